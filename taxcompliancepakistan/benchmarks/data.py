@@ -0,0 +1,244 @@
+import random
+
+import frappe
+from frappe.utils import add_days, cint, getdate
+
+# Seeded generator of benchmark data. Every record is derived from
+# (seed, kind, index) alone, so seeding is repeatable and an interrupted or
+# smaller run is topped up to the requested scale instead of starting over.
+# All master records are prefixed with BENCH- so they are easy to find and
+# never collide with real data.
+
+PREFIX = "BENCH-"
+PERIOD_START = "2025-07-01"
+PERIOD_DAYS = 365
+
+# Masters scale with the invoice count but stay bounded
+MASTER_COUNTS = {
+    "customers": lambda scale: min(max(scale // 20, 10), 5000),
+    "suppliers": lambda scale: min(max(scale // 20, 10), 5000),
+    "hs_codes": lambda scale: min(max(scale // 100, 10), 1000),
+    "items": lambda scale: min(max(scale // 20, 20), 5000),
+}
+
+# (name suffix, sales tax %, further tax %, fixed amount per unit)
+ITEM_TAX_TEMPLATES = (
+    ("ST-18", 18, 4, 0),
+    ("ST-17", 17, 3, 0),
+    ("ST-5", 5, 0, 0),
+    ("ST-18-UOM", 18, 4, 10),
+    ("ST-EXEMPT", 0, 0, 0),
+)
+
+COMMIT_EVERY = 100
+
+
+def get_rng(seed, kind, idx):
+    return random.Random(f"{seed}-{kind}-{idx}")
+
+
+def get_period(days=PERIOD_DAYS):
+    return getdate(PERIOD_START), add_days(getdate(PERIOD_START), days - 1)
+
+
+def seed_benchmark_data(company, scale=1000, seed=42, payments_per_invoice=0.1):
+    """
+    Create `scale` submitted Sales and Purchase Invoices and
+    `scale * payments_per_invoice` submitted Payment Entries for `company`,
+    along with the customers, suppliers, HS codes, Item Tax Templates and
+    items they use.
+    """
+    scale = cint(scale)
+    accounts = get_company_accounts(company)
+
+    hs_codes = make_hs_codes(MASTER_COUNTS["hs_codes"](scale))
+    templates = make_item_tax_templates(company, accounts)
+    items = make_items(MASTER_COUNTS["items"](scale), seed, hs_codes, templates)
+    wht_section = make_wht_section(accounts)
+    customers = make_parties("Customer", MASTER_COUNTS["customers"](scale), seed)
+    suppliers = make_parties("Supplier", MASTER_COUNTS["suppliers"](scale), seed, wht_section)
+    frappe.db.commit()
+
+    make_invoices("Sales Invoice", company, scale, seed, customers, items, hs_codes)
+    make_invoices("Purchase Invoice", company, scale, seed, suppliers, items, hs_codes)
+    make_payment_entries(company, int(scale * payments_per_invoice), wht_section)
+
+    from_date, to_date = get_period()
+    return frappe._dict(company=company, scale=scale, seed=seed, from_date=from_date, to_date=to_date)
+
+
+def get_company_accounts(company):
+    tax_account = frappe.db.get_value(
+        "Account", {"company": company, "account_type": "Tax", "is_group": 0}, "name"
+    )
+    if not tax_account:
+        frappe.throw(f"Company {company} needs a Tax account to seed benchmark data")
+
+    return frappe._dict(tax=tax_account)
+
+
+def make_hs_codes(count):
+    names = []
+    for i in range(count):
+        tariff_number = f"{PREFIX}{8400 + i:04d}.{i % 100:02d}00"
+        if not frappe.db.exists("Customs Tariff Number", tariff_number):
+            frappe.get_doc({
+                "doctype": "Customs Tariff Number",
+                "tariff_number": tariff_number,
+                "description": f"Benchmark goods {i}",
+                "custom_complete_description": f"{tariff_number} Benchmark goods {i}",
+            }).insert(ignore_permissions=True)
+        names.append(tariff_number)
+    return names
+
+
+def make_item_tax_templates(company, accounts):
+    names = []
+    for suffix, st_rate, further_tax_rate, fixed_amount in ITEM_TAX_TEMPLATES:
+        title = f"{PREFIX}{suffix}"
+        name = frappe.db.get_value("Item Tax Template", {"title": title, "company": company}, "name")
+        if not name:
+            doc = frappe.get_doc({
+                "doctype": "Item Tax Template",
+                "title": title,
+                "company": company,
+                "custom_allow_duplicate_accounts": 1,
+                "taxes": [
+                    {"tax_type": accounts.tax, "tax_rate": st_rate, "custom_tax_category": "Sales Tax",
+                     "custom_fixed_tax_amount": fixed_amount},
+                    {"tax_type": accounts.tax, "tax_rate": further_tax_rate, "custom_tax_category": "Further Sales Tax"},
+                ],
+            }).insert(ignore_permissions=True)
+            name = doc.name
+        names.append(name)
+    return names
+
+
+def make_items(count, seed, hs_codes, templates):
+    item_group = frappe.db.get_value("Item Group", {"is_group": 0}, "name")
+    names = []
+    for i in range(count):
+        item_code = f"{PREFIX}ITEM-{i:05d}"
+        if not frappe.db.exists("Item", item_code):
+            rng = get_rng(seed, "item", i)
+            frappe.get_doc({
+                "doctype": "Item",
+                "item_code": item_code,
+                "item_group": item_group,
+                "stock_uom": "Nos",
+                "is_stock_item": 0,
+                "customs_tariff_number": rng.choice(hs_codes),
+                "taxes": [{"item_tax_template": rng.choice(templates)}],
+            }).insert(ignore_permissions=True)
+        names.append(item_code)
+    return names
+
+
+def make_wht_section(accounts):
+    name = f"{PREFIX}153(1)(a)"
+    if not frappe.db.exists("WHT Sections", name):
+        frappe.get_doc({
+            "doctype": "WHT Sections",
+            "section_name": name,
+            "section_code": "64060001",
+            "effective_from": PERIOD_START,
+            "tax_payment_nature": "Adjustable WHT",
+            "active_tax_payer_rate": 5.5,
+            "inactive_tax_payer_rate": 11,
+            "account_head": accounts.tax,
+            "tax_receivable_account_head": accounts.tax,
+        }).insert(ignore_permissions=True)
+    return name
+
+
+def make_parties(party_type, count, seed, wht_section=None):
+    names = []
+    name_field = "customer_name" if party_type == "Customer" else "supplier_name"
+    for i in range(count):
+        name = f"{PREFIX}{party_type.upper()}-{i:05d}"
+        if not frappe.db.exists(party_type, name):
+            rng = get_rng(seed, party_type, i)
+            registered = rng.random() < 0.7
+            doc = frappe.get_doc({
+                "doctype": party_type,
+                name_field: name,
+                "tax_category": "Registered" if registered else "Unregistered",
+                "tax_id": f"{rng.randint(1000000, 9999999)}-{rng.randint(0, 9)}" if registered else None,
+                "custom_cnic_no": None if registered else f"{rng.randint(10 ** 12, 10 ** 13 - 1)}",
+            })
+            if party_type == "Supplier":
+                doc.custom_default_wht_template = wht_section
+            doc.insert(ignore_permissions=True, set_name=name)
+        names.append(name)
+    return names
+
+
+def make_invoices(doctype, company, count, seed, parties, items, hs_codes):
+    party_field = "customer" if doctype == "Sales Invoice" else "supplier"
+    existing = frappe.db.count(doctype, {"company": company, party_field: ["like", f"{PREFIX}%"], "docstatus": 1})
+    from_date, _to_date = get_period()
+
+    for i in range(existing, count):
+        rng = get_rng(seed, doctype, i)
+        posting_date = add_days(from_date, rng.randrange(PERIOD_DAYS))
+        invoice = frappe.get_doc({
+            "doctype": doctype,
+            "company": company,
+            party_field: rng.choice(parties),
+            "set_posting_time": 1,
+            "posting_date": posting_date,
+            "due_date": add_days(posting_date, 30),
+            "custom_sales_tax_invoice": 1,
+            "items": [
+                {
+                    "item_code": rng.choice(items),
+                    "qty": rng.randint(1, 50),
+                    "rate": round(rng.uniform(100, 50000), 2),
+                    "custom_hs_code": rng.choice(hs_codes),
+                }
+                for _row in range(rng.randint(1, 8))
+            ],
+        })
+        if doctype == "Purchase Invoice":
+            invoice.bill_no = f"{PREFIX}{i:07d}"
+            invoice.custom_purchase_invoice_type = "Local Purchase"
+        else:
+            invoice.custom_customer_st_status = rng.choice(("Registered", "Unregistered"))
+
+        invoice.insert(ignore_permissions=True)
+        invoice.submit()
+
+        if (i + 1) % COMMIT_EVERY == 0:
+            frappe.db.commit()
+
+    frappe.db.commit()
+
+
+def make_payment_entries(company, count, wht_section):
+    from erpnext.accounts.doctype.payment_entry.payment_entry import get_payment_entry
+
+    existing = frappe.db.count(
+        "Payment Entry", {"company": company, "party": ["like", f"{PREFIX}%"], "docstatus": 1}
+    )
+    invoices = frappe.get_all(
+        "Purchase Invoice",
+        filters={"company": company, "supplier": ["like", f"{PREFIX}%"], "docstatus": 1, "outstanding_amount": [">", 0]},
+        order_by="posting_date asc, name asc",
+        pluck="name",
+        limit=max(count - existing, 0),
+    )
+
+    for i, invoice in enumerate(invoices):
+        payment_entry = get_payment_entry("Purchase Invoice", invoice)
+        payment_entry.reference_no = f"{PREFIX}{invoice}"
+        payment_entry.reference_date = payment_entry.posting_date
+        payment_entry.custom_party_fbr_status = "Active"
+        for ref in payment_entry.references:
+            ref.custom_wht_section = wht_section
+        payment_entry.insert(ignore_permissions=True)
+        payment_entry.submit()
+
+        if (i + 1) % COMMIT_EVERY == 0:
+            frappe.db.commit()
+
+    frappe.db.commit()
@@ -0,0 +1,184 @@
+import json
+import platform
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+import frappe
+from frappe.utils import cint, now
+
+from taxcompliancepakistan.benchmarks.data import PREFIX, get_period
+
+# Timed scenarios over seeded data (see benchmarks.data). Each scenario
+# records wall time, query count and peak Python memory; results are written
+# to JSON so two versions of the app can be compared with compare_results.
+#
+# Hook scenarios run over a sample of documents, so their per-call numbers
+# show how the hooks behave at the seeded database size. Report scenarios
+# run over the whole seeded period.
+
+
+@contextmanager
+def measure(result):
+    """
+    Fill `result` with the wall time, query count and peak traced memory of
+    the block. Memory tracing adds the same overhead to every run, so times
+    stay comparable between versions.
+    """
+    sql = frappe.db.sql
+    query_count = 0
+
+    def counted_sql(*args, **kwargs):
+        nonlocal query_count
+        query_count += 1
+        return sql(*args, **kwargs)
+
+    frappe.db.sql = counted_sql
+    tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        yield result
+    finally:
+        result["wall_time"] = round(time.perf_counter() - start, 4)
+        result["peak_memory_kb"] = round(tracemalloc.get_traced_memory()[1] / 1024, 1)
+        tracemalloc.stop()
+        frappe.db.sql = sql
+        result["queries"] = query_count
+
+
+def get_sample(doctype, company, party_field, sample_size):
+    return [
+        frappe.get_doc(doctype, name)
+        for name in frappe.get_all(
+            doctype,
+            filters={"company": company, party_field: ["like", f"{PREFIX}%"], "docstatus": 1},
+            order_by="posting_date asc, name asc",
+            pluck="name",
+            limit=sample_size,
+        )
+    ]
+
+
+def bench_sales_invoice_on_update(company, filters, sample_size):
+    from taxcompliancepakistan.utilities.tax_overrides import sales_invoice_on_update
+
+    invoices = get_sample("Sales Invoice", company, "customer", sample_size)
+    # Saved invoices match their stored fingerprint and would skip the
+    # rebuild; clear it so the scenario times the summary, not the hash
+    for invoice in invoices:
+        invoice.custom_tax_fingerprint = None
+    result = {"iterations": len(invoices)}
+    with measure(result):
+        for invoice in invoices:
+            sales_invoice_on_update(invoice)
+    return result
+
+
+def bench_on_payment_entry_update(company, filters, sample_size):
+    from taxcompliancepakistan.utilities.wht_overrides import on_payment_entry_update
+
+    payment_entries = get_sample("Payment Entry", company, "party", sample_size)
+    result = {"iterations": len(payment_entries)}
+    with measure(result):
+        for payment_entry in payment_entries:
+            on_payment_entry_update(payment_entry, "validate")
+    return result
+
+
+def bench_payment_entry_build_gl_map(company, filters, sample_size):
+    from taxcompliancepakistan.utilities.tax_overrides import payment_entry_build_gl_map
+
+    payment_entries = get_sample("Payment Entry", company, "party", sample_size)
+    result = {"iterations": len(payment_entries)}
+    with measure(result):
+        for payment_entry in payment_entries:
+            payment_entry_build_gl_map(payment_entry)
+    return result
+
+
+def bench_annex_a(company, filters, sample_size):
+    from taxcompliancepakistan.taxcompliancepakistan.report.annex_a import annex_a
+
+    result = {"iterations": 1}
+    with measure(result):
+        result["rows"] = len(annex_a.execute(frappe._dict(filters))[1])
+    return result
+
+
+def bench_annex_c(company, filters, sample_size):
+    from taxcompliancepakistan.taxcompliancepakistan.report.annex_c import annex_c
+
+    result = {"iterations": 1}
+    with measure(result):
+        result["rows"] = len(annex_c.execute(frappe._dict(filters))[1])
+    return result
+
+
+SCENARIOS = {
+    "sales_invoice_on_update": bench_sales_invoice_on_update,
+    "on_payment_entry_update": bench_on_payment_entry_update,
+    "payment_entry_build_gl_map": bench_payment_entry_build_gl_map,
+    "annex_a.execute": bench_annex_a,
+    "annex_c.execute": bench_annex_c,
+}
+
+
+def run_benchmarks(company, scale, output=None, scenarios=None, sample_size=200):
+    """
+    Run the named scenarios (all by default) against seeded data and return
+    the results, writing them to `output` as JSON when given.
+    """
+    from taxcompliancepakistan import __version__
+
+    from_date, to_date = get_period()
+    filters = {"company": company, "from_date": from_date, "to_date": to_date}
+
+    results = []
+    for name in scenarios or SCENARIOS:
+        result = SCENARIOS[name](company, filters, cint(sample_size))
+        result["scenario"] = name
+        if result["iterations"]:
+            result["wall_time_per_iteration"] = round(result["wall_time"] / result["iterations"], 6)
+            result["queries_per_iteration"] = round(result["queries"] / result["iterations"], 2)
+        results.append(result)
+
+        # Hooks change documents in memory only; never keep anything they wrote
+        frappe.db.rollback()
+
+    report = {
+        "app_version": __version__,
+        "frappe_version": frappe.__version__,
+        "python_version": platform.python_version(),
+        "site": frappe.local.site,
+        "company": company,
+        "scale": cint(scale),
+        "sample_size": cint(sample_size),
+        "timestamp": now(),
+        "results": results,
+    }
+
+    if output:
+        with open(output, "w") as f:
+            json.dump(report, f, indent=2, default=str)
+
+    return report
+
+
+def compare_results(baseline, current):
+    """
+    Return one row per scenario with the ratio current / baseline of wall
+    time, query count and peak memory. Ratios above 1 are regressions.
+    """
+    baseline_results = {r["scenario"]: r for r in baseline["results"]}
+
+    rows = []
+    for result in current["results"]:
+        before = baseline_results.get(result["scenario"])
+        if not before:
+            continue
+
+        row = {"scenario": result["scenario"]}
+        for metric in ("wall_time", "queries", "peak_memory_kb"):
+            row[metric] = round(result[metric] / before[metric], 2) if before[metric] else None
+        rows.append(row)
+    return rows
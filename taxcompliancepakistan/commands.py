@@ -0,0 +1,214 @@
+import click
+from frappe.commands import get_site, pass_context
+
+# Bench commands provided by this app, e.g.
+# bench --site mysite rebuild-tax-ledger --company "My Company" --from-date 2025-07-01 --to-date 2025-09-30
+
+
+@click.command("rebuild-tax-ledger")
+@click.option("--company", required=True, help="Company to rebuild the ledger for")
+@click.option("--from-date", required=True, help="First posting date to rebuild")
+@click.option("--to-date", required=True, help="Last posting date to rebuild")
+@pass_context
+def rebuild_tax_ledger(context, company, from_date, to_date):
+    """Rebuild FBR Tax Ledger Entries from submitted invoices"""
+    import frappe
+    from taxcompliancepakistan.utilities.tax_ledger import rebuild_tax_ledger as rebuild
+
+    site = get_site(context)
+    frappe.init(site=site)
+    frappe.connect()
+    try:
+        rebuild(company, from_date, to_date)
+        click.echo(f"FBR Tax Ledger rebuilt for {company} from {from_date} to {to_date}")
+    finally:
+        frappe.destroy()
+
+
+@click.command("build-item-tax-rate-index")
+@pass_context
+def build_item_tax_rate_index(context):
+    """Build the item to tax rate index in redis"""
+    import frappe
+    from taxcompliancepakistan.utilities.tax_cache import build_item_tax_rate_index as build
+
+    site = get_site(context)
+    frappe.init(site=site)
+    frappe.connect()
+    try:
+        build()
+        click.echo("Item tax rate index built")
+    finally:
+        frappe.destroy()
+
+
+@click.command("check-tax-indexes")
+@click.option("--company", help="Company to plan the report queries for")
+@click.option("--from-date", help="First posting date of the report period")
+@click.option("--to-date", help="Last posting date of the report period")
+@pass_context
+def check_tax_indexes(context, company=None, from_date=None, to_date=None):
+    """Create missing tax indexes and print EXPLAIN plans of the Annex and WHT queries"""
+    import frappe
+    from taxcompliancepakistan.utilities.app_install_hooks import create_tax_indexes, get_query_plans
+
+    site = get_site(context)
+    frappe.init(site=site)
+    frappe.connect()
+    try:
+        missing = create_tax_indexes()
+        if missing:
+            click.secho(f"Missing indexes: {', '.join(missing)}", fg="red")
+
+        for title, plan in get_query_plans(company, from_date, to_date).items():
+            click.echo(f"\n{title}")
+            for row in plan:
+                full_scan = row.get("type") == "ALL"
+                click.secho(
+                    "  {table}: type={type} key={key} rows={rows} {extra}".format(
+                        table=row.get("table"), type=row.get("type"), key=row.get("key"),
+                        rows=row.get("rows"), extra=row.get("Extra") or "",
+                    ),
+                    fg="red" if full_scan else None,
+                )
+    finally:
+        frappe.destroy()
+
+
+@click.command("seed-tax-benchmark")
+@click.option("--company", required=True, help="Company to create benchmark documents for")
+@click.option("--scale", type=click.Choice(["1000", "10000", "100000"]), default="1000", help="Number of invoices")
+@click.option("--seed", type=int, default=42, help="Random seed of the generator")
+@pass_context
+def seed_tax_benchmark(context, company, scale, seed):
+    """Create seeded customers, suppliers, items, invoices and payments to benchmark against"""
+    import frappe
+    from taxcompliancepakistan.benchmarks.data import seed_benchmark_data
+
+    site = get_site(context)
+    frappe.init(site=site)
+    frappe.connect()
+    try:
+        seed_benchmark_data(company, int(scale), seed)
+        click.echo(f"Benchmark data seeded for {company} at scale {scale}")
+    finally:
+        frappe.destroy()
+
+
+@click.command("run-tax-benchmark")
+@click.option("--company", required=True, help="Company the benchmark data was seeded for")
+@click.option("--scale", type=click.Choice(["1000", "10000", "100000"]), default="1000", help="Seeded scale")
+@click.option("--output", required=True, help="JSON file to write the results to")
+@click.option("--scenario", multiple=True, help="Scenario to run, all when not given")
+@click.option("--sample-size", type=int, default=200, help="Documents per hook scenario")
+@click.option("--compare", help="Earlier results JSON to compare against")
+@pass_context
+def run_tax_benchmark(context, company, scale, output, scenario=None, sample_size=200, compare=None):
+    """Time invoice, payment and Annex report scenarios and write the results as JSON"""
+    import json
+
+    import frappe
+    from taxcompliancepakistan.benchmarks.runner import compare_results, run_benchmarks
+
+    site = get_site(context)
+    frappe.init(site=site)
+    frappe.connect()
+    try:
+        report = run_benchmarks(company, int(scale), output, scenario or None, sample_size)
+        for result in report["results"]:
+            click.echo(
+                "{scenario}: {wall_time}s, {queries} queries, {peak_memory_kb} KB peak".format(**result)
+            )
+
+        if compare:
+            with open(compare) as f:
+                baseline = json.load(f)
+            click.echo("\nCompared with {0} (current / baseline)".format(compare))
+            for row in compare_results(baseline, report):
+                click.echo("{scenario}: time x{wall_time}, queries x{queries}, memory x{peak_memory_kb}".format(**row))
+    finally:
+        frappe.destroy()
+
+
+@click.command("sharded-annex")
+@click.option("--report", "report_name", type=click.Choice(["Annex A", "Annex C"]), required=True)
+@click.option("--company", "companies", multiple=True, required=True, help="Company to include, repeatable")
+@click.option("--from-date", required=True, help="First posting date of the report")
+@click.option("--to-date", required=True, help="Last posting date of the report")
+@click.option("--output", required=True, help="File to write, .csv or .xlsx")
+@click.option("--processes", type=int, help="Worker processes, defaults to the CPU count")
+@click.option("--use-tax-ledger", is_flag=True, help="Read from the FBR Tax Ledger")
+@pass_context
+def sharded_annex(context, report_name, companies, from_date, to_date, output, processes=None, use_tax_ledger=False):
+    """Build an Annex report per company and month in parallel and merge the result"""
+    import frappe
+    from taxcompliancepakistan.utilities.annex_shards import run_sharded_annex_locally
+
+    site = get_site(context)
+    frappe.init(site=site)
+    frappe.connect()
+    try:
+        filters = {"from_date": from_date, "to_date": to_date, "use_tax_ledger": int(use_tax_ledger)}
+        row_count, report_summary = run_sharded_annex_locally(
+            report_name, filters, list(companies), output, processes,
+            on_progress=lambda done, total: click.echo(f"{done}/{total} shards done"),
+        )
+
+        click.echo(f"{row_count} rows written to {output}")
+        for summary in report_summary:
+            click.echo("{label}: {value}".format(**summary))
+    finally:
+        frappe.destroy()
+
+
+@click.command("import-active-taxpayer-list")
+@click.argument("file_path")
+@click.option("--identifier-column", help="Header of the NTN/CNIC column, detected when not given")
+@pass_context
+def import_active_taxpayer_list(context, file_path, identifier_column=None):
+    """Import an FBR Active Taxpayer List CSV into a new ATL snapshot"""
+    import frappe
+    from taxcompliancepakistan.utilities.atl_index import import_active_taxpayer_list as import_atl
+
+    site = get_site(context)
+    frappe.init(site=site)
+    frappe.connect()
+    try:
+        info = import_atl(file_path, identifier_column)
+        click.echo(f"{info['count']} taxpayers imported into snapshot {info['version']}")
+    finally:
+        frappe.destroy()
+
+
+@click.command("rerate-wht")
+@click.option("--section", "sections", multiple=True, required=True, help="WHT Section whose rates changed, repeatable")
+@click.option("--apply", "apply_changes", is_flag=True, help="Write the new WHT, otherwise only report the diff")
+@pass_context
+def rerate_wht(context, sections, apply_changes=False):
+    """Re-rate draft Payment Entries after WHT Section rates change"""
+    import frappe
+    from taxcompliancepakistan.utilities.wht_rerating import rerate_wht as run_rerating
+
+    site = get_site(context)
+    frappe.init(site=site)
+    frappe.connect()
+    try:
+        summary = run_rerating(list(sections), dry_run=not apply_changes)
+        click.echo(
+            f"{summary['changed']} of {summary['checked']} draft Payment Entries "
+            f"{'re-rated' if apply_changes else 'would change'}; diff: {summary['file_url']}"
+        )
+    finally:
+        frappe.destroy()
+
+
+commands = [
+    rebuild_tax_ledger,
+    build_item_tax_rate_index,
+    check_tax_indexes,
+    seed_tax_benchmark,
+    run_tax_benchmark,
+    sharded_annex,
+    import_active_taxpayer_list,
+    rerate_wht,
+]
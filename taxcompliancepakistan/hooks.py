@@ -32,6 +32,9 @@ doctype_js = {
     "Purchase Invoice": "public/js/js_overrides/purchase_invoice.js",
     "Sales Invoice": "public/js/js_overrides/sales_invoice.js"
 }
+doctype_list_js = {
+    "Payment Entry": "public/js/js_overrides/payment_entry_list.js"
+}
 
 # include js, css files in header of web template
 # web_include_css = "/assets/taxcompliancepakistan/css/taxcompliancepakistan.css"
@@ -96,6 +99,11 @@ doctype_js = {
 # before_uninstall = "taxcompliancepakistan.uninstall.before_uninstall"
 # after_uninstall = "taxcompliancepakistan.uninstall.after_uninstall"
 
+# Migration
+# ------------
+
+after_migrate = "taxcompliancepakistan.utilities.app_install_hooks.after_migrate"
+
 # Integration Setup
 # ------------------
 # To set up dependencies/integrations with other apps
@@ -150,18 +158,48 @@ doctype_js = {
 # 	}
 # }
 
-# TODO: Remove this once we have a proper solution for purchase invoice, 
-# as calculations should come from js code not from backend, 
-# in purchase data entry manual adjustments required due to rounding off diff with suppliers
+# Invoice tax summaries are rebuilt on validate only when a header or item
+# field they depend on changed (see tax_overrides.update_invoice_tax_summary).
+# Tax rows adjusted by hand, e.g. for rounding differences with suppliers, are
+# kept until then, rows outside the item summary are always kept, and manual
+# ST entered on purchase items is carried into the summary
 doc_events = {
     "Sales Invoice": {
-        "on_save": "taxcompliancepakistan.utilities.tax_overrides.sales_invoice_on_update"
+        "validate": "taxcompliancepakistan.utilities.tax_overrides.sales_invoice_on_update",
+        "on_submit": "taxcompliancepakistan.utilities.tax_ledger.on_invoice_submit",
+        "on_cancel": "taxcompliancepakistan.utilities.tax_ledger.on_invoice_cancel"
+    },
+    "Purchase Invoice": {
+        "validate": "taxcompliancepakistan.utilities.tax_overrides.purchase_invoice_on_update",
+        "on_submit": "taxcompliancepakistan.utilities.tax_ledger.on_invoice_submit",
+        "on_cancel": "taxcompliancepakistan.utilities.tax_ledger.on_invoice_cancel"
     },
-    #"Purchase Invoice": {
-     #   "on_update": "taxcompliancepakistan.utilities.tax_overrides.purchase_invoice_on_update"
-    #},
     "Payment Entry": {
         "on_update": "taxcompliancepakistan.utilities.wht_overrides.on_payment_entry_update"
+    },
+    "Company": {
+        "on_update": "taxcompliancepakistan.utilities.tax_cache.clear_company_tax_profile",
+        "on_trash": "taxcompliancepakistan.utilities.tax_cache.clear_company_tax_profile"
+    },
+    "Sales Taxes and Charges Template": {
+        "on_update": "taxcompliancepakistan.utilities.tax_cache.clear_template_advance_tax",
+        "on_trash": "taxcompliancepakistan.utilities.tax_cache.clear_template_advance_tax"
+    },
+    "Purchase Taxes and Charges Template": {
+        "on_update": "taxcompliancepakistan.utilities.tax_cache.clear_template_advance_tax",
+        "on_trash": "taxcompliancepakistan.utilities.tax_cache.clear_template_advance_tax"
+    },
+    "Item": {
+        "on_update": "taxcompliancepakistan.utilities.tax_cache.clear_item_tax_rates",
+        "on_trash": "taxcompliancepakistan.utilities.tax_cache.clear_item_tax_rates"
+    },
+    "Item Group": {
+        "on_update": "taxcompliancepakistan.utilities.tax_cache.clear_item_group_tax_rates",
+        "on_trash": "taxcompliancepakistan.utilities.tax_cache.clear_item_group_tax_rates"
+    },
+    "Item Tax Template": {
+        "on_update": "taxcompliancepakistan.utilities.tax_cache.clear_item_tax_template_rates",
+        "on_trash": "taxcompliancepakistan.utilities.tax_cache.clear_item_tax_template_rates"
     }
 }
 
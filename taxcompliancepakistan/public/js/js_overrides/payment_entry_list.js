@@ -0,0 +1,62 @@
+// Adds batch Payment Advice printing to ERPNext's Payment Entry list
+// settings, keeping whatever onload they already define.
+frappe.listview_settings["Payment Entry"] = frappe.listview_settings["Payment Entry"] || {};
+
+(function(settings) {
+    const onload = settings.onload;
+
+    settings.onload = function(listview) {
+        if (onload) {
+            onload(listview);
+        }
+
+        listview.page.add_actions_menu_item(__("Print Payment Advices"), function() {
+            const names = listview.get_checked_items(true);
+            frappe.prompt({
+                "fieldname": "output",
+                "label": __("Output"),
+                "fieldtype": "Select",
+                "options": [
+                    {"value": "merged", "label": __("One merged PDF")},
+                    {"value": "zip", "label": __("Zip of PDFs")},
+                    {"value": "attach", "label": __("Attach PDF to each Payment Entry")}
+                ],
+                "default": "merged",
+                "reqd": 1
+            }, function(values) {
+                frappe.call({
+                    method: "taxcompliancepakistan.utilities.payment_advice.enqueue_payment_advices",
+                    args: {
+                        names: names,
+                        output: values.output
+                    },
+                    callback: function(r) {
+                        if (!r.message) {
+                            return;
+                        }
+                        const run_id = r.message.run_id;
+                        frappe.show_progress(__("Payment Advices"), 0, r.message.total, __("Queued"));
+                        // One listener per list view, following the latest run
+                        if (listview.__advice_progress_handler) {
+                            frappe.realtime.off("payment_advice_progress", listview.__advice_progress_handler);
+                        }
+                        listview.__advice_progress_handler = function handler(data) {
+                            if (data.run_id !== run_id) {
+                                return;
+                            }
+                            if (data.failed || data.done === data.total) {
+                                frappe.hide_progress();
+                                frappe.realtime.off("payment_advice_progress", handler);
+                                listview.__advice_progress_handler = null;
+                                return;
+                            }
+                            frappe.show_progress(__("Payment Advices"), data.done, data.total,
+                                __("{0} of {1} rendered", [data.done, data.total]));
+                        };
+                        frappe.realtime.on("payment_advice_progress", listview.__advice_progress_handler);
+                    }
+                });
+            }, __("Print Payment Advices"));
+        });
+    };
+})(frappe.listview_settings["Payment Entry"]);
@@ -5,32 +5,27 @@ tax purposes, this will calculate ST,AT, Further Tax and any other taxes as per
 All tax calculation functions are defined in taxation.js which is loaded globally.
 */
 
-// Track manual override mode to prevent re-calculation loops
-let manual_override_in_progress = false;
-
+// Row events are coalesced per form by the scheduler in taxation.js, which
+// also keeps a manually typed ST or ST rate from being recalculated away
 frappe.ui.form.on("Purchase Invoice Item", {
     
     
     item_code: function(frm, cdt, cdn) {
-        if (manual_override_in_progress) return;
         const row = locals[cdt][cdn];
         calculate_taxes(frm, row);
     },
     
     qty: function(frm, cdt, cdn) {
-        if (manual_override_in_progress) return;
         const row = locals[cdt][cdn];
         calculate_taxes(frm, row);
     },
     
     rate: function(frm, cdt, cdn) {
-        if (manual_override_in_progress) return;
         const row = locals[cdt][cdn];
         calculate_taxes(frm, row);
     },
     
     discount_percentage: function(frm, cdt, cdn) {
-        if (manual_override_in_progress) return;
         const row = locals[cdt][cdn];
         calculate_taxes(frm, row);
     },
@@ -39,30 +34,14 @@ frappe.ui.form.on("Purchase Invoice Item", {
         const row = locals[cdt][cdn];
         console.log(`[custom_st_rate] User manually changed ST Rate to: ${row.custom_st_rate}`);
         
-        // Set flag to prevent other events from interfering
-        manual_override_in_progress = true;
-        
         calculate_taxes(frm, row, "custom_st_rate");
-        
-        // Reset flag after a delay
-        setTimeout(() => {
-            manual_override_in_progress = false;
-        }, 50);
     },
 
     custom_st: function(frm, cdt, cdn) {
         const row = locals[cdt][cdn];
         console.log(`[custom_st] User manually changed ST Amount to: ${row.custom_st}`);
         
-        // Set flag to prevent other events from interfering
-        manual_override_in_progress = true;
-        
         calculate_taxes(frm, row, "custom_st");
-        
-        // Reset flag after a delay
-        setTimeout(() => {
-            manual_override_in_progress = false;
-        }, 50);
     }
 });
 
@@ -72,7 +51,11 @@ frappe.ui.form.on("Purchase Invoice Item", {
 
 frappe.ui.form.on("Purchase Invoice", {
     custom_tax_template: function(frm) {
-        apply_tax_summary(frm);
+        recalculate_all_taxes(frm);
+    },
+
+    items_remove: function(frm, cdt, cdn) {
+        remove_tax_row(frm, cdn);
     }
 });
 
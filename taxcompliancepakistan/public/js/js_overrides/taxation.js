@@ -3,546 +3,351 @@ This will override erpnext default Purchase Invoice Item. We need a set pattern
 tax purposes, this will calculate ST,AT, Further Tax and any other taxes as per needs.
 */
 
-function get_company_tax_accounts(company_name, callback) {
-    frappe.call({
-        method: "frappe.client.get",
-        args: {
-            doctype: "Company",
-            name: company_name
-        },
-        callback: function(res) {
-            if (res.message) {
-                callback({
-                    sales_tax_account: res.message.custom_vat_input || "",
-                    further_tax_account: res.message.custom_further_sales_tax_account || "" // Same as ST
-                });
-            } else {
-                callback({});
-            }
-        }
-    });
+function getMultiplier(frm){
+    
+    let multiplier = 1;
+    if (frm.doc.is_return === 1){
+        multiplier = -1
+    }
+    
+    return multiplier;
 }
 
-function calculate_row_tax_totals(frm) {
-    let total_st = 0;
-    let total_further_tax = 0;
-    let total_inclusive = 0;
-    let precision = frappe.boot.sysdefaults.currency_precision || 2;
-    
-    (frm.doc.items || []).forEach(row => {
-        total_st += flt(row.custom_st || 0,precision);
-        total_further_tax += flt(row.custom_further_tax || 0,precision);
-        total_inclusive += flt(row.custom_total_incl_tax || 0,precision);
-    });
+function get_tax_header_key(frm) {
+    // Changes to any of these invalidate the running totals
+    return [
+        frm.doc.company,
+        frm.doc.is_return,
+        frm.doc.custom_tax_template,
+        frm.doc.custom_customer_st_status,
+        frm.doc.custom_supplier_st_status,
+        frm.doc.custom_sales_tax_invoice
+    ].join("|");
+}
 
-    console.log(`[calculate_row_tax_totals] Total ST: ${total_st}, Total Further Tax: ${total_further_tax}, Total Inclusive: ${total_inclusive}`);
-    console.log(`[calculate_row_tax_totals] Item details:`, frm.doc.items.map(item => ({
-        item_code: item.item_code,
-        custom_st: item.custom_st,
-        custom_further_tax: item.custom_further_tax,
-        custom_total_incl_tax: item.custom_total_incl_tax
-    })));
-    
-    return { total_st, total_further_tax, total_inclusive };
+function can_update_incrementally(frm) {
+    // The running totals must cover exactly the current rows; comparing
+    // counts alone misses a row removed and another added
+    const state = frm.__tax_state;
+    if (!state || state.header_key !== get_tax_header_key(frm)) {
+        return false;
+    }
+    const items = frm.doc.items || [];
+    return items.length === Object.keys(state.rows).length
+        && items.every(row => Object.prototype.hasOwnProperty.call(state.rows, row.name));
 }
 
-function fetch_item_tax_template(row, callback) {
-    if (row.item_tax_template) {
-        console.log(`Returning item_tax_template directly: ${row.item_tax_template}`);
-        callback(row.item_tax_template);
-    } else {
-        // Access it from the item group
-        console.log(`Fetching item group for: ${row.item_group}`);
-        frappe.call({
-            method: "frappe.client.get",
-            args: {
-                doctype: "Item Group",
-                name: row.item_group
-            },
-            callback: function(response) {
-                console.log(`Response from item group fetch:`, response);
-                if (response.message) {
-                    const taxes = response.message.taxes || []; // Assuming taxes is the child table field
-                    console.log(`Taxes found:`, taxes);
-                    
-                    if (taxes.length > 0) {
-                        const salesTaxEntry = taxes[0]; // Assuming the first entry is relevant
-                        console.log(`Found sales tax entry:`, salesTaxEntry);
-                        
-                        if (salesTaxEntry.item_tax_template) {
-                            console.log(`Sales tax template in entry is ${salesTaxEntry.item_tax_template}`);
-                            callback(salesTaxEntry.item_tax_template);
-                        } else {
-                            callback(null);
-                        }
-                    } else {
-                        callback(null);
-                    }
-                } else {
-                    callback(null);
-                }
-            }
-        });
+function recalculate_all_taxes(frm) {
+    // The rate basis comes from the tax template, so changing it rates every
+    // row again and rebuilds the summary from the full result
+    frm.__tax_state = null;
+    (frm.doc.items || []).forEach(row => calculate_taxes(frm, row));
+}
+
+function remove_tax_row(frm, cdn) {
+    // Called from the items_remove event: take the removed row out of the
+    // running totals so its tax does not stay in the summary
+    get_tax_scheduler(frm).dirty.delete(cdn);
+
+    const state = frm.__tax_state;
+    if (!state || !state.rows[cdn]) {
+        return;
+    }
+    if (state.header_key !== get_tax_header_key(frm)) {
+        frm.__tax_state = null;
+        return;
     }
+
+    const previous = state.rows[cdn];
+    state.totals.st -= previous.st;
+    state.totals.further_tax -= previous.further_tax;
+    state.totals.inclusive -= previous.inclusive;
+    delete state.rows[cdn];
+
+    update_item_level_tax_rows(frm, state);
 }
 
+// Row events only mark rows dirty. Dirty rows are sent together in one
+// server call once editing pauses (and the browser is idle), so pasting or
+// editing many rows costs one rate fetch and one summary rebuild.
+const TAX_RECALC_DELAY = 80;
 
-function get_advance_tax_from_template(template_name, callback) {
-    // Skip API call if no template is provided
-    if (!template_name) {
-        callback({
-            advance_tax_rate: 0,
-            advance_tax_account: ""
-        });
+function calculate_taxes(frm, row, manual_override_field) {
+    if (frm.doc.custom_purchase_invoice_type === "Import") {
         return;
     }
 
-    // Determine correct template doctype based on parent document
-    let template_doctype = "Purchase Taxes and Charges Template";
-    if (cur_frm.doc.doctype === "Sales Invoice") {
-        template_doctype = "Sales Taxes and Charges Template";
+    const scheduler = get_tax_scheduler(frm);
+
+    // A value the user typed wins over events fired for the same row
+    // before the next flush
+    if (manual_override_field || !scheduler.dirty.has(row.name)) {
+        scheduler.dirty.set(row.name, manual_override_field || scheduler.dirty.get(row.name) || null);
+    }
+
+    clearTimeout(scheduler.timer);
+    scheduler.timer = setTimeout(() => {
+        const run = () => flush_tax_calculation(frm);
+        window.requestIdleCallback ? window.requestIdleCallback(run, { timeout: 200 }) : requestAnimationFrame(run);
+    }, TAX_RECALC_DELAY);
+}
+
+
+function get_tax_scheduler(frm) {
+    if (!frm.__tax_scheduler || frm.__tax_scheduler.docname !== frm.doc.name) {
+        frm.__tax_scheduler = {
+            docname: frm.doc.name,
+            dirty: new Map(),
+            timer: null,
+            seq: 0,
+            in_flight: null
+        };
+    }
+    return frm.__tax_scheduler;
+}
+
+
+function flush_tax_calculation(frm) {
+    const scheduler = get_tax_scheduler(frm);
+
+    // A newer edit supersedes the request in flight: cancel it and send its
+    // rows again with the new ones
+    if (scheduler.in_flight) {
+        scheduler.in_flight.rows.forEach((field, name) => {
+            if (!scheduler.dirty.get(name)) {
+                scheduler.dirty.set(name, field);
+            }
+        });
+        if (scheduler.in_flight.request && scheduler.in_flight.request.abort) {
+            scheduler.in_flight.request.abort();
+        }
+        scheduler.in_flight = null;
+    }
+
+    const item_names = new Set((frm.doc.items || []).map(d => d.name));
+    const rows = new Map([...scheduler.dirty].filter(([name]) => item_names.has(name)));
+    scheduler.dirty = new Map();
+    if (!rows.size) {
+        return;
     }
 
-    frappe.call({
-        method: "frappe.client.get",
+    const manual_overrides = {};
+    rows.forEach((field, name) => {
+        if (field) {
+            manual_overrides[name] = field;
+        }
+    });
+
+    // When the header is unchanged only the edited rows come back and the
+    // summary is adjusted by their delta, otherwise the server returns the
+    // full summary as well
+    const seq = ++scheduler.seq;
+    const request = frappe.call({
+        method: "taxcompliancepakistan.utilities.tax_overrides.calculate_invoice_taxes",
         args: {
-            doctype: template_doctype,
-            name: template_name
+            doc: frm.doc,
+            rows: [...rows.keys()],
+            manual_overrides: manual_overrides,
+            incremental: can_update_incrementally(frm) ? 1 : 0
         },
-        callback: function(res) {
-            if (res.message && res.message.taxes) {
-                let advance_tax_account = "";
-                let advance_tax_rate = 0;
-
-                res.message.taxes.forEach(tax => {
-                    if (tax.custom_tax_category === "236G") {
-                        advance_tax_rate = flt(tax.rate || 0);
-                        advance_tax_account = tax.account_head || "";
-                    }
-                });
-
-                callback({
-                    advance_tax_rate,
-                    advance_tax_account
-                });
+        callback: function(r) {
+            if (seq !== scheduler.seq) {
+                return;
+            }
+            scheduler.in_flight = null;
+
+            if (!r.message || r.message.skipped) {
+                return;
+            }
+            if (r.message.incremental && can_update_incrementally(frm)) {
+                apply_incremental_tax_result(frm, r.message);
+            } else if (r.message.incremental) {
+                // Header changed while the request was in flight
+                rows.forEach((field, name) => calculate_taxes(frm, { name: name }, field));
             } else {
-                callback({
-                    advance_tax_rate: 0,
-                    advance_tax_account: ""
-                });
+                apply_invoice_tax_result(frm, r.message);
             }
-        },
-        error: function(err) {
-            console.warn("Advance tax template fetch failed:", err);
-            callback({
-                advance_tax_rate: 0,
-                advance_tax_account: ""
-            });
         }
     });
+    scheduler.in_flight = { seq: seq, rows: rows, request: request };
 }
 
 
-function getMultiplier(frm){
-    
-    let multiplier = 1;
-    if (frm.doc.is_return === 1){
-        multiplier = -1
-    }
-    
-    return multiplier;
-}
+function apply_invoice_tax_result(frm, result) {
+    // Update item level tax fields
+    (result.items || []).forEach(item => {
+        const row = (frm.doc.items || []).find(d => d.name === item.name);
+        if (row) {
+            Object.assign(row, item);
+        }
+    });
+    frm.refresh_field("items");
+
+    // Reset running totals from the full result
+    const state = {
+        header_key: get_tax_header_key(frm),
+        context: result.summary_context || {},
+        totals: { st: 0, further_tax: 0, inclusive: 0 },
+        rows: {}
+    };
+    (frm.doc.items || []).forEach(row => {
+        const values = get_row_tax_snapshot(row);
+        state.rows[row.name] = values;
+        state.totals.st += values.st;
+        state.totals.further_tax += values.further_tax;
+        state.totals.inclusive += values.inclusive;
+    });
+    frm.__tax_state = state;
 
-function apply_tax_summary(frm) {
-    console.log(`[apply_tax_summary] Starting tax summary calculation`);
-    const { total_st, total_further_tax, total_inclusive } = calculate_row_tax_totals(frm);
-
-    get_company_tax_accounts(frm.doc.company, (accounts) => {
-        get_advance_tax_from_template(frm.doc.custom_tax_template, (advance) => {
-            
-            // Preserve manually added 236G rows for Purchase Invoice
-            let preserved_236g_rows = [];
-            if (frm.doc.doctype === "Purchase Invoice") {
-                (frm.doc.taxes || []).forEach(tax => {
-                    if (tax.custom_tax_category === "236G" || tax.tax_category === "236G") {
-                        preserved_236g_rows.push({
-                            charge_type: tax.charge_type,
-                            account_head: tax.account_head,
-                            description: tax.description,
-                            tax_amount: tax.tax_amount,
-                            custom_tax_category: tax.custom_tax_category,
-                            tax_category: tax.tax_category,
-                            cost_center: tax.cost_center,
-                            rate: tax.rate
-                        });
-                    }
-                });
-            }
-            
-            // Clear old tax rows
-            frm.clear_table("taxes");
-
-            if (total_st && accounts.sales_tax_account) {
-                let row = frm.add_child("taxes");
-                Object.assign(row, {
-                    charge_type: "Actual",
-                    account_head: accounts.sales_tax_account,
-                    description: "Sales Tax (Item Level)",
-                    tax_amount: total_st,
-                    custom_tax_category: "Sales Tax",
-                    tax_category: "Sales Tax"
-                });
-            }
+    set_tax_summary_rows(frm, result.taxes || []);
+}
 
-            if (total_further_tax && accounts.further_tax_account) {
-                let row = frm.add_child("taxes");
-                Object.assign(row, {
-                    charge_type: "Actual",
-                    account_head: accounts.further_tax_account,
-                    description: "Further Tax (Item Level)",
-                    tax_amount: total_further_tax,
-                    custom_tax_category: "Further Sales Tax",
-                    tax_category: "Further Sales Tax"
-                });
-            }
 
-            // Apply 236G tax from template
-            let advance_tax = 0;
-            
-            // Calculate base for 236G: total invoice value including taxes
-            // total_inclusive = item amounts + sales tax + further tax
-            let tax_base_for_236g = total_inclusive;
-            
-            if (frm.doc.doctype === "Sales Invoice") {
-                // For Sales Invoice: Calculate 236G on total inclusive amount
-                advance_tax = (advance.advance_tax_rate || 0) * 0.01 * tax_base_for_236g;
-
-                if (advance_tax && advance.advance_tax_account) {
-                    let row = frm.add_child("taxes");
-                    Object.assign(row, {
-                        charge_type: "Actual",
-                        account_head: advance.advance_tax_account,
-                        description: "Advance Income Tax (236G)",
-                        tax_amount: advance_tax,
-                        custom_tax_category: "236G",
-                        tax_category: "236G"
-                    });
-                }
-            } else if (frm.doc.doctype === "Purchase Invoice") {
-                // For Purchase Invoice: Apply 236G from template if available, otherwise restore preserved rows
-                if (advance.advance_tax_rate && advance.advance_tax_account && frm.doc.custom_tax_template) {
-                    // Template has 236G defined - calculate on total inclusive amount
-                    advance_tax = (advance.advance_tax_rate || 0) * 0.01 * tax_base_for_236g;
-                    
-                    if (advance_tax) {
-                        let row = frm.add_child("taxes");
-                        Object.assign(row, {
-                            charge_type: "Actual",
-                            account_head: advance.advance_tax_account,
-                            description: "Withholding Tax (236G)",
-                            tax_amount: advance_tax,
-                            custom_tax_category: "236G",
-                            tax_category: "236G",
-                            rate: advance.advance_tax_rate
-                        });
-                        console.log(`[apply_tax_summary] Applied 236G from template: ${advance_tax} (based on total inclusive: ${tax_base_for_236g})`);
-                    }
-                } else if (preserved_236g_rows.length > 0) {
-                    // No template or template has no 236G - restore manually added rows
-                    preserved_236g_rows.forEach(preserved_row => {
-                        let row = frm.add_child("taxes");
-                        Object.assign(row, preserved_row);
-                        advance_tax += flt(preserved_row.tax_amount || 0);
-                    });
-                    console.log(`[apply_tax_summary] Restored ${preserved_236g_rows.length} manually added 236G row(s)`);
-                }
-            }
+function apply_incremental_tax_result(frm, result) {
+    const state = frm.__tax_state;
 
-            // Update UI instantly
-            frm.refresh_field("taxes");
-            frm.doc.total_taxes_and_charges = (total_st || 0) + (total_further_tax || 0) + (advance_tax || 0);
-            frm.refresh_field("total_taxes_and_charges");
-
-            // Mark doc as dirty so it gets saved
-            frm.dirty();
-            
-            console.log(`[apply_tax_summary] Completed tax summary with totals:`, {
-                total_st,
-                total_further_tax,
-                advance_tax,
-                total_taxes_and_charges: frm.doc.total_taxes_and_charges
-            });
-        });
+    // Adjust running totals by the change in each recalculated row
+    (result.items || []).forEach(item => {
+        const row = (frm.doc.items || []).find(d => d.name === item.name);
+        if (!row) {
+            return;
+        }
+        Object.assign(row, item);
+
+        const previous = state.rows[row.name] || { st: 0, further_tax: 0, inclusive: 0 };
+        const current = get_row_tax_snapshot(row);
+        state.totals.st += current.st - previous.st;
+        state.totals.further_tax += current.further_tax - previous.further_tax;
+        state.totals.inclusive += current.inclusive - previous.inclusive;
+        state.rows[row.name] = current;
     });
+    frm.refresh_field("items");
+
+    update_item_level_tax_rows(frm, state);
 }
 
 
-function calculate_taxes(frm, row, manual_override_field) {
-    if (frm.doc.custom_purchase_invoice_type === "Import") {
-        return;
-    }
+function get_row_tax_snapshot(row) {
+    return {
+        st: flt(row.custom_st || 0),
+        further_tax: flt(row.custom_further_tax || 0),
+        inclusive: flt(row.custom_total_incl_tax || 0)
+    };
+}
 
-    if (frm.doc.custom_supplier_st_status === "Unregistered") {
-        console.log(`[calculate_taxes] Skipping calculation for item: ${row.item_code} because supplier is unregistered`);
-        
-        // Clear all tax fields for unregistered supplier
-        let qty = row.qty > 0 ? row.qty : 1;
-        let base_amount = qty * row.rate;
-        const multiplier = getMultiplier(frm);
-        
-        row.custom_st_rate = 0;
-        row.custom_st = 0;
-        row.custom_further_tax = 0;
-        row.custom_at = 0;
-        row.custom_total_incl_tax = multiplier * base_amount;
-        
-        frm.refresh_field("items");
-        
-        // Call apply_tax_summary to recalculate taxes table
-        setTimeout(() => {
-            console.log(`[calculate_taxes] Calling apply_tax_summary after clearing taxes for unregistered supplier`);
-            apply_tax_summary(frm);
-        }, 50);
-        
-        return;
-    }
 
-    if (frm.doc.custom_sales_tax_invoice === 0) {
-        console.log(`[calculate_taxes] Skipping calculation for item: ${row.item_code} because its not a sales tax invoice`);
-        
-        // Clear all tax fields for unregistered supplier
-        let qty = row.qty > 0 ? row.qty : 1;
-        let base_amount = qty * row.rate;
-        const multiplier = getMultiplier(frm);
-        
-        row.custom_st_rate = 0;
-        row.custom_st = 0;
-        row.custom_further_tax = 0;
-        row.custom_at = 0;
-        row.custom_total_incl_tax = multiplier * base_amount;
-        
-        frm.refresh_field("items");
-        
-        // Call apply_tax_summary to recalculate taxes table
-        setTimeout(() => {
-            console.log(`[calculate_taxes] Calling apply_tax_summary after clearing taxes for unregistered supplier`);
-            apply_tax_summary(frm);
-        }, 50);
-        
-        return;
+function update_item_level_tax_rows(frm, state) {
+    // Same rules as apply_item_level_tax_summary, for the rows that depend on items
+    const precision = frappe.boot.sysdefaults.currency_precision || 2;
+    const ctx = state.context;
+    const total_st = flt(state.totals.st, precision);
+    const total_further_tax = flt(state.totals.further_tax, precision);
+
+    upsert_tax_row(frm, "Sales Tax", total_st && ctx.sales_tax_account ? {
+        charge_type: "Actual",
+        account_head: ctx.sales_tax_account,
+        description: "Sales Tax (Item Level)",
+        tax_amount: total_st,
+        custom_tax_category: "Sales Tax",
+        tax_category: "Sales Tax",
+        category: "Total",
+        add_deduct_tax: "Add"
+    } : null);
+
+    upsert_tax_row(frm, "Further Sales Tax", total_further_tax && ctx.further_tax_account ? {
+        charge_type: "Actual",
+        account_head: ctx.further_tax_account,
+        description: "Further Tax (Item Level)",
+        tax_amount: total_further_tax,
+        custom_tax_category: "Further Sales Tax",
+        tax_category: "Further Sales Tax",
+        category: "Total",
+        add_deduct_tax: "Add"
+    } : null);
+
+    // 236G only follows the items when the template defines it; manually
+    // added Purchase Invoice rows are left alone
+    if (ctx.advance_tax_rate && ctx.advance_tax_account) {
+        const advance_tax = ctx.advance_tax_rate * 0.01 * state.totals.inclusive;
+        const values = {
+            charge_type: "Actual",
+            account_head: ctx.advance_tax_account,
+            tax_amount: advance_tax,
+            custom_tax_category: "236G",
+            tax_category: "236G",
+            cost_center: ctx.cost_center,
+            category: "Total",
+            add_deduct_tax: "Add"
+        };
+        if (frm.doc.doctype === "Sales Invoice") {
+            values.description = "Advance Income Tax (236G)";
+        } else {
+            values.description = "Withholding Tax (236G)";
+            values.rate = ctx.advance_tax_rate;
+        }
+        upsert_tax_row(frm, "236G", advance_tax ? values : null);
     }
 
-   
-
-    console.log(`[calculate_taxes] Starting calculation for item: ${row.item_code}, manual_override_field: ${manual_override_field}`);
-
-    let qty = row.qty > 0 ? row.qty : 1;
-    let base_amount = qty * row.rate;
-    const multiplier = getMultiplier(frm);
-    let precision = frappe.boot.sysdefaults.currency_precision || 2;
-
-    // Handle manual override scenarios
-    if (manual_override_field === "custom_st") {
-        // User manually changed the sales tax amount
-        console.log(`[calculate_taxes] Manual override: custom_st = ${row.custom_st}`);
-        
-        let sales_tax = flt(row.custom_st || 0, precision);
-        
-        // Reverse calculate the rate from amount
-        let sales_tax_rate = 0;
-        if (base_amount !== 0) {
-            sales_tax_rate = (sales_tax / (multiplier * base_amount)) * 100;
+    refresh_tax_totals(frm);
+}
+
+
+function upsert_tax_row(frm, tax_category, values) {
+    const existing = (frm.doc.taxes || []).find(d => d.custom_tax_category === tax_category);
+
+    if (!values) {
+        if (existing) {
+            remove_tax_rows(frm, [existing]);
         }
-        
-        row.custom_st_rate = flt(sales_tax_rate, precision);
-        row.custom_st = sales_tax;
-        
-        // Recalculate total including tax
-        fetch_item_tax_template(row, function(item_tax_template) {
-            let further_tax = 0;
-            
-            if (item_tax_template) {
-                frappe.call({
-                    method: "frappe.client.get",
-                    args: {
-                        doctype: "Item Tax Template",
-                        name: item_tax_template
-                    },
-                    callback: function(response) {
-                        if (response.message) {
-                            const tax_rates = response.message.taxes || [];
-                            
-                            tax_rates.forEach(rate => {
-                                if (
-                                    rate.custom_tax_category === "Further Sales Tax" &&
-                                    frm.doc.doctype === "Sales Invoice" &&
-                                    (!frm.doc.custom_customer_st_status || frm.doc.custom_customer_st_status === "Unregistered")
-                                ) {
-                                    further_tax += multiplier * (rate.tax_rate * 0.01 * base_amount);
-                                }
-                            });
-                        }
-                        
-                        row.custom_further_tax = further_tax;
-                        row.custom_at = 0;
-                        row.custom_total_incl_tax = multiplier * base_amount + sales_tax + further_tax;
-                        
-                        frm.refresh_field("items");
-                        setTimeout(() => {
-                            apply_tax_summary(frm);
-                        }, 50);
-                    }
-                });
-            } else {
-                row.custom_further_tax = 0;
-                row.custom_at = 0;
-                row.custom_total_incl_tax = multiplier * base_amount + sales_tax;
-                
-                frm.refresh_field("items");
-                setTimeout(() => {
-                    apply_tax_summary(frm);
-                }, 50);
-            }
-        });
-        
         return;
     }
-    
-    if (manual_override_field === "custom_st_rate") {
-        // User manually changed the sales tax rate
-        console.log(`[calculate_taxes] Manual override: custom_st_rate = ${row.custom_st_rate}`);
-        
-        let sales_tax_rate = flt(row.custom_st_rate || 0, precision);
-        let sales_tax = multiplier * (sales_tax_rate * 0.01 * base_amount);
-        
-        row.custom_st_rate = sales_tax_rate;
-        row.custom_st = flt(sales_tax, precision);
-        
-        // Recalculate total including tax
-        fetch_item_tax_template(row, function(item_tax_template) {
-            let further_tax = 0;
-            
-            if (item_tax_template) {
-                frappe.call({
-                    method: "frappe.client.get",
-                    args: {
-                        doctype: "Item Tax Template",
-                        name: item_tax_template
-                    },
-                    callback: function(response) {
-                        if (response.message) {
-                            const tax_rates = response.message.taxes || [];
-                            
-                            tax_rates.forEach(rate => {
-                                if (
-                                    rate.custom_tax_category === "Further Sales Tax" &&
-                                    frm.doc.doctype === "Sales Invoice" &&
-                                    (!frm.doc.custom_customer_st_status || frm.doc.custom_customer_st_status === "Unregistered")
-                                ) {
-                                    further_tax += multiplier * (rate.tax_rate * 0.01 * base_amount);
-                                }
-                            });
-                        }
-                        
-                        row.custom_further_tax = further_tax;
-                        row.custom_at = 0;
-                        row.custom_total_incl_tax = multiplier * base_amount + sales_tax + further_tax;
-                        
-                        frm.refresh_field("items");
-                        setTimeout(() => {
-                            apply_tax_summary(frm);
-                        }, 50);
-                    }
-                });
-            } else {
-                row.custom_further_tax = 0;
-                row.custom_at = 0;
-                row.custom_total_incl_tax = multiplier * base_amount + sales_tax;
-                
-                frm.refresh_field("items");
-                setTimeout(() => {
-                    apply_tax_summary(frm);
-                }, 50);
-            }
-        });
-        
-        return;
+
+    if (existing) {
+        Object.assign(existing, values);
+    } else {
+        Object.assign(frm.add_child("taxes"), values);
     }
+}
+
+
+function remove_tax_rows(frm, rows) {
+    rows.forEach(row => frappe.model.clear_doc(row.doctype, row.name));
+    frm.doc.taxes = (frm.doc.taxes || []).filter(d => !rows.includes(d));
+    frm.doc.taxes.forEach((d, i) => d.idx = i + 1);
+}
 
-    // Normal flow: fetch from tax template
-    fetch_item_tax_template(row, function(item_tax_template) {
-        let sales_tax = 0;
-        let further_tax = 0;
-        let sales_tax_rate = 0;
-
-        if (item_tax_template) {
-            console.log(`[calculate_taxes] Found tax template: ${item_tax_template}`);
-            frappe.call({
-                method: "frappe.client.get",
-                args: {
-                    doctype: "Item Tax Template",
-                    name: item_tax_template
-                },
-                callback: function(response) {
-                    if (response.message) {
-                        const tax_rates = response.message.taxes || [];
-
-                        tax_rates.forEach(rate => {
-                            if (rate.custom_tax_category === "Sales Tax") {
-                                sales_tax += multiplier * (rate.tax_rate * 0.01 * base_amount);
-                                sales_tax_rate += rate.tax_rate;
-                            }
-
-                            // ✅ Apply Further Tax conditionally
-                            if (
-                                rate.custom_tax_category === "Further Sales Tax" &&
-                                frm.doc.doctype === "Sales Invoice" &&
-                                (!frm.doc.custom_customer_st_status || frm.doc.custom_customer_st_status === "Unregistered")
-                            ) {
-                                further_tax += multiplier * (rate.tax_rate * 0.01 * base_amount);
-                            }
-                        });
-
-                        // Update row fields first
-                        row.custom_st_rate = flt(sales_tax_rate, precision);
-                        row.custom_st = flt(sales_tax, precision);
-                        row.custom_further_tax = flt(further_tax, precision);
-                        row.custom_at = 0;
-                        row.custom_total_incl_tax = flt(multiplier * base_amount + sales_tax + further_tax, precision);
-
-                        console.log(`[calculate_taxes] Updated row ${row.item_code}:`, {
-                            custom_st: row.custom_st,
-                            custom_further_tax: row.custom_further_tax,
-                            custom_total_incl_tax: row.custom_total_incl_tax
-                        });
-
-                        // Refresh the row data first
-                        frm.refresh_field("items");
-                        
-                        // Only call apply_tax_summary after the row is updated
-                        // Use a small delay to ensure the UI has updated
-                        setTimeout(() => {
-                            console.log(`[calculate_taxes] Calling apply_tax_summary after row update`);
-                            apply_tax_summary(frm);
-                        }, 50);
-                    }
-                }
-            });
+
+// Tax categories of the summary rows; rows of other categories were added
+// by hand and are left alone (see SUMMARY_TAX_CATEGORIES in tax_overrides.py)
+const SUMMARY_TAX_CATEGORIES = ["Sales Tax", "Further Sales Tax", "236G", "Freight"];
+
+function set_tax_summary_rows(frm, tax_summary) {
+    // Update existing rows in place (matched on tax category and account head)
+    // instead of clearing the table and adding every row again
+    let unmatched = (frm.doc.taxes || []).filter(d => SUMMARY_TAX_CATEGORIES.includes(d.custom_tax_category));
+    tax_summary.forEach(tax => {
+        const existing = unmatched.find(d =>
+            d.custom_tax_category === tax.custom_tax_category && d.account_head === tax.account_head
+        );
+        if (existing) {
+            Object.assign(existing, tax);
+            unmatched = unmatched.filter(d => d !== existing);
         } else {
-            console.log(`[calculate_taxes] No tax template found for item: ${row.item_code}`);
-            row.custom_st_rate = 0;
-            row.custom_st = 0;
-            row.custom_further_tax = 0;
-            row.custom_at = 0;
-            row.custom_total_incl_tax = flt(multiplier * base_amount, precision);
-            
-            frm.refresh_field("items");
-            
-            // Call apply_tax_summary even when no template is found
-            setTimeout(() => {
-                console.log(`[calculate_taxes] Calling apply_tax_summary after clearing taxes`);
-                apply_tax_summary(frm);
-            }, 50);
+            Object.assign(frm.add_child("taxes"), tax);
         }
     });
-}
\ No newline at end of file
+    remove_tax_rows(frm, unmatched);
+
+    refresh_tax_totals(frm);
+}
+
+
+function refresh_tax_totals(frm) {
+    // Update UI instantly
+    frm.refresh_field("taxes");
+    frm.doc.total_taxes_and_charges = (frm.doc.taxes || []).reduce((sum, d) => sum + flt(d.tax_amount || 0), 0);
+    frm.refresh_field("total_taxes_and_charges");
+
+    // Mark doc as dirty so it gets saved
+    frm.dirty();
+}
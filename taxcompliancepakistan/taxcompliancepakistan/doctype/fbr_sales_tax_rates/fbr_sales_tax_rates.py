@@ -4,6 +4,12 @@
 # import frappe
 from frappe.model.document import Document
 
+from taxcompliancepakistan.utilities.tax_cache import clear_template_rate_basis
+
 
 class FBRSalesTaxRates(Document):
-	pass
+	def on_update(self):
+		clear_template_rate_basis()
+
+	def on_trash(self):
+		clear_template_rate_basis()
@@ -1,9 +1,151 @@
 # Copyright (c) 2025, SpotLedger and Contributors
 # See license.txt
 
-# import frappe
+import csv
+from unittest.mock import patch
+
+import frappe
+from erpnext.accounts.doctype.sales_invoice.test_sales_invoice import create_sales_invoice
 from frappe.tests.utils import FrappeTestCase
 
+from taxcompliancepakistan.utilities.rate_engine import (
+	APPLY_PERCENTAGE_AND_UOM,
+	audit_sales_tax,
+	compute_sales_tax,
+	rate_invoice_items,
+)
+from taxcompliancepakistan.utilities.tax_cache import (
+	DEFAULT_RATE_BASIS,
+	clear_template_advance_tax,
+	get_template_rate_basis,
+)
+
+SALES_TAX_TEMPLATE = "_Test Sales Taxes and Charges Template - _TC"
+
 
 class TestFBRSalesTaxRates(FrappeTestCase):
-	pass
+	def test_rate_engine_applies_every_basis(self):
+		# Same line (10 units at 100 each, 18% and Rs. 5 per unit) under each basis
+		sales_tax = compute_sales_tax(
+			qty=[10, 10, 10, 10],
+			base_amount=[1000, 1000, 1000, 1000],
+			st_rate=[18, 18, 18, 18],
+			fixed_tax_amount=[5, 5, 5, 5],
+			basis=[0, 1, 2, 3],
+		)
+
+		self.assertEqual(list(sales_tax), [180, 230, 50, 5])
+
+	def test_rate_engine_applies_fixed_tax_basis(self):
+		# 10 units (2 in the fixed tax UOM) at Rs. 5 under Actual, UOM and no fixed basis
+		sales_tax = compute_sales_tax(
+			qty=[10, 10, 10, 10],
+			base_amount=[1000, 1000, 1000, 1000],
+			st_rate=[18, 18, 18, 18],
+			fixed_tax_amount=[5, 5, 5, 5],
+			basis=[1, 1, 2, 3],
+			fixed_basis=[1, 2, 0, 2],
+			fixed_tax_qty=[2, 2, 2, 2],
+		)
+
+		self.assertEqual(list(sales_tax), [185, 190, 50, 10])
+
+	def test_invoice_items_are_rated_on_the_template_basis(self):
+		make_rate_fixtures()
+		si = make_rated_invoice()
+		si.items[0].update({"uom": "_Test UOM 1", "stock_uom": "_Test UOM", "conversion_factor": 10})
+
+		basis = get_template_rate_basis("Sales Taxes and Charges Template", SALES_TAX_TEMPLATE)
+		self.assertEqual(basis, APPLY_PERCENTAGE_AND_UOM)
+		rate_invoice_items(si, si.items, basis)
+
+		# 18% of 200, plus Rs. 5 per stock unit (2 x 10) on the UOM template
+		# and Rs. 50 once on the Actual one; 4% further tax for an
+		# unregistered customer
+		self.assertEqual(get_item_taxes(si.items[0]), (18, 136, 8, 344))
+		self.assertEqual(get_item_taxes(si.items[1]), (18, 86, 8, 294))
+
+		# Without the template's basis the fixed charges are not applied
+		rate_invoice_items(si, si.items, DEFAULT_RATE_BASIS)
+		self.assertEqual(get_item_taxes(si.items[0]), (18, 36, 8, 244))
+		self.assertEqual(get_item_taxes(si.items[1]), (18, 36, 8, 244))
+
+	def test_audit_reports_lines_whose_stored_tax_differs(self):
+		make_rate_fixtures()
+		si = make_rated_invoice()
+		si.submit()
+		expected_st = si.items[0].custom_st
+		# Rated on save with the template basis, so the fixed charge is included
+		self.assertGreater(expected_st, 18 * 0.01 * 200)
+
+		frappe.db.set_value("Sales Invoice Item", si.items[0].name, "custom_st", expected_st + 10)
+
+		# The audit commits once its file is written; keep the test data rolled back
+		with patch.object(frappe.db, "commit"):
+			result = audit_sales_tax(si.company, si.posting_date, si.posting_date)
+
+		self.assertGreaterEqual(result["lines_checked"], 2)
+		with open(frappe.get_site_path(result["file_url"].lstrip("/")), newline="") as f:
+			rows = [row for row in csv.DictReader(f) if row["Invoice"] == si.name]
+
+		self.assertEqual(len(rows), 1)
+		self.assertEqual(int(rows[0]["Row"]), 1)
+		self.assertEqual(float(rows[0]["Stored ST"]), expected_st + 10)
+		self.assertEqual(float(rows[0]["Expected ST"]), expected_st)
+		self.assertEqual(float(rows[0]["Expected Further Tax"]), si.items[0].custom_further_tax)
+
+
+def make_rate_fixtures():
+	fbr_rate = "_Test 18% With Charge on UOM"
+	if not frappe.db.exists("FBR Sales Tax Rates", fbr_rate):
+		frappe.get_doc({
+			"doctype": "FBR Sales Tax Rates",
+			"fbr_tax_rate_description": fbr_rate,
+			"rate_application_basis": APPLY_PERCENTAGE_AND_UOM,
+		}).insert()
+
+	frappe.db.set_value("Sales Taxes and Charges Template", SALES_TAX_TEMPLATE, "custom_fbr_sales_tax_rate", fbr_rate)
+	clear_template_advance_tax(frappe.get_doc("Sales Taxes and Charges Template", SALES_TAX_TEMPLATE))
+
+	make_item_tax_template("_Test FBR Fixed per UOM", 5, "UOM", "_Test UOM")
+	make_item_tax_template("_Test FBR Fixed per Line", 50, "Actual")
+
+
+def make_item_tax_template(title, fixed_tax_amount, fixed_tax_basis, fixed_tax_uom=None):
+	if frappe.db.exists("Item Tax Template", f"{title} - _TC"):
+		return
+	frappe.get_doc({
+		"doctype": "Item Tax Template",
+		"title": title,
+		"company": "_Test Company",
+		"taxes": [
+			{
+				"tax_type": "_Test Account VAT - _TC",
+				"tax_rate": 18,
+				"custom_tax_category": "Sales Tax",
+				"custom_fixed_tax_amount": fixed_tax_amount,
+				"custom_fixed_tax_basis": fixed_tax_basis,
+				"custom_fixed_tax_uom": fixed_tax_uom,
+			},
+			{
+				"tax_type": "_Test Account Service Tax - _TC",
+				"tax_rate": 4,
+				"custom_tax_category": "Further Sales Tax",
+			},
+		],
+	}).insert()
+
+
+def make_rated_invoice():
+	si = create_sales_invoice(qty=2, rate=100, do_not_save=True)
+	si.append("items", dict(si.items[0].as_dict(), name=None, idx=None))
+	si.items[0].item_tax_template = "_Test FBR Fixed per UOM - _TC"
+	si.items[1].item_tax_template = "_Test FBR Fixed per Line - _TC"
+	si.custom_tax_template = SALES_TAX_TEMPLATE
+	si.custom_sales_tax_invoice = 1
+	si.custom_customer_st_status = "Unregistered"
+	return si
+
+
+def get_item_taxes(item):
+	return (item.custom_st_rate, item.custom_st, item.custom_further_tax, item.custom_total_incl_tax)
@@ -0,0 +1,8 @@
+// Copyright (c) 2026, SpotLedger and contributors
+// For license information, please see license.txt
+
+// frappe.ui.form.on("FBR Tax Ledger Entry", {
+// 	refresh(frm) {
+
+// 	},
+// });
@@ -0,0 +1,14 @@
+# Copyright (c) 2026, SpotLedger and contributors
+# For license information, please see license.txt
+
+import frappe
+from frappe.model.document import Document
+
+
+class FBRTaxLedgerEntry(Document):
+	pass
+
+
+def on_doctype_update():
+	frappe.db.add_index("FBR Tax Ledger Entry", ["company", "voucher_type", "posting_date"])
+	frappe.db.add_index("FBR Tax Ledger Entry", ["voucher_type", "voucher_no"])
@@ -0,0 +1,35 @@
+# Copyright (c) 2026, SpotLedger and Contributors
+# See license.txt
+
+import frappe
+from erpnext.accounts.doctype.sales_invoice.test_sales_invoice import create_sales_invoice
+from frappe.tests.utils import FrappeTestCase
+from frappe.utils import get_first_day
+
+
+class TestFBRTaxLedgerEntry(FrappeTestCase):
+	def test_ledger_follows_invoice_submit_and_cancel(self):
+		si = create_sales_invoice(qty=4, rate=250, do_not_submit=True)
+		si.append("items", dict(si.items[0].as_dict(), name=None, idx=None, qty=6))
+		si.submit()
+
+		# Both lines share the HS code, so they are summed into one entry
+		entries = get_ledger_entries(si.name)
+		self.assertEqual(len(entries), 1)
+		self.assertEqual(entries[0].company, si.company)
+		self.assertEqual(entries[0].period, get_first_day(si.posting_date))
+		self.assertEqual(entries[0].party, si.customer)
+		self.assertEqual(entries[0].doc_type, "Sales Invoice")
+		self.assertEqual(entries[0].qty, 10)
+		self.assertEqual(entries[0].amount, 2500)
+
+		si.cancel()
+		self.assertEqual(get_ledger_entries(si.name), [])
+
+
+def get_ledger_entries(voucher_no):
+	return frappe.get_all(
+		"FBR Tax Ledger Entry",
+		filters={"voucher_type": "Sales Invoice", "voucher_no": voucher_no},
+		fields=["company", "period", "party", "doc_type", "qty", "amount"],
+	)
@@ -4,6 +4,25 @@
 # import frappe
 from frappe.tests.utils import FrappeTestCase
 
+from taxcompliancepakistan.utilities.tax_cache import is_wht_exempt, make_wht_exemption_index
+
 
 class TestWHTExemption(FrappeTestCase):
-	pass
+	def test_exemption_index_merges_overlapping_periods(self):
+		index = make_wht_exemption_index([
+			{"exemption_from_section": "153(1)(a)", "company": "_Test Company", "valid_from": "2024-07-01", "valid_upto": "2024-12-31"},
+			{"exemption_from_section": "153(1)(a)", "company": "_Test Company", "valid_from": "2024-11-01", "valid_upto": "2025-06-30"},
+			{"exemption_from_section": "153(1)(a)", "company": "_Test Company", "valid_from": "2025-09-01", "valid_upto": None},
+		])
+
+		def exempt(on_date, section="153(1)(a)", company="_Test Company"):
+			return is_wht_exempt("Supplier", "_Test Supplier", section, company, on_date, exemption_index=index)
+
+		self.assertEqual(len(index[("153(1)(a)", "_Test Company")][0]), 2)
+		self.assertFalse(exempt("2024-06-30"))
+		self.assertTrue(exempt("2024-07-01"))
+		self.assertTrue(exempt("2025-01-15"))
+		self.assertFalse(exempt("2025-08-01"))
+		self.assertTrue(exempt("2030-01-01"))
+		self.assertFalse(exempt("2025-01-15", section="153(1)(b)"))
+		self.assertFalse(exempt("2025-01-15", company="_Test Company 1"))
@@ -4,6 +4,12 @@
 # import frappe
 from frappe.model.document import Document
 
+from taxcompliancepakistan.utilities.tax_cache import clear_wht_exemption_index
+
 
 class WHTExemption(Document):
-	pass
+	def on_submit(self):
+		clear_wht_exemption_index(self.party_type, self.party)
+
+	def on_cancel(self):
+		clear_wht_exemption_index(self.party_type, self.party)
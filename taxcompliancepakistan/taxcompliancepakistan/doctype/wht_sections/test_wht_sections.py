@@ -1,9 +1,29 @@
 # Copyright (c) 2025, SpotLedger and Contributors
 # See license.txt
 
-# import frappe
+import frappe
 from frappe.tests.utils import FrappeTestCase
 
+from taxcompliancepakistan.utilities.tax_cache import get_wht_sections
+
 
 class TestWHTSections(FrappeTestCase):
-	pass
+	def test_cache_is_invalidated_on_save_and_trash(self):
+		section = frappe.get_doc({
+			"doctype": "WHT Sections",
+			"section_name": "_Test 153(1)(a)",
+			"effective_from": "2025-07-01",
+			"section_code": "64020004",
+			"tax_payment_nature": "Adjustable WHT",
+			"active_tax_payer_rate": 5.5,
+			"inactive_tax_payer_rate": 11,
+		}).insert()
+
+		self.assertEqual(get_wht_sections()[section.name].active_tax_payer_rate, 5.5)
+
+		section.active_tax_payer_rate = 6
+		section.save()
+		self.assertEqual(get_wht_sections()[section.name].active_tax_payer_rate, 6)
+
+		section.delete()
+		self.assertNotIn(section.name, get_wht_sections())
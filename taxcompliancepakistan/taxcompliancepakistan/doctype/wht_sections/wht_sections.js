@@ -1,8 +1,35 @@
 // Copyright (c) 2025, SpotLedger and contributors
 // For license information, please see license.txt
 
-// frappe.ui.form.on("WHT Sections", {
-// 	refresh(frm) {
+frappe.ui.form.on("WHT Sections", {
+	refresh(frm) {
+		if (frm.is_new()) {
+			return;
+		}
 
-// 	},
-// });
+		// After a rate change, draft Payment Entries from effective_from on
+		// keep their old WHT until re-rated
+		frm.add_custom_button(__("Re-rate Draft Payments"), function() {
+			frappe.prompt({
+				"fieldname": "dry_run",
+				"label": __("Dry Run (only report the changes)"),
+				"fieldtype": "Check",
+				"default": 1
+			}, function(values) {
+				frappe.call({
+					method: "taxcompliancepakistan.utilities.wht_rerating.enqueue_wht_rerating",
+					args: {
+						sections: [frm.doc.name],
+						dry_run: values.dry_run
+					},
+					callback: function() {
+						frappe.show_alert({
+							message: __("Re-rating queued. You will be notified with the diff report."),
+							indicator: "blue"
+						});
+					}
+				});
+			}, __("Re-rate Draft Payment Entries"));
+		});
+	},
+});
@@ -4,6 +4,12 @@
 # import frappe
 from frappe.model.document import Document
 
+from taxcompliancepakistan.utilities.tax_cache import clear_wht_sections_cache
+
 
 class WHTSections(Document):
-	pass
+	def on_update(self):
+		clear_wht_sections_cache()
+
+	def on_trash(self):
+		clear_wht_sections_cache()
@@ -21,7 +21,142 @@ frappe.query_reports["Annex A"] = {
             "fieldtype": "Link",
             "options": "Company",
             "reqd": 1
+        },
+        {
+            "fieldname": "use_tax_ledger",
+            "label": __("Read From Tax Ledger"),
+            "fieldtype": "Check",
+            "default": 0
         }
 
-	]
+	],
+    "onload": function(report) {
+        report.page.add_inner_button(__("Export FBR File"), function() {
+            frappe.prompt({
+                "fieldname": "file_format",
+                "label": __("Format"),
+                "fieldtype": "Select",
+                "options": "csv\nxlsx",
+                "default": "csv",
+                "reqd": 1
+            }, function(values) {
+                frappe.call({
+                    method: "taxcompliancepakistan.utilities.annex_export.export_annex",
+                    args: {
+                        report_name: "Annex A",
+                        filters: report.get_values(),
+                        file_format: values.file_format
+                    },
+                    callback: function() {
+                        frappe.show_alert({
+                            message: __("Export queued. You will be notified when the file is ready."),
+                            indicator: "blue"
+                        });
+                    }
+                });
+            }, __("Export Annex A"));
+        });
+        report.page.add_inner_button(__("Export by Company and Month"), function() {
+            frappe.prompt([
+                {
+                    "fieldname": "companies",
+                    "label": __("Companies"),
+                    "fieldtype": "MultiSelectList",
+                    "get_data": function(txt) {
+                        return frappe.db.get_link_options("Company", txt);
+                    },
+                    "default": [report.get_values().company],
+                    "reqd": 1
+                },
+                {
+                    "fieldname": "file_format",
+                    "label": __("Format"),
+                    "fieldtype": "Select",
+                    "options": "csv\nxlsx",
+                    "default": "csv",
+                    "reqd": 1
+                }
+            ], function(values) {
+                frappe.call({
+                    method: "taxcompliancepakistan.utilities.annex_shards.enqueue_sharded_annex",
+                    args: {
+                        report_name: "Annex A",
+                        filters: report.get_values(),
+                        companies: values.companies,
+                        file_format: values.file_format
+                    },
+                    callback: function(r) {
+                        if (!r.message) {
+                            return;
+                        }
+                        const run_id = r.message.run_id;
+                        frappe.show_progress(__("Annex A"), 0, r.message.shards, __("Queued"));
+                        // One listener per report page, following the latest run
+                        if (report.__annex_progress_handler) {
+                            frappe.realtime.off("tax_annex_progress", report.__annex_progress_handler);
+                        }
+                        report.__annex_progress_handler = function handler(data) {
+                            if (data.run_id !== run_id) {
+                                return;
+                            }
+                            if (data.failed || data.done === data.total) {
+                                frappe.hide_progress();
+                                frappe.realtime.off("tax_annex_progress", handler);
+                                report.__annex_progress_handler = null;
+                                return;
+                            }
+                            frappe.show_progress(__("Annex A"), data.done, data.total,
+                                __("{0} of {1} parts done", [data.done, data.total]));
+                        };
+                        frappe.realtime.on("tax_annex_progress", report.__annex_progress_handler);
+                    }
+                });
+            }, __("Export Annex A by Company and Month"));
+        });
+        report.page.add_inner_button(__("Reconcile Supplier Declarations"), function() {
+            frappe.prompt([
+                {
+                    "fieldname": "file_url",
+                    "label": __("Declared Sales File (Annex C layout)"),
+                    "fieldtype": "Attach",
+                    "reqd": 1
+                },
+                {
+                    "fieldname": "supplier",
+                    "label": __("Supplier"),
+                    "fieldtype": "Link",
+                    "options": "Supplier",
+                    "description": __("Required when the file has no supplier NTN column")
+                },
+                {
+                    "fieldname": "amount_tolerance",
+                    "label": __("Amount Tolerance"),
+                    "fieldtype": "Currency",
+                    "default": 1
+                },
+                {
+                    "fieldname": "tax_tolerance",
+                    "label": __("Sales Tax Tolerance"),
+                    "fieldtype": "Currency",
+                    "default": 1
+                }
+            ], function(values) {
+                const filters = report.get_values();
+                frappe.call({
+                    method: "taxcompliancepakistan.utilities.annex_reconciliation.enqueue_annex_reconciliation",
+                    args: Object.assign({
+                        company: filters.company,
+                        from_date: filters.from_date,
+                        to_date: filters.to_date
+                    }, values),
+                    callback: function() {
+                        frappe.show_alert({
+                            message: __("Reconciliation queued. You will be notified when the result is ready."),
+                            indicator: "blue"
+                        });
+                    }
+                });
+            }, __("Reconcile Supplier Declarations"));
+        });
+    }
 };
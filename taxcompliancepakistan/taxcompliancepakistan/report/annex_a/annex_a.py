@@ -1,8 +1,24 @@
 import frappe
 from frappe.utils import flt
 
+from taxcompliancepakistan.utilities.tax_ledger import get_ledger_data, iter_ledger_data
+
+
 def execute(filters=None):
-    columns = [
+    filters = filters or {}
+    columns = get_columns()
+
+    if filters.get("use_tax_ledger"):
+        data = get_ledger_data("Purchase Invoice", filters)
+    else:
+        purchase_invoices = get_purchase_invoices(filters)
+        data = get_data(purchase_invoices)
+
+    return columns, data
+
+
+def get_columns():
+    return [
         {"label": "Registration No", "fieldname": "supplier_tax_id", "fieldtype": "Data", "width": 150},
         {"label": "Supplier Name", "fieldname": "supplier_name", "fieldtype": "Data", "width": 200},
         {"label": "Type", "fieldname": "tax_category", "fieldtype": "Data", "width": 100},
@@ -26,67 +42,160 @@ def execute(filters=None):
         {"label": "Exemption SRO No./ Schedule No.", "fieldname": "exemption_sro_schedule", "fieldtype": "Data", "width": 120},
         {"label": "Exemption Item S. No.", "fieldname": "exemption_item_sr_no", "fieldtype": "Data", "width": 100}
     ]
-    
-    conditions = {"docstatus": 1,"custom_purchase_invoice_type":"Local Purchase"}
+
+
+def iter_data(filters, page_length=500):
+    """
+    Yield Annex A rows one page of invoices at a time, paging on
+    (posting_date, name) so memory stays flat for any period length.
+    """
+    if filters.get("use_tax_ledger"):
+        yield from iter_ledger_data("Purchase Invoice", filters)
+        return
+
+    after = None
+    while True:
+        purchase_invoices = get_purchase_invoices(filters, after=after, page_length=page_length)
+        if not purchase_invoices:
+            return
+
+        yield from get_data(purchase_invoices)
+
+        if len(purchase_invoices) < page_length:
+            return
+        after = (purchase_invoices[-1].posting_date, purchase_invoices[-1].name)
+
+
+def get_purchase_invoices(filters, after=None, page_length=None, invoice_names=None):
+    conditions = ["docstatus = 1", "custom_purchase_invoice_type = 'Local Purchase'"]
+    values = dict(filters)
     if filters.get("from_date") and filters.get("to_date"):
-        conditions["posting_date"] = ["between", [filters["from_date"], filters["to_date"]]]
+        conditions.append("posting_date BETWEEN %(from_date)s AND %(to_date)s")
     if filters.get("company"):
-        conditions["company"] = filters["company"]
-    
+        conditions.append("company = %(company)s")
+    if invoice_names is not None:
+        if not invoice_names:
+            return []
+        conditions.append("name IN %(invoice_names)s")
+        values["invoice_names"] = tuple(invoice_names)
+    if after:
+        conditions.append("(posting_date > %(after_date)s OR (posting_date = %(after_date)s AND name > %(after_name)s))")
+        values["after_date"], values["after_name"] = after
+
+    return frappe.db.sql(
+        """
+        SELECT name, supplier, supplier_name, tax_category, posting_date, billing_address, is_return
+        FROM `tabPurchase Invoice`
+        WHERE {conditions}
+        ORDER BY posting_date, name
+        {limit}
+        """.format(
+            conditions=" AND ".join(conditions),
+            limit="LIMIT {0}".format(int(page_length)) if page_length else ""
+        ),
+        values,
+        as_dict=True,
+    )
+
+
+def get_data(purchase_invoices):
+    """
+    Build Annex A rows for the given invoices. Everything the rows need is
+    fetched in a fixed number of bulk queries and joined in memory, so the
+    query count does not grow with the number of invoices in the period.
+    """
+    if not purchase_invoices:
+        return []
+
+    invoice_names = [inv.name for inv in purchase_invoices]
+    supplier_names = list({inv.supplier for inv in purchase_invoices})
+
+    # Company province (fetched once)
+    company_province = get_company_province()
+
+    # Fetch suppliers
+    suppliers = frappe.get_all(
+        "Supplier",
+        filters={"name": ["in", supplier_names]},
+        fields=["name", "tax_id", "custom_cnic_no", "tax_category", "supplier_primary_address"]
+    )
+    supplier_map = {s.name: s for s in suppliers}
+
+    # Fetch addresses for suppliers
+    address_names = list({s.supplier_primary_address for s in suppliers if s.supplier_primary_address})
+    address_map = {}
+    if address_names:
+        addresses = frappe.get_all(
+            "Address",
+            filters={"name": ["in", address_names]},
+            fields=["name", "custom_province"]
+        )
+        address_map = {a.name: a.custom_province for a in addresses}
+
+    # Fetch items for all invoices, grouped per invoice
+    items = frappe.get_all(
+        "Purchase Invoice Item",
+        filters={"parent": ["in", invoice_names], "parenttype": "Purchase Invoice"},
+        fields=[
+            "parent", "custom_hs_code", "item_group", "custom_st_rate", "qty", "uom", "amount",
+            "custom_further_tax", "custom_st"
+        ],
+        order_by="parent asc, idx asc"
+    )
+    items_by_invoice = {}
+    for item in items:
+        items_by_invoice.setdefault(item.parent, []).append(item)
+
+    # Fetch HS code descriptions in bulk
+    hs_codes = list({i.custom_hs_code for i in items if i.custom_hs_code})
+    hs_map = {}
+    if hs_codes:
+        hs_code_docs = frappe.get_all(
+            "Customs Tariff Number",
+            filters={"name": ["in", hs_codes]},
+            fields=["name", "tariff_number", "custom_complete_description"]
+        )
+        hs_map = {h.name: f"{h.tariff_number}: {h.custom_complete_description}" for h in hs_code_docs}
+
+    # ----------------------------
+    # Build data rows
+    # ----------------------------
     data = []
-    purchase_invoices = frappe.get_all("Purchase Invoice", filters=conditions, fields=[
-        "name", "supplier", "supplier_name", "tax_category", "posting_date", "billing_address",
-        "is_return"
-    ])
-    
     for invoice in purchase_invoices:
-        company_address_list = frappe.get_list('Address', filters={'is_your_company_address': 1, 'address_type': 'Billing'}, fields=['custom_province'])
-        company_province = company_address_list[0].get('custom_province') if company_address_list else None
-        
-        supplier_doc = frappe.get_doc("Supplier", invoice.supplier)
-        
+        supplier = supplier_map.get(invoice.supplier)
+        if not supplier:
+            continue
+
         # Handle missing supplier address gracefully
-        supplier_province = None
-        if supplier_doc.supplier_primary_address:
-            try:
-                supplier_address_doc = frappe.get_doc("Address", supplier_doc.supplier_primary_address)
-                supplier_province = supplier_address_doc.get('custom_province')
-            except Exception:
-                supplier_province = None
-        
-        supplier_tax_id = supplier_doc.tax_id if supplier_doc.tax_category == "Registered" else supplier_doc.custom_cnic_no
-        is_return = invoice.get('is_return')
-        
-        items = frappe.get_all("Purchase Invoice Item", filters={"parent": invoice.name}, fields=[
-            "custom_hs_code", "item_group", "custom_st_rate", "qty", "uom", "amount", "custom_further_tax", "custom_st"
-        ])
-        
+        supplier_province = address_map.get(supplier.supplier_primary_address)
+
+        supplier_tax_id = supplier.tax_id if supplier.tax_category == "Registered" else supplier.custom_cnic_no
+        doc_type = "Debit Note" if invoice.get("is_return") == 1 else "Purchase Invoice"
+
         grouped_items = {}
-        for item in items:
-            hs_code = item["custom_hs_code"]
+        for item in items_by_invoice.get(invoice.name, []):
+            hs_code = item.custom_hs_code
             if hs_code not in grouped_items:
                 grouped_items[hs_code] = {
-                    "qty": 0, "amount": 0, "further_tax": 0, "st_amount": 0, "sales_tax_rate": item["custom_st_rate"],
-                    "uom": item["uom"], "tax_classification": item["item_group"]
+                    "qty": 0, "amount": 0, "further_tax": 0, "st_amount": 0, "sales_tax_rate": item.custom_st_rate,
+                    "uom": item.uom, "tax_classification": item.item_group
                 }
-            
-            grouped_items[hs_code]["qty"] += flt(item["qty"])
-            grouped_items[hs_code]["amount"] += flt(item["amount"])
-            grouped_items[hs_code]["further_tax"] += flt(item["custom_further_tax"])
-            grouped_items[hs_code]["st_amount"] += flt(item["custom_st"])
-        
+
+            grouped_items[hs_code]["qty"] += flt(item.qty)
+            grouped_items[hs_code]["amount"] += flt(item.amount)
+            grouped_items[hs_code]["further_tax"] += flt(item.custom_further_tax)
+            grouped_items[hs_code]["st_amount"] += flt(item.custom_st)
+
         for hs_code, values in grouped_items.items():
             if hs_code is not None:
-                item_hs_code_doc = frappe.get_doc("Customs Tariff Number", hs_code)
-                fbr_desc = f"{item_hs_code_doc.tariff_number}: {item_hs_code_doc.custom_complete_description}"
+                fbr_desc = hs_map.get(hs_code, hs_code)
             else:
-                
                 fbr_desc = "Missing HS Code"
-            doc_type = "Debit Note" if is_return==1 else "Purchase Invoice"
+
             data.append({
                 "supplier_tax_id": supplier_tax_id,
                 "supplier_name": invoice.supplier,
-                "tax_category": supplier_doc.tax_category,
+                "tax_category": supplier.tax_category,
                 "supplier_province": supplier_province,
                 "company_province": company_province,
                 "doc_type": doc_type,
@@ -101,5 +210,15 @@ def execute(filters=None):
                 "further_tax": abs(values["further_tax"]),
                 "st_amount": abs(values["st_amount"])
             })
-    
-    return columns, data
+
+    return data
+
+
+def get_company_province():
+    company_address_list = frappe.get_all(
+        'Address',
+        filters={'is_your_company_address': 1, 'address_type': 'Billing'},
+        fields=['custom_province'],
+        limit=1
+    )
+    return company_address_list[0].custom_province if company_address_list else None
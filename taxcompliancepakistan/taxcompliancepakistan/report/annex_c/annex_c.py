@@ -1,11 +1,82 @@
 import frappe
 from frappe.utils import flt,fmt_money
 
+from taxcompliancepakistan.utilities.tax_ledger import get_ledger_data, iter_ledger_data
+
+
+# HS code description a line is grouped under
+HS_CODE_EXPRESSION = """
+    CASE
+        WHEN IFNULL(sii.custom_hs_code, '') = '' THEN NULL
+        WHEN ctn.name IS NOT NULL THEN ctn.custom_complete_description
+        ELSE item.customs_tariff_number
+    END
+"""
+
+
 def execute(filters=None):
+    columns = get_columns()
+    filters = filters or {}
+    if filters.get("use_tax_ledger"):
+        data = get_ledger_data("Sales Invoice", filters)
+    else:
+        data = get_data(filters)
+    if not data:
+        return columns, [], None, None, []
+
+    # Calculate totals
+    total_qty = sum(d["qty"] for d in data)
+    total_amount = sum(d["amount"] for d in data)
+    total_further_tax = sum(d["further_tax"] for d in data)
+    total_st_amount = sum(d["st_amount"] for d in data)
+
+    # Append totals row
+    
+    """
+    data.append({
+        "customer_tax_id": "",
+        "customer_name": "",
+        "tax_category": "Total",
+        "supplier_province": "",
+        "customer_province": "",
+        "doc_type": "",
+        "doc_name": "",
+        "posting_date": "",
+        "hs_code": "",
+        "tax_classification": "",
+        "sales_tax_rate": "",
+        "qty": total_qty,
+        "uom": "",
+        "amount": total_amount,
+        "further_tax": total_further_tax,
+        "st_amount": total_st_amount
+        
+    })
+    """
+
+    # ----------------------------
+    # Report Totals (Summary Bar)
+    # ----------------------------
+    
+
+    report_summary = get_report_summary(total_amount, total_st_amount, total_further_tax)
+
+    return columns, data, None, None, report_summary
+
+
+def get_report_summary(total_amount, total_st_amount, total_further_tax):
+    return [
+        {"label": "Total Amount", "value": fmt_money(round(total_amount,0)), "indicator": "Green"},
+        {"label": "Total ST Amount", "value": fmt_money(round(total_st_amount,0)), "indicator": "Blue"},
+        {"label": "Total Further Tax", "value": fmt_money(round(total_further_tax,0)), "indicator": "Orange"}
+    ]
+
+
+def get_columns():
     # ----------------------------
     # Columns
     # ----------------------------
-    columns = [
+    return [
         {"label": "Registration No", "fieldname": "customer_tax_id", "fieldtype": "Data", "width": 150},
         {"label": "Customer Name", "fieldname": "customer_name", "fieldtype": "Data", "width": 200},
         {"label": "Type", "fieldname": "tax_category", "fieldtype": "Data", "width": 100},
@@ -30,32 +101,70 @@ def execute(filters=None):
         {"label": "Exemption Item S. No.", "fieldname": "exemption_item_sr_no", "fieldtype": "Data", "width": 100}
     ]
 
-    # ----------------------------
-    # Filters
-    # ----------------------------
-    conditions = {"docstatus": 1}
+
+def iter_data(filters, page_length=500):
+    """
+    Yield Annex C rows one page of invoices at a time, paging on
+    (posting_date, name) so memory stays flat for any period length.
+    """
+    if filters.get("use_tax_ledger"):
+        yield from iter_ledger_data("Sales Invoice", filters)
+        return
+
+    after = None
+    while True:
+        invoices = get_sales_invoices(filters, after=after, page_length=page_length)
+        if not invoices:
+            return
+
+        yield from get_data(filters, invoice_names=[inv.name for inv in invoices])
+
+        if len(invoices) < page_length:
+            return
+        after = (invoices[-1].posting_date, invoices[-1].name)
+
+
+def get_sales_invoices(filters, after=None, page_length=None):
+    conditions, values = get_conditions(filters)
+    if after:
+        conditions.append("(si.posting_date > %(after_date)s OR (si.posting_date = %(after_date)s AND si.name > %(after_name)s))")
+        values["after_date"], values["after_name"] = after
+
+    return frappe.db.sql(
+        """
+        SELECT si.name, si.posting_date
+        FROM `tabSales Invoice` si
+        WHERE {conditions}
+        ORDER BY si.posting_date, si.name
+        {limit}
+        """.format(
+            conditions=" AND ".join(conditions),
+            limit="LIMIT {0}".format(int(page_length)) if page_length else ""
+        ),
+        values,
+        as_dict=True,
+    )
+
+
+def get_conditions(filters):
+    conditions = ["si.docstatus = 1"]
     if filters.get("from_date") and filters.get("to_date"):
-        conditions["posting_date"] = ["between", [filters["from_date"], filters["to_date"]]]
+        conditions.append("si.posting_date BETWEEN %(from_date)s AND %(to_date)s")
     if filters.get("company"):
-        conditions["company"] = filters["company"]
+        conditions.append("si.company = %(company)s")
+    return conditions, dict(filters)
 
-    # ----------------------------
-    # Pre-fetch data
-    # ----------------------------
-    sales_invoices = frappe.get_all(
-        "Sales Invoice",
-        filters=conditions,
-        fields=[
-            "name", "customer", "tax_category", "posting_date",
-            "custom_customer_st_status", "is_return"
-        ]
-    )
 
-    if not sales_invoices:
-        return columns, [], None, None, []
+def get_data(filters, invoice_names=None):
+    """
+    Build Annex C rows. Invoice lines are grouped by (invoice, HS code) and
+    summed in the database, so only the aggregated rows come back to Python.
+    """
+    lines = get_grouped_invoice_lines(filters, invoice_names=invoice_names)
+    if not lines:
+        return []
 
-    invoice_names = [inv.name for inv in sales_invoices]
-    customer_names = list({inv.customer for inv in sales_invoices})
+    customer_names = list({line.customer for line in lines})
 
     # Company province (fetched once)
     company_province = None
@@ -78,39 +187,21 @@ def execute(filters=None):
 
     # Fetch addresses for customers
     address_names = [c.customer_primary_address for c in customers if c.customer_primary_address]
-    addresses = frappe.get_all(
-        "Address",
-        filters={"name": ["in", address_names]},
-        fields=["name", "custom_province"]
-    )
-    address_map = {a.name: a for a in addresses}
-
-    # Fetch items for all invoices
-    items = frappe.get_all(
-        "Sales Invoice Item",
-        filters={"parent": ["in", invoice_names]},
-        fields=[
-            "parent", "custom_hs_code", "item_group",
-            "custom_st_rate", "qty", "uom", "amount",
-            "custom_further_tax", "custom_st"
-        ]
-    )
-
-    # Fetch HS code descriptions in bulk
-    hs_codes = list({i.custom_hs_code for i in items if i.custom_hs_code})
-    hs_code_docs = frappe.get_all(
-        "Customs Tariff Number",
-        filters={"name": ["in", hs_codes]},
-        fields=["name", "tariff_number", "custom_complete_description"]
-    )
-    hs_map = {h.name: f"{h.tariff_number}: {h.custom_complete_description}" for h in hs_code_docs}
+    address_map = {}
+    if address_names:
+        addresses = frappe.get_all(
+            "Address",
+            filters={"name": ["in", address_names]},
+            fields=["name", "custom_province"]
+        )
+        address_map = {a.name: a for a in addresses}
 
     # ----------------------------
     # Build data rows
     # ----------------------------
     data = []
-    for inv in sales_invoices:
-        cust = customer_map.get(inv.customer)
+    for line in lines:
+        cust = customer_map.get(line.customer)
         if not cust:
             continue
 
@@ -124,96 +215,82 @@ def execute(filters=None):
             customer_tax_id = cust.custom_cnic_no
 
         # Normalize tax category for FBR
-        tax_category_value = inv.custom_customer_st_status
+        tax_category_value = line.custom_customer_st_status
         if tax_category_value == "Registered Customers":
             tax_category_value = "Registered"
 
-        doc_type = "Credit Note" if inv.is_return else "Sales Invoice"
-
-        # Group items by HS code per invoice
-        invoice_items = [it for it in items if it.parent == inv.name]
-        grouped_items = {}
-        for it in invoice_items:
-            hs_code = None
-            if it.custom_hs_code:
-                try:
-                    hs_code = frappe.get_cached_doc("Customs Tariff Number", it.custom_hs_code).custom_complete_description
-                except frappe.DoesNotExistError:
-                    # Fallback from Item Master (In Case User forget to set HS Code intially)
-                    hs_code = frappe.get_cached_doc("Item",it.item_code).customs_tariff_number
-                    
-            
-            if hs_code not in grouped_items:
-                grouped_items[hs_code] = {
-                    "qty": 0, "amount": 0, "further_tax": 0,
-                    "st_amount": 0, "sales_tax_rate": it.custom_st_rate,
-                    "uom": it.uom, "tax_classification": it.item_group
-                }
-            grouped_items[hs_code]["qty"] += flt(it.qty)
-            grouped_items[hs_code]["amount"] += flt(it.amount)
-            grouped_items[hs_code]["further_tax"] += flt(it.custom_further_tax)
-            grouped_items[hs_code]["st_amount"] += flt(it.custom_st)
-
-        for hs_code, values in grouped_items.items():
-            fbr_desc = hs_map.get(hs_code, hs_code)
-            data.append({
-                "customer_tax_id": customer_tax_id,
-                "customer_name": inv.customer,
-                "tax_category": tax_category_value,
-                "supplier_province": company_province,
-                "customer_province": customer_province,
-                "doc_type": doc_type,
-                "doc_name": inv.name,
-                "posting_date": inv.posting_date,
-                "hs_code": fbr_desc,
-                "tax_classification": values["tax_classification"],
-                "sales_tax_rate": values["sales_tax_rate"],
-                "qty": abs(values["qty"]),
-                "uom": values["uom"],
-                "amount": abs(values["amount"]),
-                "further_tax": abs(values["further_tax"]),
-                "st_amount": abs(values["st_amount"])
-            })
-    
-        # Calculate totals
-    total_qty = sum(d["qty"] for d in data)
-    total_amount = sum(d["amount"] for d in data)
-    total_further_tax = sum(d["further_tax"] for d in data)
-    total_st_amount = sum(d["st_amount"] for d in data)
+        doc_type = "Credit Note" if line.is_return else "Sales Invoice"
 
-    # Append totals row
-    
-    """
-    data.append({
-        "customer_tax_id": "",
-        "customer_name": "",
-        "tax_category": "Total",
-        "supplier_province": "",
-        "customer_province": "",
-        "doc_type": "",
-        "doc_name": "",
-        "posting_date": "",
-        "hs_code": "",
-        "tax_classification": "",
-        "sales_tax_rate": "",
-        "qty": total_qty,
-        "uom": "",
-        "amount": total_amount,
-        "further_tax": total_further_tax,
-        "st_amount": total_st_amount
-        
-    })
-    """
+        data.append({
+            "customer_tax_id": customer_tax_id,
+            "customer_name": line.customer,
+            "tax_category": tax_category_value,
+            "supplier_province": company_province,
+            "customer_province": customer_province,
+            "doc_type": doc_type,
+            "doc_name": line.invoice,
+            "posting_date": line.posting_date,
+            "hs_code": line.hs_code,
+            "tax_classification": line.tax_classification,
+            "sales_tax_rate": line.sales_tax_rate,
+            "qty": abs(flt(line.qty)),
+            "uom": line.uom,
+            "amount": abs(flt(line.amount)),
+            "further_tax": abs(flt(line.further_tax)),
+            "st_amount": abs(flt(line.st_amount))
+        })
 
-    # ----------------------------
-    # Report Totals (Summary Bar)
-    # ----------------------------
-    
+    return data
 
-    report_summary = [
-        {"label": "Total Amount", "value": fmt_money(round(total_amount,0)), "indicator": "Green"},
-        {"label": "Total ST Amount", "value": fmt_money(round(total_st_amount,0)), "indicator": "Blue"},
-        {"label": "Total Further Tax", "value": fmt_money(round(total_further_tax,0)), "indicator": "Orange"}
-    ]
 
-    return columns, data, None, None, report_summary
+def get_grouped_invoice_lines(filters, invoice_names=None):
+    """
+    Sum Sales Invoice Item qty, amount, further tax and ST per invoice and HS
+    code description. Lines whose HS code has no Customs Tariff Number fall
+    back to the tariff number set on the Item master. ST rate, UOM and item
+    group are taken from the first line (lowest idx) of each group.
+    """
+    conditions, values = get_conditions(filters)
+    if invoice_names is not None:
+        if not invoice_names:
+            return []
+        conditions.append("si.name IN %(invoice_names)s")
+        values["invoice_names"] = tuple(invoice_names)
+
+    return frappe.db.sql(
+        """
+        SELECT
+            grouped.invoice, grouped.customer, grouped.posting_date,
+            grouped.custom_customer_st_status, grouped.is_return,
+            grouped.hs_code,
+            first_line.custom_st_rate AS sales_tax_rate,
+            first_line.uom,
+            first_line.item_group AS tax_classification,
+            grouped.qty, grouped.amount, grouped.further_tax, grouped.st_amount
+        FROM (
+            SELECT
+                si.name AS invoice, si.customer, si.posting_date,
+                si.custom_customer_st_status, si.is_return,
+                {hs_code} AS hs_code,
+                MIN(sii.idx) AS first_idx,
+                SUM(sii.qty) AS qty,
+                SUM(sii.amount) AS amount,
+                SUM(sii.custom_further_tax) AS further_tax,
+                SUM(sii.custom_st) AS st_amount
+            FROM `tabSales Invoice` si
+            INNER JOIN `tabSales Invoice Item` sii
+                ON sii.parent = si.name AND sii.parenttype = 'Sales Invoice'
+            LEFT JOIN `tabCustoms Tariff Number` ctn ON ctn.name = sii.custom_hs_code
+            LEFT JOIN `tabItem` item ON item.name = sii.item_code
+            WHERE {conditions}
+            GROUP BY si.name, si.customer, si.posting_date,
+                si.custom_customer_st_status, si.is_return, {hs_code}
+        ) grouped
+        INNER JOIN `tabSales Invoice Item` first_line
+            ON first_line.parent = grouped.invoice AND first_line.parenttype = 'Sales Invoice'
+            AND first_line.idx = grouped.first_idx
+        ORDER BY grouped.posting_date, grouped.invoice
+        """.format(hs_code=HS_CODE_EXPRESSION, conditions=" AND ".join(conditions)),
+        values,
+        as_dict=True,
+    )
@@ -0,0 +1,19 @@
+// Copyright (c) 2026, SpotLedger and contributors
+// For license information, please see license.txt
+
+frappe.query_reports["Tax Hook Timings"] = {
+	"filters": [
+		{
+			"fieldname": "hours",
+			"label": __("Last Hours"),
+			"fieldtype": "Int",
+			"default": 24
+		},
+		{
+			"fieldname": "doctype",
+			"label": __("DocType"),
+			"fieldtype": "Link",
+			"options": "DocType"
+		}
+	]
+};
@@ -0,0 +1,33 @@
+import frappe
+from frappe import _
+from frappe.utils import cint
+
+from taxcompliancepakistan.utilities.instrumentation import get_hook_timings, is_enabled
+
+
+def execute(filters=None):
+    filters = filters or {}
+    if not is_enabled():
+        frappe.msgprint(_("Hook instrumentation is disabled. Set tax_instrumentation in site config to record timings."))
+
+    data = get_hook_timings(cint(filters.get("hours")) or 24)
+    if filters.get("doctype"):
+        data = [row for row in data if row.doctype == filters.get("doctype")]
+
+    return get_columns(), data
+
+
+def get_columns():
+    return [
+        {"label": "Hook", "fieldname": "hook", "fieldtype": "Data", "width": 260},
+        {"label": "DocType", "fieldname": "doctype", "fieldtype": "Link", "options": "DocType", "width": 150},
+        {"label": "Calls", "fieldname": "calls", "fieldtype": "Int", "width": 80},
+        {"label": "p50 (ms)", "fieldname": "p50_ms", "fieldtype": "Float", "precision": 1, "width": 90},
+        {"label": "p95 (ms)", "fieldname": "p95_ms", "fieldtype": "Float", "precision": 1, "width": 90},
+        {"label": "p99 (ms)", "fieldname": "p99_ms", "fieldtype": "Float", "precision": 1, "width": 90},
+        {"label": "Avg (ms)", "fieldname": "avg_ms", "fieldtype": "Float", "precision": 1, "width": 90},
+        {"label": "Avg Queries", "fieldname": "avg_queries", "fieldtype": "Float", "precision": 1, "width": 100},
+        {"label": "Avg Cache Hits", "fieldname": "avg_cache_hits", "fieldtype": "Float", "precision": 1, "width": 110},
+        {"label": "Avg Cache Misses", "fieldname": "avg_cache_misses", "fieldtype": "Float", "precision": 1, "width": 120},
+        {"label": "Avg Child Rows", "fieldname": "avg_doc_size", "fieldtype": "Float", "precision": 1, "width": 110},
+    ]
@@ -0,0 +1,63 @@
+# Copyright (c) 2025, SpotLedger and Contributors
+# See license.txt
+
+import csv
+import io
+import os
+import tempfile
+import zipfile
+
+from frappe.tests.utils import FrappeTestCase
+
+from taxcompliancepakistan.utilities.annex_reconciliation import join_partition, normalize_ntn, reconcile
+
+
+class TestAnnexReconciliation(FrappeTestCase):
+	def test_join_partition_sorts_keys_into_result_sets(self):
+		books = {
+			("1234567", "INV-1", "84713010"): [1000.0, 180.0, {"PINV-1"}],
+			("1234567", "INV-2", "84713010"): [-500.0, -90.0, {"PINV-2"}],
+			("1234567", "INV-3", "84713010"): [200.0, 36.0, {"PINV-3"}],
+		}
+		declared = {
+			("1234567", "INV-1", "84713010"): [1000.5, 180.0, set()],
+			("1234567", "INV-2", "84713010"): [500.0, 80.0, set()],
+			("1234567", "INV-4", "84713010"): [300.0, 54.0, set()],
+		}
+
+		results = {row["invoice_no"]: (result_set, row) for result_set, row in join_partition(books, declared, 1, 1)}
+
+		self.assertEqual(results["INV-1"][0], "matched")
+		# Returns are compared as absolute amounts; the ST differs by 10
+		self.assertEqual(results["INV-2"][0], "mismatched")
+		self.assertEqual(results["INV-2"][1]["st_amount_difference"], 10)
+		self.assertEqual(results["INV-3"][0], "missing_from_declarations")
+		self.assertEqual(results["INV-4"][0], "missing_from_books")
+
+		# Within a tolerance of 10 the return matches too
+		result_sets = {row["invoice_no"]: result_set for result_set, row in join_partition(books, declared, 10, 10)}
+		self.assertEqual(result_sets["INV-2"], "matched")
+
+	def test_reconcile_writes_result_sets(self):
+		book_lines = [
+			((normalize_ntn("1234567-8"), "INV-1", "84713010"), 600.0, 108.0, "PINV-1"),
+			((normalize_ntn("1234567-8"), "INV-1", "84713010"), 400.0, 72.0, "PINV-1"),
+			((normalize_ntn("1234567"), "INV-2", "84713010"), 100.0, 18.0, "PINV-2"),
+		]
+		declared_lines = [
+			((normalize_ntn("12345678"), "INV-1", "84713010"), 1000.0, 180.0, None),
+			((normalize_ntn("1234567"), "INV-3", "84713010"), 50.0, 9.0, None),
+		]
+
+		with tempfile.TemporaryDirectory() as directory:
+			output_path = os.path.join(directory, "result.zip")
+			counts = reconcile(book_lines, declared_lines, output_path)
+
+			with zipfile.ZipFile(output_path) as result_zip:
+				matched = list(csv.DictReader(io.TextIOWrapper(result_zip.open("matched.csv"), encoding="utf-8")))
+
+		self.assertEqual(counts, {
+			"matched": 1, "mismatched": 0, "missing_from_declarations": 1, "missing_from_books": 1,
+		})
+		self.assertEqual(matched[0]["purchase_invoices"], "PINV-1")
+		self.assertEqual(float(matched[0]["books_amount"]), 1000)
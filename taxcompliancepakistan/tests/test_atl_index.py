@@ -0,0 +1,80 @@
+# Copyright (c) 2025, SpotLedger and Contributors
+# See license.txt
+
+import os
+import shutil
+import tempfile
+from datetime import datetime
+from unittest.mock import patch
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+
+from taxcompliancepakistan.utilities import atl_index
+from taxcompliancepakistan.utilities.atl_index import (
+	get_party_fbr_status,
+	import_active_taxpayer_list,
+	normalize_identifier,
+)
+from taxcompliancepakistan.utilities.wht_overrides import resolve_party_fbr_status
+
+
+class TestATLIndex(FrappeTestCase):
+	def setUp(self):
+		self.atl_dir = ("private", "atl_test")
+		patcher = patch.object(atl_index, "ATL_DIR", self.atl_dir)
+		patcher.start()
+		self.addCleanup(patcher.stop)
+		self.addCleanup(shutil.rmtree, frappe.get_site_path(*self.atl_dir), ignore_errors=True)
+
+	def test_ntn_check_digit_is_dropped_in_both_forms(self):
+		self.assertEqual(normalize_identifier("1234567-8"), 1234567)
+		self.assertEqual(normalize_identifier("12345678"), 1234567)
+		self.assertEqual(normalize_identifier("1234567"), 1234567)
+		self.assertEqual(normalize_identifier("35202-1234567-1"), 3520212345671)
+		self.assertIsNone(normalize_identifier(""))
+
+	def test_party_status_from_imported_list(self):
+		self.assertIsNone(get_party_fbr_status("Supplier", "_Test Supplier", identifiers=("1234567",)))
+
+		with tempfile.NamedTemporaryFile("w", suffix=".csv", delete=False) as f:
+			f.write("Sr,NTN,Name\n1,1234567,Active One\n2,3520212345671,Active Two\n")
+		self.addCleanup(os.remove, f.name)
+		import_active_taxpayer_list(f.name)
+
+		self.assertEqual(get_party_fbr_status("Supplier", "_Test Supplier", identifiers=("12345678", None)), "Active")
+		self.assertEqual(get_party_fbr_status("Supplier", "_Test Supplier", identifiers=(None, "35202-1234567-1")), "Active")
+		self.assertEqual(get_party_fbr_status("Supplier", "_Test Supplier", identifiers=("7654321-0", None)), "InActive")
+
+	def test_party_without_identifiers_has_no_status(self):
+		self.import_list("1234567", imported_on=datetime(2026, 1, 1))
+
+		self.assertIsNone(get_party_fbr_status("Supplier", "_Test Supplier", identifiers=(None, "")))
+
+	def test_status_set_from_the_list_follows_new_snapshots(self):
+		wht_context = frappe._dict(party_identifiers={("Supplier", "_Test Supplier"): ("1234567", None)})
+		payment_entry = frappe.new_doc("Payment Entry")
+		payment_entry.update({"party_type": "Supplier", "party": "_Test Supplier", "custom_party_fbr_status": None})
+
+		first = self.import_list("1234567", imported_on=datetime(2026, 1, 1))
+		resolve_party_fbr_status(payment_entry, wht_context)
+		self.assertEqual(payment_entry.custom_party_fbr_status, "Active")
+		self.assertEqual(payment_entry.custom_fbr_status_source, first["version"])
+
+		# The party dropped off the list in the next snapshot
+		second = self.import_list("7654321", imported_on=datetime(2026, 1, 8))
+		resolve_party_fbr_status(payment_entry, wht_context)
+		self.assertEqual(payment_entry.custom_party_fbr_status, "InActive")
+		self.assertEqual(payment_entry.custom_fbr_status_source, second["version"])
+
+		# A status typed by the user has no source and is kept
+		payment_entry.update({"custom_party_fbr_status": "Active", "custom_fbr_status_source": None})
+		resolve_party_fbr_status(payment_entry, wht_context)
+		self.assertEqual(payment_entry.custom_party_fbr_status, "Active")
+
+	def import_list(self, *identifiers, imported_on):
+		with tempfile.NamedTemporaryFile("w", suffix=".csv", delete=False) as f:
+			f.write("NTN\n" + "".join(f"{identifier}\n" for identifier in identifiers))
+		self.addCleanup(os.remove, f.name)
+		with patch("frappe.utils.now_datetime", return_value=imported_on):
+			return import_active_taxpayer_list(f.name)
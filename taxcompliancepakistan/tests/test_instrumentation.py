@@ -0,0 +1,50 @@
+# Copyright (c) 2025, SpotLedger and Contributors
+# See license.txt
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+
+from taxcompliancepakistan.utilities.instrumentation import (
+	BUCKET_COUNT,
+	count_queries,
+	get_bucket,
+	get_bucket_upper_bound,
+	get_percentile,
+)
+
+
+class TestInstrumentation(FrappeTestCase):
+	def test_duration_buckets(self):
+		self.assertEqual(get_bucket(0.1), 0)
+		self.assertEqual(get_bucket(0.5), 0)
+		self.assertEqual(get_bucket(0.75), 1)
+		self.assertEqual(get_bucket(0.76), 2)
+		self.assertEqual(get_bucket(10 ** 9), BUCKET_COUNT - 1)
+
+		# Every duration falls at or under its bucket's upper bound
+		for duration_ms in (0.3, 1, 12.5, 480, 61000):
+			bucket = get_bucket(duration_ms)
+			self.assertLessEqual(duration_ms, get_bucket_upper_bound(bucket) * (1 + 1e-9))
+			if bucket:
+				self.assertGreater(duration_ms, get_bucket_upper_bound(bucket - 1))
+
+	def test_percentiles_from_buckets(self):
+		# 90 fast calls in bucket 2, 9 in bucket 10 and one outlier in bucket 20
+		buckets = {2: 90, 10: 9, 20: 1}
+
+		self.assertEqual(get_percentile(buckets, 100, 0.5), get_bucket_upper_bound(2))
+		self.assertEqual(get_percentile(buckets, 100, 0.95), get_bucket_upper_bound(10))
+		self.assertEqual(get_percentile(buckets, 100, 0.99), get_bucket_upper_bound(10))
+		self.assertEqual(get_percentile(buckets, 100, 1), get_bucket_upper_bound(20))
+
+	def test_query_counting_is_undone_when_the_block_fails(self):
+		counters = {"queries": 0}
+		with self.assertRaises(ZeroDivisionError):
+			with count_queries(counters):
+				frappe.db.sql("SELECT 1")
+				1 / 0
+
+		self.assertEqual(counters["queries"], 1)
+		self.assertNotIn("sql", vars(frappe.db))
+		frappe.db.sql("SELECT 1")
+		self.assertEqual(counters["queries"], 1)
@@ -0,0 +1,50 @@
+# Copyright (c) 2026, SpotLedger and Contributors
+# See license.txt
+
+import frappe
+from erpnext.accounts.doctype.sales_invoice.test_sales_invoice import create_sales_invoice
+from frappe.tests.utils import FrappeTestCase
+
+from taxcompliancepakistan.utilities.tax_cache import clear_company_tax_profile
+
+FREIGHT_ACCOUNT = "_Test Account Shipping Charges - _TC"
+MANUAL_ACCOUNT = "_Test Account Excise Duty - _TC"
+
+
+class TestTaxOverrides(FrappeTestCase):
+	def setUp(self):
+		company = frappe.get_doc("Company", "_Test Company")
+		frappe.db.set_value("Company", company.name, "custom_default_freight_expense_account", FREIGHT_ACCOUNT)
+		clear_company_tax_profile(company)
+		self.addCleanup(clear_company_tax_profile, company)
+
+	def test_tax_row_edits_are_kept_until_the_items_change(self):
+		si = create_sales_invoice(qty=4, rate=250, do_not_save=True)
+		si.custom_freight_rule = "Paid By Customer"
+		si.custom_freight_amount = 300
+		si.insert()
+		fingerprint = si.custom_tax_fingerprint
+		self.assertEqual(get_tax_rows(si), [(FREIGHT_ACCOUNT, "Actual", 300)])
+
+		# A rounding adjustment and a row added by hand survive a save that
+		# changes no header or item field
+		si.taxes[0].tax_amount = 301
+		si.append("taxes", {
+			"charge_type": "Actual",
+			"account_head": MANUAL_ACCOUNT,
+			"description": "Manual",
+			"tax_amount": 100,
+		})
+		si.save()
+		self.assertEqual(get_tax_rows(si), [(FREIGHT_ACCOUNT, "Actual", 301), (MANUAL_ACCOUNT, "Actual", 100)])
+		self.assertEqual(si.custom_tax_fingerprint, fingerprint)
+
+		# An item edit rebuilds the summary rows and keeps the manual row
+		si.items[0].qty = 5
+		si.save()
+		self.assertEqual(get_tax_rows(si), [(FREIGHT_ACCOUNT, "Actual", 300), (MANUAL_ACCOUNT, "Actual", 100)])
+		self.assertNotEqual(si.custom_tax_fingerprint, fingerprint)
+
+
+def get_tax_rows(doc):
+	return [(row.account_head, row.charge_type, row.tax_amount) for row in doc.taxes]
@@ -0,0 +1,33 @@
+# Copyright (c) 2025, SpotLedger and Contributors
+# See license.txt
+
+from unittest.mock import patch
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+
+from taxcompliancepakistan.utilities import tax_trace
+from taxcompliancepakistan.utilities.tax_trace import is_traced
+
+
+class TestTaxTrace(FrappeTestCase):
+	def setUp(self):
+		patcher = patch.object(tax_trace, "get_trace_config", return_value={"level": "debug", "sample_rate": 0.5})
+		patcher.start()
+		self.addCleanup(patcher.stop)
+
+	def test_unsaved_documents_are_sampled(self):
+		docs = [frappe.get_doc({"doctype": "ToDo", "description": "trace"}) for i in range(200)]
+		traced = [is_traced("debug", doc) for doc in docs]
+
+		# Unsaved documents used to share the empty name and were all traced
+		self.assertTrue(20 < sum(traced) < 180)
+
+		# Every record of a document gets the same decision, also once it is named
+		for doc, was_traced in zip(docs[:20], traced):
+			doc.name = frappe.generate_hash()
+			self.assertEqual(is_traced("debug", doc), was_traced)
+
+	def test_warnings_are_not_sampled(self):
+		doc = frappe.get_doc({"doctype": "ToDo", "description": "trace"})
+		self.assertTrue(all(is_traced("warning", doc) for i in range(10)))
@@ -0,0 +1,125 @@
+import csv
+import os
+
+import frappe
+from frappe import _
+from frappe.utils import cint, now_datetime
+
+from taxcompliancepakistan.taxcompliancepakistan.report.annex_a import annex_a
+from taxcompliancepakistan.taxcompliancepakistan.report.annex_c import annex_c
+
+# Reports that can be exported, with the module that builds their rows
+ANNEX_REPORTS = {
+    "Annex A": annex_a,
+    "Annex C": annex_c,
+}
+
+EXPORT_FORMATS = ("csv", "xlsx")
+
+
+@frappe.whitelist()
+def export_annex(report_name, filters, file_format="csv"):
+    """
+    Queue an FBR-format export of an Annex report. The file is written in the
+    background and the user is notified with a link once it is ready.
+    """
+    validate_export(report_name, file_format)
+
+    filters = frappe.parse_json(filters) or {}
+
+    job = frappe.enqueue(
+        "taxcompliancepakistan.utilities.annex_export.build_annex_export",
+        queue="long",
+        timeout=4 * 60 * 60,
+        report_name=report_name,
+        filters=filters,
+        file_format=file_format,
+        user=frappe.session.user,
+    )
+    return job.id if job else None
+
+
+def validate_export(report_name, file_format):
+    if report_name not in ANNEX_REPORTS:
+        frappe.throw(_("Export is not available for report {0}").format(report_name))
+    if file_format not in EXPORT_FORMATS:
+        frappe.throw(_("Unsupported export format {0}").format(file_format))
+    if not frappe.get_doc("Report", report_name).is_permitted():
+        frappe.throw(_("Not permitted to export {0}").format(report_name), frappe.PermissionError)
+
+
+def build_annex_export(report_name, filters, file_format="csv", user=None, page_length=500):
+    """
+    Write every row of the report to a private file, one page of invoices at
+    a time, and notify the user with its link. Rows are never held in memory
+    together.
+    """
+    report = ANNEX_REPORTS[report_name]
+    columns = report.get_columns()
+    rows = report.iter_data(frappe._dict(filters), page_length=cint(page_length) or 500)
+
+    file_doc = save_export_file(report_name, columns, rows, file_format)
+
+    if user:
+        frappe.publish_realtime(
+            "msgprint",
+            _("{0} export is ready: {1}").format(
+                report_name, '<a href="{0}">{1}</a>'.format(file_doc.file_url, file_doc.file_name)
+            ),
+            user=user,
+        )
+
+    return file_doc.file_url
+
+
+def save_export_file(report_name, columns, rows, file_format="csv"):
+    """
+    Write rows to a private file and record it as a File.
+    """
+    file_name = "{0}-{1}.{2}".format(
+        frappe.scrub(report_name), now_datetime().strftime("%Y%m%d-%H%M%S"), file_format
+    )
+    file_path = frappe.get_site_path("private", "files", file_name)
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+
+    if file_format == "xlsx":
+        write_xlsx(file_path, report_name, columns, rows)
+    else:
+        write_csv(file_path, columns, rows)
+
+    file_doc = frappe.get_doc({
+        "doctype": "File",
+        "file_name": file_name,
+        "file_url": "/private/files/{0}".format(file_name),
+        "is_private": 1,
+    })
+    # Private and unattached, so only the user who ran the export (its owner)
+    # and System Managers can download it
+    file_doc.insert(ignore_permissions=True)
+    frappe.db.commit()
+
+    return file_doc
+
+
+def write_csv(file_path, columns, rows):
+    with open(file_path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow([col["label"] for col in columns])
+        for row in rows:
+            writer.writerow(get_row_values(columns, row))
+
+
+def write_xlsx(file_path, sheet_name, columns, rows):
+    from openpyxl import Workbook
+
+    # write_only mode streams rows to disk instead of building the sheet in memory
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet(sheet_name)
+    sheet.append([col["label"] for col in columns])
+    for row in rows:
+        sheet.append(get_row_values(columns, row))
+    workbook.save(file_path)
+
+
+def get_row_values(columns, row):
+    return [row.get(col["fieldname"]) if row.get(col["fieldname"]) is not None else "" for col in columns]
@@ -0,0 +1,344 @@
+import csv
+import os
+import re
+import tempfile
+import zipfile
+import zlib
+
+import frappe
+from frappe import _
+from frappe.utils import cint, flt, now_datetime
+
+from taxcompliancepakistan.taxcompliancepakistan.report.annex_c.annex_c import get_columns as get_annex_c_columns
+from taxcompliancepakistan.utilities.atl_index import normalize_identifier
+
+# Reconciliation of the input tax we claim (Purchase Invoice lines, as in
+# Annex A) against the sales our suppliers declared (a file in the Annex C
+# layout). Lines are joined on (supplier NTN, invoice number, HS code).
+#
+# The join is a partitioned (grace) hash join: both sides are streamed once
+# into PARTITIONS temporary files by a hash of the key, then each partition
+# pair is joined in memory on its own. Memory is bounded by the largest
+# partition, not by the size of either side.
+
+PARTITIONS = 64
+
+# Header of the supplier NTN column, when the file covers several suppliers.
+# A single supplier's own Annex C has none; its NTN then comes from the
+# `supplier` argument.
+SUPPLIER_NTN_COLUMNS = ("Seller Registration No", "Supplier Registration No", "Supplier NTN")
+
+RESULT_COLUMNS = (
+    "supplier_ntn", "invoice_no", "hs_code",
+    "books_amount", "declared_amount", "amount_difference",
+    "books_st_amount", "declared_st_amount", "st_amount_difference",
+    "purchase_invoices",
+)
+
+# Result sets, each written to its own CSV in the result zip
+RESULT_SETS = ("matched", "mismatched", "missing_from_declarations", "missing_from_books")
+
+
+def normalize_ntn(value):
+    """NTN/CNIC join key, normalized like the Active Taxpayer List"""
+    identifier = normalize_identifier(value)
+    return str(identifier) if identifier is not None else ""
+
+
+def normalize_invoice_no(value):
+    return re.sub(r"\s+", "", str(value or "")).upper()
+
+
+def normalize_hs_code(value):
+    """
+    Tariff digits of an HS code or of an "HS Code Description" such as
+    "8471.3010: Portable computers", so both sides compare equal.
+    """
+    value = str(value or "").strip()
+    match = re.match(r"\d{4}(?:\.?\d{2,4})*", value)
+    if match:
+        return match.group(0).replace(".", "")
+    return value.upper()
+
+
+def get_partition(key):
+    # crc32 rather than hash(), which is salted per process
+    return zlib.crc32("\x1f".join(key).encode()) % PARTITIONS
+
+
+# ----------------------------
+# Input streams
+# ----------------------------
+
+def iter_book_lines(company, from_date, to_date, supplier=None, page_length=1000):
+    """
+    Yield (key, amount, st_amount, invoice) of submitted local Purchase
+    Invoices, grouped per invoice and HS code in the database and paged on
+    the invoice name.
+    """
+    conditions = [
+        "pi.docstatus = 1",
+        "pi.custom_purchase_invoice_type = 'Local Purchase'",
+        "pi.company = %(company)s",
+        "pi.posting_date BETWEEN %(from_date)s AND %(to_date)s",
+        "pi.name > %(after)s",
+    ]
+    values = {"company": company, "from_date": from_date, "to_date": to_date, "after": ""}
+    if supplier:
+        conditions.append("pi.supplier = %(supplier)s")
+        values["supplier"] = supplier
+
+    while True:
+        invoices = frappe.db.sql(
+            """
+            SELECT pi.name
+            FROM `tabPurchase Invoice` pi
+            WHERE {conditions}
+            ORDER BY pi.name
+            LIMIT {limit}
+            """.format(conditions=" AND ".join(conditions), limit=int(page_length)),
+            values,
+            pluck=True,
+        )
+        if not invoices:
+            return
+
+        lines = frappe.db.sql(
+            """
+            SELECT
+                pi.name, pi.bill_no, s.tax_id, s.custom_cnic_no, pii.custom_hs_code,
+                SUM(pii.amount) AS amount, SUM(pii.custom_st) AS st_amount
+            FROM `tabPurchase Invoice` pi
+            JOIN `tabPurchase Invoice Item` pii ON pii.parent = pi.name AND pii.parenttype = 'Purchase Invoice'
+            JOIN `tabSupplier` s ON s.name = pi.supplier
+            WHERE pi.name IN %(invoices)s
+            GROUP BY pi.name, pii.custom_hs_code
+            """,
+            {"invoices": tuple(invoices)},
+            as_dict=True,
+        )
+        for line in lines:
+            key = (
+                normalize_ntn(line.tax_id or line.custom_cnic_no),
+                normalize_invoice_no(line.bill_no),
+                normalize_hs_code(line.custom_hs_code),
+            )
+            yield key, flt(line.amount), flt(line.st_amount), line.name
+
+        if len(invoices) < page_length:
+            return
+        values["after"] = invoices[-1]
+
+
+def iter_declared_lines(file_path, supplier_ntn=None):
+    """
+    Yield (key, amount, st_amount, None) of a supplier-declared sales file
+    (csv or xlsx) in the Annex C column layout.
+    """
+    rows = iter_file_rows(file_path)
+    header = [str(column or "").strip() for column in next(rows, [])]
+
+    labels = {col["fieldname"]: col["label"] for col in get_annex_c_columns()}
+    required = [labels[fieldname] for fieldname in ("doc_name", "hs_code", "amount", "st_amount")]
+    missing = [label for label in required if label not in header]
+    if missing:
+        frappe.throw(_("Columns missing in the declared sales file: {0}").format(", ".join(missing)))
+
+    invoice_idx, hs_code_idx, amount_idx, st_amount_idx = (header.index(label) for label in required)
+    ntn_idx = next((header.index(column) for column in SUPPLIER_NTN_COLUMNS if column in header), None)
+    if ntn_idx is None and not supplier_ntn:
+        frappe.throw(_("The declared sales file has no supplier NTN column; select the supplier it belongs to"))
+
+    for row in rows:
+        if not row or len(row) <= max(invoice_idx, hs_code_idx, amount_idx, st_amount_idx):
+            continue
+        ntn = normalize_ntn(row[ntn_idx]) if ntn_idx is not None and ntn_idx < len(row) else supplier_ntn
+        key = (ntn, normalize_invoice_no(row[invoice_idx]), normalize_hs_code(row[hs_code_idx]))
+        yield key, flt(row[amount_idx]), flt(row[st_amount_idx]), None
+
+
+def iter_file_rows(file_path):
+    if file_path.lower().endswith(".xlsx"):
+        from openpyxl import load_workbook
+
+        # read_only mode streams rows instead of loading the sheet
+        workbook = load_workbook(file_path, read_only=True, data_only=True)
+        try:
+            yield from workbook.active.iter_rows(values_only=True)
+        finally:
+            workbook.close()
+    else:
+        with open(file_path, newline="", encoding="utf-8-sig") as f:
+            yield from csv.reader(f)
+
+
+# ----------------------------
+# Grace hash join
+# ----------------------------
+
+def partition_lines(lines, directory, side):
+    """Write each line to the partition file of its key"""
+    files = [open(os.path.join(directory, f"{side}-{p}.csv"), "w", newline="") for p in range(PARTITIONS)]
+    try:
+        writers = [csv.writer(f) for f in files]
+        for key, amount, st_amount, invoice in lines:
+            writers[get_partition(key)].writerow(key + (amount, st_amount, invoice or ""))
+    finally:
+        for f in files:
+            f.close()
+
+
+def load_partition(path):
+    """Sum the lines of one partition file per key"""
+    totals = {}
+    with open(path, newline="") as f:
+        for ntn, invoice_no, hs_code, amount, st_amount, invoice in csv.reader(f):
+            entry = totals.setdefault((ntn, invoice_no, hs_code), [0.0, 0.0, set()])
+            entry[0] += flt(amount)
+            entry[1] += flt(st_amount)
+            if invoice:
+                entry[2].add(invoice)
+    return totals
+
+
+def join_partition(books, declared, amount_tolerance, tax_tolerance):
+    """
+    Yield (result_set, row) for the union of keys of one partition pair.
+    Book amounts are compared as absolute values, like Annex A shows them.
+    """
+    for key in books.keys() | declared.keys():
+        book = books.get(key)
+        declaration = declared.get(key)
+        row = dict(zip(("supplier_ntn", "invoice_no", "hs_code"), key))
+
+        if book:
+            row.update(books_amount=abs(book[0]), books_st_amount=abs(book[1]),
+                purchase_invoices=", ".join(sorted(book[2])))
+        if declaration:
+            row.update(declared_amount=declaration[0], declared_st_amount=declaration[1])
+
+        if not declaration:
+            yield "missing_from_declarations", row
+        elif not book:
+            yield "missing_from_books", row
+        else:
+            row["amount_difference"] = row["books_amount"] - row["declared_amount"]
+            row["st_amount_difference"] = row["books_st_amount"] - row["declared_st_amount"]
+            matched = (
+                abs(row["amount_difference"]) <= amount_tolerance
+                and abs(row["st_amount_difference"]) <= tax_tolerance
+            )
+            yield "matched" if matched else "mismatched", row
+
+
+def reconcile(book_lines, declared_lines, output_path, amount_tolerance=1, tax_tolerance=1):
+    """
+    Join the two line streams and write one CSV per result set into a zip at
+    `output_path`. Returns the number of rows in each result set.
+    """
+    counts = dict.fromkeys(RESULT_SETS, 0)
+
+    with tempfile.TemporaryDirectory(prefix="annex-reconciliation-") as directory:
+        partition_lines(book_lines, directory, "books")
+        partition_lines(declared_lines, directory, "declared")
+
+        result_files = {name: open(os.path.join(directory, f"{name}.csv"), "w", newline="") for name in RESULT_SETS}
+        try:
+            writers = {name: csv.writer(f) for name, f in result_files.items()}
+            for writer in writers.values():
+                writer.writerow(RESULT_COLUMNS)
+
+            for p in range(PARTITIONS):
+                books = load_partition(os.path.join(directory, f"books-{p}.csv"))
+                declared = load_partition(os.path.join(directory, f"declared-{p}.csv"))
+                for result_set, row in join_partition(books, declared, flt(amount_tolerance), flt(tax_tolerance)):
+                    writers[result_set].writerow([row.get(column, "") for column in RESULT_COLUMNS])
+                    counts[result_set] += 1
+        finally:
+            for f in result_files.values():
+                f.close()
+
+        with zipfile.ZipFile(output_path, "w", zipfile.ZIP_DEFLATED) as result_zip:
+            for name in RESULT_SETS:
+                result_zip.write(os.path.join(directory, f"{name}.csv"), f"{name}.csv")
+
+    return counts
+
+
+# ----------------------------
+# Background job
+# ----------------------------
+
+@frappe.whitelist()
+def enqueue_annex_reconciliation(file_url, company, from_date, to_date, supplier=None,
+        amount_tolerance=1, tax_tolerance=1):
+    """
+    Queue the reconciliation of an uploaded supplier-declared sales file
+    against our Purchase Invoices of the period. The user is notified with
+    a link to the result zip once it is ready.
+    """
+    if not frappe.get_doc("Report", "Annex A").is_permitted():
+        frappe.throw(_("Not permitted to reconcile Annex A"), frappe.PermissionError)
+    frappe.has_permission("Company", "read", company, throw=True)
+
+    file_doc = frappe.get_doc("File", {"file_url": file_url})
+    if not file_doc.is_downloadable():
+        frappe.throw(_("Not permitted to read {0}").format(file_doc.file_name), frappe.PermissionError)
+
+    job = frappe.enqueue(
+        "taxcompliancepakistan.utilities.annex_reconciliation.reconcile_annex_job",
+        queue="long",
+        timeout=4 * 60 * 60,
+        file_path=file_doc.get_full_path(),
+        company=company,
+        from_date=from_date,
+        to_date=to_date,
+        supplier=supplier,
+        amount_tolerance=flt(amount_tolerance),
+        tax_tolerance=flt(tax_tolerance),
+        user=frappe.session.user,
+    )
+    return job.id if job else None
+
+
+def reconcile_annex_job(file_path, company, from_date, to_date, supplier=None,
+        amount_tolerance=1, tax_tolerance=1, user=None):
+    supplier_ntn = None
+    if supplier:
+        tax_id, cnic = frappe.db.get_value("Supplier", supplier, ["tax_id", "custom_cnic_no"])
+        supplier_ntn = normalize_ntn(tax_id or cnic)
+
+    file_name = "annex_reconciliation-{0}.zip".format(now_datetime().strftime("%Y%m%d-%H%M%S"))
+    output_path = frappe.get_site_path("private", "files", file_name)
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+
+    counts = reconcile(
+        iter_book_lines(company, from_date, to_date, supplier),
+        iter_declared_lines(file_path, supplier_ntn),
+        output_path,
+        amount_tolerance,
+        tax_tolerance,
+    )
+
+    file_doc = frappe.get_doc({
+        "doctype": "File",
+        "file_name": file_name,
+        "file_url": "/private/files/{0}".format(file_name),
+        "is_private": 1,
+    })
+    # Private and unattached, so only the user who ran the job (its owner)
+    # and System Managers can download it
+    file_doc.insert(ignore_permissions=True)
+    frappe.db.commit()
+
+    if user:
+        frappe.publish_realtime(
+            "msgprint",
+            _("Annex reconciliation is ready: {0}<br>{1}").format(
+                '<a href="{0}">{1}</a>'.format(file_doc.file_url, file_doc.file_name),
+                "<br>".join("{0}: {1}".format(frappe.unscrub(name), cint(count)) for name, count in counts.items()),
+            ),
+            user=user,
+        )
+
+    return counts
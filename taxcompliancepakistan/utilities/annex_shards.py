@@ -0,0 +1,323 @@
+import heapq
+import multiprocessing
+import os
+import pickle
+import shutil
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import frappe
+from frappe import _
+from frappe.utils import add_months, flt, get_first_day, get_last_day, getdate
+
+from taxcompliancepakistan.taxcompliancepakistan.report.annex_c.annex_c import get_report_summary
+from taxcompliancepakistan.utilities.annex_export import (
+    ANNEX_REPORTS,
+    save_export_file,
+    validate_export,
+    write_csv,
+    write_xlsx,
+)
+
+# Annex reports for several companies and long periods, split into one
+# shard per company and month. Shards run concurrently, as RQ jobs from the
+# desk or in a local process pool from bench. Each shard streams its rows
+# to a file in the site's private/annex_shards folder, and the shard files
+# are merged into one export ordered like the report itself, one row at a
+# time, so no process holds the whole result in memory.
+
+SHARD_RUN_KEY = "taxcompliancepakistan:annex_shard_run"
+SHARD_RUN_TTL = 6 * 60 * 60
+
+# Row fields summed into the report summary
+TOTAL_FIELDS = ("amount", "st_amount", "further_tax")
+
+
+def get_shards(companies, from_date, to_date):
+    """One shard per company and calendar month of the period"""
+    from_date, to_date = getdate(from_date), getdate(to_date)
+
+    shards = []
+    month = get_first_day(from_date)
+    while month <= to_date:
+        for company in companies:
+            shards.append({
+                "company": company,
+                "from_date": max(month, from_date),
+                "to_date": min(get_last_day(month), to_date),
+            })
+        month = add_months(month, 1)
+    return shards
+
+
+def get_run_dir(run_id):
+    return frappe.get_site_path("private", "annex_shards", run_id)
+
+
+def get_shard_path(run_dir, idx):
+    return os.path.join(run_dir, f"{idx}.pickle")
+
+
+def run_shard(report_name, filters, shard, shard_path):
+    """
+    Write the rows of one shard to `shard_path` and return their totals.
+    Rows keep the report's (posting_date, invoice) order and are tagged
+    with their company.
+    """
+    shard_filters = frappe._dict(filters, **shard)
+    totals = dict.fromkeys(TOTAL_FIELDS, 0)
+
+    with open(shard_path, "wb") as f:
+        for row in ANNEX_REPORTS[report_name].iter_data(shard_filters):
+            row = dict(row, company=shard["company"])
+            for field in TOTAL_FIELDS:
+                totals[field] += flt(row.get(field))
+            pickle.dump(row, f, protocol=pickle.HIGHEST_PROTOCOL)
+    return totals
+
+
+def iter_shard_rows(shard_path):
+    with open(shard_path, "rb") as f:
+        while True:
+            try:
+                yield pickle.load(f)
+            except EOFError:
+                return
+
+
+def get_row_sort_key(row):
+    return (str(row.get("posting_date") or ""), row.get("company") or "", row.get("doc_name") or "")
+
+
+def merge_shards(shard_paths):
+    """Rows of all shard files as one ordered stream"""
+    return heapq.merge(*(iter_shard_rows(path) for path in shard_paths), key=get_row_sort_key)
+
+
+def get_merged_summary(shard_totals):
+    """Report summary of the summed (unrounded) totals of all shards"""
+    totals = dict.fromkeys(TOTAL_FIELDS, 0)
+    for shard in shard_totals:
+        for field in TOTAL_FIELDS:
+            totals[field] += shard[field]
+    return get_report_summary(totals["amount"], totals["st_amount"], totals["further_tax"])
+
+
+def get_columns(report_name, companies):
+    columns = ANNEX_REPORTS[report_name].get_columns()
+    if len(companies) > 1:
+        columns = [{"label": "Company", "fieldname": "company", "fieldtype": "Link", "options": "Company"}] + columns
+    return columns
+
+
+# ----------------------------
+# Background (RQ) mode
+# ----------------------------
+
+@frappe.whitelist()
+def enqueue_sharded_annex(report_name, filters, companies=None, file_format="csv"):
+    """
+    Queue one job per company and month of an Annex report. The job that
+    finishes last merges the shards into one file and notifies the user;
+    progress is published as the `tax_annex_progress` realtime event.
+    """
+    validate_export(report_name, file_format)
+
+    filters = frappe._dict(frappe.parse_json(filters) or {})
+    companies = frappe.parse_json(companies) if companies else [filters.company]
+    companies = [company for company in companies if company]
+    if not companies or not (filters.from_date and filters.to_date):
+        frappe.throw(_("Companies, From Date and To Date are required"))
+    for company in companies:
+        frappe.has_permission("Company", "read", company, throw=True)
+
+    shards = get_shards(companies, filters.from_date, filters.to_date)
+    run_id = frappe.generate_hash(length=12)
+    os.makedirs(get_run_dir(run_id), exist_ok=True)
+    frappe.cache().set_value(
+        f"{SHARD_RUN_KEY}:{run_id}",
+        {
+            "report_name": report_name,
+            "filters": filters,
+            "companies": companies,
+            "file_format": file_format,
+            "user": frappe.session.user,
+            "total": len(shards),
+        },
+        expires_in_sec=SHARD_RUN_TTL,
+    )
+
+    for idx, shard in enumerate(shards):
+        frappe.enqueue(
+            "taxcompliancepakistan.utilities.annex_shards.run_shard_job",
+            queue="long",
+            timeout=4 * 60 * 60,
+            run_id=run_id,
+            idx=idx,
+            shard=shard,
+        )
+
+    return {"run_id": run_id, "shards": len(shards)}
+
+
+def run_shard_job(run_id, idx, shard):
+    cache = frappe.cache()
+    run = cache.get_value(f"{SHARD_RUN_KEY}:{run_id}")
+    if not run:
+        return
+
+    # A sibling shard failed: write nothing, only count this job as finished
+    run_dir = get_run_dir(run_id)
+    if os.path.exists(get_failure_marker(run_dir)):
+        finish_shard_job(run_id, run)
+        return
+
+    try:
+        totals = run_shard(run["report_name"], run["filters"], shard, get_shard_path(run_dir, idx))
+    except Exception:
+        # The folder is left to the last job to finish, as siblings may
+        # still be writing to it
+        open(get_failure_marker(run_dir), "w").close()
+        # Final progress event, so the desk closes its progress dialog
+        frappe.publish_realtime(
+            "tax_annex_progress",
+            {"run_id": run_id, "report_name": run["report_name"], "failed": 1, "total": run["total"]},
+            user=run["user"],
+        )
+        frappe.publish_realtime(
+            "msgprint",
+            _("{0} for {1} from {2} to {3} failed").format(
+                run["report_name"], shard["company"], shard["from_date"], shard["to_date"]
+            ),
+            user=run["user"],
+        )
+        finish_shard_job(run_id, run)
+        raise
+
+    cache.set_value(f"{SHARD_RUN_KEY}:{run_id}:{idx}", totals, expires_in_sec=SHARD_RUN_TTL)
+    finish_shard_job(run_id, run)
+
+
+def get_failure_marker(run_dir):
+    return os.path.join(run_dir, "failed")
+
+
+def finish_shard_job(run_id, run):
+    """
+    Count a finished shard job, whatever its outcome. The job that finishes
+    last merges the shards, or only cleans up when a shard failed, so the
+    folder is never removed while another job may write to it.
+    """
+    cache = frappe.cache()
+
+    # Atomic across workers, so exactly one job sees the last shard done
+    done_key = cache.make_key(f"{SHARD_RUN_KEY}:{run_id}:done")
+    done = cache.incr(done_key)
+    cache.expire(done_key, SHARD_RUN_TTL)
+
+    failed = os.path.exists(get_failure_marker(get_run_dir(run_id)))
+    if not failed:
+        frappe.publish_realtime(
+            "tax_annex_progress",
+            {"run_id": run_id, "report_name": run["report_name"], "done": done, "total": run["total"]},
+            user=run["user"],
+        )
+
+    if done < run["total"]:
+        return
+    if failed:
+        clear_sharded_annex(run_id, run)
+    else:
+        finish_sharded_annex(run_id, run)
+
+
+def finish_sharded_annex(run_id, run):
+    cache = frappe.cache()
+    run_dir = get_run_dir(run_id)
+    total_keys = [f"{SHARD_RUN_KEY}:{run_id}:{idx}" for idx in range(run["total"])]
+    report_summary = get_merged_summary([cache.get_value(key) for key in total_keys])
+
+    try:
+        file_doc = save_export_file(
+            run["report_name"],
+            get_columns(run["report_name"], run["companies"]),
+            merge_shards([get_shard_path(run_dir, idx) for idx in range(run["total"])]),
+            run["file_format"],
+        )
+    finally:
+        clear_sharded_annex(run_id, run)
+
+    frappe.publish_realtime(
+        "msgprint",
+        _("{0} is ready: {1}<br>{2}").format(
+            run["report_name"],
+            '<a href="{0}">{1}</a>'.format(file_doc.file_url, file_doc.file_name),
+            "<br>".join("{label}: {value}".format(**summary) for summary in report_summary),
+        ),
+        user=run["user"],
+    )
+
+
+def clear_sharded_annex(run_id, run):
+    """Remove the shard files and cached state of a run"""
+    shutil.rmtree(get_run_dir(run_id), ignore_errors=True)
+    frappe.cache().delete_value(
+        [f"{SHARD_RUN_KEY}:{run_id}:{idx}" for idx in range(run["total"])]
+        + [f"{SHARD_RUN_KEY}:{run_id}", f"{SHARD_RUN_KEY}:{run_id}:done"]
+    )
+
+
+# ----------------------------
+# Local process pool mode (bench)
+# ----------------------------
+
+def init_shard_worker(site, sites_path):
+    frappe.init(site=site, sites_path=sites_path)
+    frappe.connect()
+
+
+def run_sharded_annex_locally(report_name, filters, companies, output, processes=None, on_progress=None):
+    """
+    Run the shards of an Annex report in a local process pool, each process
+    with its own site connection, and stream the merged rows to `output`
+    (.csv or .xlsx). Returns (row count, report_summary).
+    """
+    filters = dict(filters)
+    shards = get_shards(companies, filters["from_date"], filters["to_date"])
+    run_dir = get_run_dir(frappe.generate_hash(length=12))
+    os.makedirs(run_dir, exist_ok=True)
+
+    try:
+        shard_totals = [None] * len(shards)
+        with ProcessPoolExecutor(
+            max_workers=processes,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=init_shard_worker,
+            initargs=(frappe.local.site, frappe.local.sites_path),
+        ) as pool:
+            futures = {
+                pool.submit(run_shard, report_name, filters, shard, get_shard_path(run_dir, idx)): idx
+                for idx, shard in enumerate(shards)
+            }
+            for done, future in enumerate(as_completed(futures), 1):
+                shard_totals[futures[future]] = future.result()
+                if on_progress:
+                    on_progress(done, len(shards))
+
+        row_count = 0
+
+        def counted(rows):
+            nonlocal row_count
+            for row in rows:
+                row_count += 1
+                yield row
+
+        columns = get_columns(report_name, companies)
+        rows = counted(merge_shards([get_shard_path(run_dir, idx) for idx in range(len(shards))]))
+        if output.endswith(".xlsx"):
+            write_xlsx(output, report_name, columns, rows)
+        else:
+            write_csv(output, columns, rows)
+    finally:
+        shutil.rmtree(run_dir, ignore_errors=True)
+
+    return row_count, get_merged_summary(shard_totals)
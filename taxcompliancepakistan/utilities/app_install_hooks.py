@@ -1,5 +1,6 @@
 import frappe
-# Functions in this will run when app will first install
+from frappe.utils import add_months, getdate, today
+# Functions in this will run when app will first install and after migrations
 
 
 def create_party_type(party_type, account_type):
@@ -48,3 +49,110 @@ def create_party_type(party_type, account_type):
         
     except Exception as e:
         frappe.log_error(f"Error creating Party Type {party_type}: {str(e)}", "Party Type Creation Error")
+
+
+# Indexes the Annex reports and WHT lookups filter on, as
+# (doctype, index name, columns). Created after every migrate.
+TAX_INDEXES = (
+    ("Purchase Invoice", "purchase_invoice_type_posting_date_index", ("custom_purchase_invoice_type", "posting_date")),
+    ("Payment Entry Reference", "custom_wht_section_index", ("custom_wht_section",)),
+    ("WHT Exemption", "party_exemption_from_section_index", ("party", "exemption_from_section")),
+    ("Address", "is_your_company_address_index", ("is_your_company_address", "address_type")),
+)
+
+# Hot path queries whose plans `bench check-tax-indexes` prints
+QUERY_PLANS = {
+    "Annex A: Purchase Invoices": """
+        SELECT name, supplier, posting_date
+        FROM `tabPurchase Invoice`
+        WHERE docstatus = 1 AND custom_purchase_invoice_type = 'Local Purchase'
+            AND posting_date BETWEEN %(from_date)s AND %(to_date)s AND company = %(company)s
+        ORDER BY posting_date, name
+        LIMIT 500
+    """,
+    "Annex C: grouped Sales Invoice lines": """
+        SELECT si.name, {hs_code} AS hs_code, SUM(sii.amount), SUM(sii.custom_st)
+        FROM `tabSales Invoice` si
+        INNER JOIN `tabSales Invoice Item` sii
+            ON sii.parent = si.name AND sii.parenttype = 'Sales Invoice'
+        LEFT JOIN `tabCustoms Tariff Number` ctn ON ctn.name = sii.custom_hs_code
+        LEFT JOIN `tabItem` item ON item.name = sii.item_code
+        WHERE si.docstatus = 1 AND si.posting_date BETWEEN %(from_date)s AND %(to_date)s
+            AND si.company = %(company)s
+        GROUP BY si.name, {hs_code}
+        ORDER BY si.posting_date, si.name
+    """,
+    "Annex A/C: company address": """
+        SELECT custom_province
+        FROM `tabAddress`
+        WHERE is_your_company_address = 1 AND address_type = 'Billing'
+        LIMIT 1
+    """,
+    "WHT: Payment Entry References by section": """
+        SELECT parent, allocated_amount
+        FROM `tabPayment Entry Reference`
+        WHERE custom_wht_section = %(wht_section)s
+    """,
+    "WHT: draft Payment Entries to re-rate": """
+        SELECT DISTINCT pe.name
+        FROM `tabPayment Entry Reference` per
+        INNER JOIN `tabPayment Entry` pe ON pe.name = per.parent
+        WHERE per.custom_wht_section = %(wht_section)s AND per.parenttype = 'Payment Entry'
+            AND pe.docstatus = 0 AND pe.posting_date >= %(from_date)s
+    """,
+    "WHT: party exemptions": """
+        SELECT party, exemption_from_section, company, valid_from, valid_upto
+        FROM `tabWHT Exemption`
+        WHERE docstatus = 1 AND party = %(party)s AND exemption_from_section = %(wht_section)s
+    """,
+}
+
+
+## Hooks that will be executed after every bench migrate
+
+def after_migrate():
+    create_tax_indexes()
+
+
+def create_tax_indexes():
+    """
+    Create the missing indexes of TAX_INDEXES and check that every one of
+    them exists afterwards. Indexes on custom fields that are not synced yet
+    are skipped and picked up by the next migrate.
+    """
+    missing = []
+    for doctype, index_name, columns in TAX_INDEXES:
+        if not all(frappe.db.has_column(doctype, column) for column in columns):
+            missing.append(index_name)
+            continue
+
+        frappe.db.add_index(doctype, list(columns), index_name)
+        if not frappe.db.has_index(f"tab{doctype}", index_name):
+            missing.append(index_name)
+
+    if missing:
+        frappe.log_error(f"Could not create tax indexes: {', '.join(missing)}", "Tax Index Creation Error")
+
+    return missing
+
+
+def get_query_plans(company=None, from_date=None, to_date=None):
+    """
+    Return {title: EXPLAIN rows} of every QUERY_PLANS query, run with sample
+    values from the site so the optimizer sees realistic selectivity.
+    """
+    from taxcompliancepakistan.taxcompliancepakistan.report.annex_c.annex_c import HS_CODE_EXPRESSION
+
+    to_date = getdate(to_date or today())
+    values = {
+        "company": company or frappe.defaults.get_global_default("company"),
+        "from_date": getdate(from_date) if from_date else add_months(to_date, -1),
+        "to_date": to_date,
+        "wht_section": frappe.db.get_value("WHT Sections", {}, "name"),
+        "party": frappe.db.get_value("WHT Exemption", {}, "party"),
+    }
+
+    return {
+        title: frappe.db.sql("EXPLAIN " + query.format(hs_code=HS_CODE_EXPRESSION), values, as_dict=True)
+        for title, query in QUERY_PLANS.items()
+    }
@@ -0,0 +1,213 @@
+import csv
+import json
+import os
+import re
+
+import frappe
+import numpy as np
+from frappe import _
+from frappe.utils import now
+
+# Local copy of the FBR Active Taxpayer List (ATL). The list is imported
+# into a sorted array of uint64 identifiers (NTN or CNIC digits) on disk and
+# memory-mapped for lookups, so resolving a party's status is a binary
+# search over a shared page-cached file rather than a database query.
+#
+# Each import writes a new versioned snapshot and then atomically switches
+# current.json to it; readers pick up the new snapshot on their next lookup.
+# The newest KEEP_SNAPSHOTS snapshots are kept for rollback.
+
+ATL_DIR = ("private", "atl")
+CURRENT_FILE = "current.json"
+KEEP_SNAPSHOTS = 3
+
+# Header names of the identifier column in FBR's ATL downloads
+IDENTIFIER_COLUMNS = ("NTN", "CNIC", "NTN/CNIC", "REGISTRATION NO", "REGISTRATION_NO")
+
+# Process-local (version, memory map) of the current snapshot by current.json mtime
+_snapshots = {}
+
+
+def get_atl_dir():
+    return frappe.get_site_path(*ATL_DIR)
+
+
+def normalize_identifier(value):
+    """
+    Digits of an NTN or CNIC as an int. NTNs written with their check digit,
+    "1234567-8" or "12345678", are reduced to the 7 digit NTN the ATL lists.
+    """
+    if not value:
+        return None
+    digits = re.sub(r"\D", "", str(value))
+    if len(digits) == 8:
+        digits = digits[:7]
+    return int(digits) if digits and len(digits) <= 19 else None
+
+
+def import_active_taxpayer_list(file_path, identifier_column=None):
+    """
+    Build a new snapshot from an ATL CSV file and make it current. Returns
+    the snapshot info written to current.json.
+    """
+    with open(file_path, newline="", encoding="utf-8-sig") as f:
+        reader = csv.reader(f)
+        header = [column.strip().upper() for column in next(reader)]
+
+        columns = [identifier_column.upper()] if identifier_column else IDENTIFIER_COLUMNS
+        indexes = [header.index(column) for column in columns if column in header]
+        if not indexes:
+            frappe.throw(_("No NTN or CNIC column found in {0}").format(os.path.basename(file_path)))
+
+        identifiers = np.fromiter(iter_identifiers(reader, indexes), dtype=np.uint64)
+
+    # np.unique sorts and removes duplicates in one pass
+    identifiers = np.unique(identifiers)
+
+    atl_dir = get_atl_dir()
+    os.makedirs(atl_dir, exist_ok=True)
+    version = frappe.utils.now_datetime().strftime("%Y%m%d%H%M%S")
+    snapshot_path = os.path.join(atl_dir, f"atl-{version}.idx")
+    identifiers.tofile(snapshot_path)
+
+    info = {
+        "version": version,
+        "path": os.path.basename(snapshot_path),
+        "count": int(identifiers.size),
+        "source": os.path.basename(file_path),
+        "imported_on": now(),
+    }
+    current_path = os.path.join(atl_dir, CURRENT_FILE)
+    with open(current_path + ".tmp", "w") as f:
+        json.dump(info, f)
+    os.replace(current_path + ".tmp", current_path)
+
+    prune_snapshots(atl_dir, info["path"])
+    return info
+
+
+def iter_identifiers(reader, indexes):
+    for row in reader:
+        for i in indexes:
+            if i < len(row):
+                identifier = normalize_identifier(row[i])
+                if identifier is not None:
+                    yield identifier
+
+
+def prune_snapshots(atl_dir, current):
+    snapshots = sorted(f for f in os.listdir(atl_dir) if f.startswith("atl-") and f.endswith(".idx"))
+    for name in snapshots[:-KEEP_SNAPSHOTS]:
+        if name != current:
+            os.remove(os.path.join(atl_dir, name))
+
+
+def load_current_snapshot():
+    """
+    (version, memory map) of the current snapshot, or (None, None) when no
+    list was imported. current.json is only re-read when its mtime changes.
+    """
+    current_path = os.path.join(get_atl_dir(), CURRENT_FILE)
+    try:
+        mtime = os.stat(current_path).st_mtime_ns
+    except FileNotFoundError:
+        return None, None
+
+    cache_key = (current_path, mtime)
+    current = _snapshots.get(cache_key)
+    if current is None:
+        with open(current_path) as f:
+            info = json.load(f)
+        snapshot_path = os.path.join(get_atl_dir(), info["path"])
+        if info["count"]:
+            snapshot = np.memmap(snapshot_path, dtype=np.uint64, mode="r")
+        else:
+            snapshot = np.zeros(0, dtype=np.uint64)
+        current = (info["version"], snapshot)
+        _snapshots.clear()
+        _snapshots[cache_key] = current
+    return current
+
+
+def get_current_snapshot():
+    """Memory map of the current snapshot, or None when no list was imported"""
+    return load_current_snapshot()[1]
+
+
+def get_current_snapshot_version():
+    """Version of the current snapshot, or None when no list was imported"""
+    return load_current_snapshot()[0]
+
+
+def is_active_taxpayer(*identifiers):
+    """
+    True when any of the identifiers is on the ATL, False when none is, None
+    when no list has been imported on this site.
+    """
+    snapshot = get_current_snapshot()
+    if snapshot is None:
+        return None
+
+    for identifier in identifiers:
+        key = normalize_identifier(identifier)
+        if key is None:
+            continue
+        i = int(np.searchsorted(snapshot, np.uint64(key)))
+        if i < snapshot.size and snapshot[i] == key:
+            return True
+    return False
+
+
+def get_party_fbr_status(party_type, party, identifiers=None):
+    """
+    "Active"/"InActive" of a Supplier or Customer from its tax_id and
+    custom_cnic_no, or None when no ATL has been imported or the party has
+    neither identifier.
+    """
+    if identifiers is None:
+        identifiers = frappe.get_cached_value(party_type, party, ["tax_id", "custom_cnic_no"]) or ()
+
+    # Without an NTN or CNIC there is nothing to look up
+    if all(normalize_identifier(identifier) is None for identifier in identifiers):
+        return None
+
+    active = is_active_taxpayer(*identifiers)
+    if active is None:
+        return None
+    return "Active" if active else "InActive"
+
+
+@frappe.whitelist()
+def enqueue_atl_import(file_url, identifier_column=None):
+    """Import an uploaded ATL file in the background"""
+    frappe.only_for(("Accounts Manager", "System Manager"))
+    file_doc = frappe.get_doc("File", {"file_url": file_url})
+
+    frappe.enqueue(
+        "taxcompliancepakistan.utilities.atl_index.import_active_taxpayer_list_job",
+        queue="long",
+        timeout=60 * 60,
+        file_path=file_doc.get_full_path(),
+        identifier_column=identifier_column,
+        user=frappe.session.user,
+    )
+
+
+def import_active_taxpayer_list_job(file_path, identifier_column=None, user=None):
+    info = import_active_taxpayer_list(file_path, identifier_column)
+    if user:
+        frappe.publish_realtime(
+            "msgprint",
+            _("Active Taxpayer List imported: {0} taxpayers (snapshot {1})").format(info["count"], info["version"]),
+            user=user,
+        )
+
+
+@frappe.whitelist()
+def get_atl_status():
+    """Info of the current snapshot, or None"""
+    current_path = os.path.join(get_atl_dir(), CURRENT_FILE)
+    if not os.path.exists(current_path):
+        return None
+    with open(current_path) as f:
+        return json.load(f)
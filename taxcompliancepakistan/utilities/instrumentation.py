@@ -0,0 +1,232 @@
+import math
+import time
+from contextlib import contextmanager, nullcontext
+from functools import wraps
+
+import frappe
+from frappe.utils import add_to_date, now_datetime
+
+# Optional timing of this app's document hooks. Enable per site with
+#   bench --site mysite set-config tax_instrumentation 1
+# Every instrumented call then records its duration, SQL query count, tax
+# cache hits and misses and document size into hourly redis histograms,
+# which the Tax Hook Timings report reads. When disabled an instrumented
+# call costs one site config lookup.
+
+HISTOGRAM_KEY = "taxcompliancepakistan:hook_timings"
+RETENTION_HOURS = 48
+
+# Duration buckets grow geometrically from 0.5 ms, so percentiles are
+# accurate to within one bucket (50%) from sub-millisecond calls to minutes
+FIRST_BUCKET_MS = 0.5
+BUCKET_FACTOR = 1.5
+BUCKET_COUNT = 32
+
+COUNTERS = ("queries", "cache_hits", "cache_misses")
+
+
+def is_enabled():
+    return bool(frappe.conf.get("tax_instrumentation"))
+
+
+def instrumented(fn):
+    """
+    Decorator for hook functions. The first argument, when it is a
+    Document, gives the doctype and size the call is recorded under.
+    """
+    hook = "{0}.{1}".format(fn.__module__.rsplit(".", 1)[-1], fn.__name__)
+
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        if not frappe.conf.get("tax_instrumentation"):
+            return fn(*args, **kwargs)
+
+        doc = args[0] if args else None
+        with span(hook, getattr(doc, "doctype", None), doc):
+            return fn(*args, **kwargs)
+
+    return wrapper
+
+
+@contextmanager
+def span(name, doctype=None, doc=None):
+    """
+    Record the block as `name`. Spans nest: an outer span's numbers include
+    those of the spans inside it.
+    """
+    if not is_enabled():
+        yield
+        return
+
+    state = get_tracking_state()
+    counters = state["counters"]
+    before = dict(counters)
+    outermost = state["depth"] == 0
+    state["depth"] += 1
+    start = time.perf_counter()
+    try:
+        # The outermost span counts the queries of all spans inside it
+        with count_queries(counters) if outermost else nullcontext():
+            yield
+    finally:
+        duration_ms = (time.perf_counter() - start) * 1000
+        state["depth"] -= 1
+        if outermost:
+            frappe.local.tax_instrumentation = None
+        try:
+            record(
+                name, doctype, duration_ms,
+                {counter: counters[counter] - before[counter] for counter in COUNTERS},
+                get_doc_size(doc),
+            )
+        except Exception:
+            # Instrumentation must never fail the document operation
+            pass
+
+
+def get_tracking_state():
+    state = getattr(frappe.local, "tax_instrumentation", None)
+    if not state:
+        state = frappe.local.tax_instrumentation = {
+            "depth": 0,
+            "counters": dict.fromkeys(COUNTERS, 0),
+        }
+    return state
+
+
+@contextmanager
+def count_queries(counters):
+    """
+    Count the SQL queries of the block into counters["queries"] by wrapping
+    frappe.db.sql of the current connection, which is restored on exit
+    however the block ends. Queries frappe.db.sql issues from inside a
+    counted call are not counted again.
+    """
+    db = frappe.db
+    sql = db.sql
+    patched = "sql" in vars(db)
+    active = 0
+
+    def counted_sql(*args, **kwargs):
+        nonlocal active
+        if not active:
+            counters["queries"] += 1
+        active += 1
+        try:
+            return sql(*args, **kwargs)
+        finally:
+            active -= 1
+
+    db.sql = counted_sql
+    try:
+        yield
+    finally:
+        if patched:
+            db.sql = sql
+        else:
+            del db.sql
+
+
+def record_cache_lookup(hit):
+    state = getattr(frappe.local, "tax_instrumentation", None)
+    if state:
+        state["counters"]["cache_hits" if hit else "cache_misses"] += 1
+
+
+def get_doc_size(doc):
+    """Number of child table rows of a Document, 0 for anything else"""
+    if not hasattr(doc, "meta"):
+        return 0
+    return sum(len(doc.get(df.fieldname) or []) for df in doc.meta.get_table_fields())
+
+
+def get_bucket(duration_ms):
+    if duration_ms <= FIRST_BUCKET_MS:
+        return 0
+    return min(math.ceil(math.log(duration_ms / FIRST_BUCKET_MS, BUCKET_FACTOR)), BUCKET_COUNT - 1)
+
+
+def get_bucket_upper_bound(bucket):
+    return FIRST_BUCKET_MS * BUCKET_FACTOR ** bucket
+
+
+def get_hour_key(dt):
+    return frappe.cache().make_key("{0}|{1}".format(HISTOGRAM_KEY, dt.strftime("%Y%m%d%H")))
+
+
+def record(name, doctype, duration_ms, counters, doc_size):
+    """
+    Add one call to the current hour's histogram, in a single redis round
+    trip. Fields are "<name>::<doctype>::<metric>".
+    """
+    cache = frappe.cache()
+    key = get_hour_key(now_datetime())
+    prefix = "{0}::{1}".format(name, doctype or "")
+
+    pipe = cache.pipeline()
+    pipe.hincrby(key, "{0}::bucket{1}".format(prefix, get_bucket(duration_ms)), 1)
+    pipe.hincrby(key, prefix + "::calls", 1)
+    pipe.hincrbyfloat(key, prefix + "::duration_ms", duration_ms)
+    pipe.hincrby(key, prefix + "::doc_size", doc_size)
+    for counter, value in counters.items():
+        pipe.hincrby(key, "{0}::{1}".format(prefix, counter), value)
+    pipe.expire(key, RETENTION_HOURS * 60 * 60)
+    pipe.execute()
+
+
+def get_hook_timings(hours=24):
+    """
+    Merge the histograms of the last `hours` hours into one row per
+    (hook, doctype) with call count, percentiles and averages.
+    """
+    cache = frappe.cache()
+    end = now_datetime()
+    keys = [get_hour_key(add_to_date(end, hours=-h)) for h in range(min(int(hours), RETENTION_HOURS))]
+
+    pipe = cache.pipeline()
+    for key in keys:
+        pipe.hgetall(key)
+
+    stats = {}
+    for histogram in pipe.execute():
+        for field, value in histogram.items():
+            name, doctype, metric = frappe.safe_decode(field).rsplit("::", 2)
+            entry = stats.setdefault((name, doctype), {"buckets": {}})
+            if metric.startswith("bucket"):
+                bucket = int(metric[len("bucket"):])
+                entry["buckets"][bucket] = entry["buckets"].get(bucket, 0) + int(value)
+            else:
+                entry[metric] = entry.get(metric, 0) + float(value)
+
+    rows = []
+    for (name, doctype), entry in stats.items():
+        calls = entry.get("calls") or 0
+        if not calls:
+            continue
+
+        rows.append(frappe._dict(
+            hook=name,
+            doctype=doctype or None,
+            calls=int(calls),
+            p50_ms=get_percentile(entry["buckets"], calls, 0.5),
+            p95_ms=get_percentile(entry["buckets"], calls, 0.95),
+            p99_ms=get_percentile(entry["buckets"], calls, 0.99),
+            avg_ms=entry.get("duration_ms", 0) / calls,
+            avg_queries=entry.get("queries", 0) / calls,
+            avg_cache_hits=entry.get("cache_hits", 0) / calls,
+            avg_cache_misses=entry.get("cache_misses", 0) / calls,
+            avg_doc_size=entry.get("doc_size", 0) / calls,
+        ))
+
+    return sorted(rows, key=lambda row: row.p95_ms, reverse=True)
+
+
+def get_percentile(buckets, calls, quantile):
+    """Upper bound of the bucket holding the given quantile of calls"""
+    target = quantile * calls
+    seen = 0
+    for bucket in sorted(buckets):
+        seen += buckets[bucket]
+        if seen >= target:
+            return get_bucket_upper_bound(bucket)
+    return get_bucket_upper_bound(BUCKET_COUNT - 1)
@@ -0,0 +1,306 @@
+import io
+import multiprocessing
+import os
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+
+import frappe
+from frappe import _
+from frappe.utils import now_datetime
+
+# Payment Advice PDFs for a whole payment run. Everything the print format
+# looks up per document (company, address, references, invoice dates) is
+# prefetched in bulk and passed to the template as `advice`, the template is
+# compiled once per process together with Frappe's print stylesheet and the
+# default letter head, and HTML and PDF rendering run in a local process
+# pool. Output is one PDF attached to each Payment Entry, one merged
+# PDF, or a zip of the individual PDFs.
+
+PRINT_FORMAT = "Payment Advice"
+OUTPUTS = ("attach", "merged", "zip")
+
+# Page shell of Frappe's printview, without the desk action banner
+PRINT_WRAPPER = (
+    '<!DOCTYPE html><html lang="{lang}"><head><meta charset="utf-8">'
+    '<meta name="viewport" content="width=device-width, initial-scale=1.0">'
+    "<style>{style}</style></head>"
+    '<body><div class="print-format-gutter"><div class="print-format">{body}</div></div></body></html>'
+)
+
+# Payment Entries prefetched and rendered together
+CHUNK_SIZE = 200
+
+REFERENCE_FIELDS = [
+    "parent", "reference_doctype", "reference_name", "allocated_amount",
+    "custom_wht_section", "custom_wht_amount",
+]
+PAYMENT_ENTRY_FIELDS = [
+    "name", "company", "party", "party_type", "posting_date", "mode_of_payment", "reference_no",
+    "paid_amount", "custom_party_fbr_status",
+]
+
+
+@frappe.whitelist()
+def enqueue_payment_advices(names=None, filters=None, output="merged"):
+    """
+    Queue Payment Advice PDFs for the given Payment Entries, or for those
+    matching `filters`. Progress is published as the
+    `payment_advice_progress` realtime event, tagged with the returned run id.
+    """
+    if output not in OUTPUTS:
+        frappe.throw(_("Unsupported output {0}").format(output))
+
+    names = frappe.parse_json(names) if names else frappe.get_list(
+        "Payment Entry",
+        filters=frappe.parse_json(filters) or {},
+        order_by="posting_date asc, name asc",
+        pluck="name",
+    )
+    if not names:
+        frappe.throw(_("No Payment Entries to print"))
+    for name in names:
+        frappe.has_permission("Payment Entry", "print", name, throw=True)
+
+    run_id = frappe.generate_hash(length=12)
+    frappe.enqueue(
+        "taxcompliancepakistan.utilities.payment_advice.render_payment_advices_job",
+        queue="long",
+        timeout=4 * 60 * 60,
+        names=names,
+        output=output,
+        user=frappe.session.user,
+        run_id=run_id,
+    )
+    return {"run_id": run_id, "total": len(names)}
+
+
+def render_payment_advices_job(names, output="merged", user=None, processes=None, run_id=None):
+    total = len(names)
+
+    def on_progress(done):
+        if user:
+            frappe.publish_realtime(
+                "payment_advice_progress", {"run_id": run_id, "done": done, "total": total}, user=user
+            )
+
+    try:
+        file_doc = render_payment_advices(names, output, processes, on_progress)
+    except Exception:
+        # Final progress event, so the desk closes its progress dialog
+        if user:
+            frappe.publish_realtime(
+                "payment_advice_progress", {"run_id": run_id, "failed": 1, "total": total}, user=user
+            )
+            frappe.publish_realtime("msgprint", _("Printing {0} Payment Advices failed").format(total), user=user)
+        raise
+
+    if user:
+        frappe.publish_realtime(
+            "msgprint",
+            _("{0} Payment Advices are ready{1}").format(
+                total,
+                ': <a href="{0}">{1}</a>'.format(file_doc.file_url, file_doc.file_name) if file_doc else "",
+            ),
+            user=user,
+        )
+
+
+def render_payment_advices(names, output="merged", processes=None, on_progress=None):
+    """
+    Render the advices of `names` in order. Returns the merged or zip File,
+    or None when each PDF is attached to its Payment Entry.
+    """
+    print_format = frappe.get_cached_doc("Print Format", PRINT_FORMAT)
+    template_key = (PRINT_FORMAT, str(print_format.modified))
+
+    writer = None
+    if output == "merged":
+        from pypdf import PdfWriter
+
+        writer = PdfWriter()
+    elif output == "zip":
+        zip_name, zip_path = get_output_path("zip")
+        writer = zipfile.ZipFile(zip_path, "w", zipfile.ZIP_DEFLATED)
+
+    done = 0
+    with ProcessPoolExecutor(
+        max_workers=processes,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=init_render_worker,
+        initargs=(frappe.local.site, frappe.local.sites_path),
+    ) as pool:
+        for start in range(0, len(names), CHUNK_SIZE):
+            chunk = names[start:start + CHUNK_SIZE]
+            contexts = get_advice_contexts(chunk)
+
+            # map keeps the order of the chunk, so merged output is in order
+            for name, pdf in zip(chunk, pool.map(render_advice, [template_key] * len(chunk), contexts, chunksize=4)):
+                if output == "attach":
+                    attach_advice(name, pdf)
+                elif output == "merged":
+                    writer.append(io.BytesIO(pdf))
+                else:
+                    writer.writestr(f"{name}.pdf", pdf)
+
+                done += 1
+                if on_progress and (done % 20 == 0 or done == len(names)):
+                    on_progress(done)
+
+            if output == "attach":
+                frappe.db.commit()
+
+    if output == "attach":
+        return None
+
+    if output == "merged":
+        file_name, file_path = get_output_path("pdf")
+        with open(file_path, "wb") as f:
+            writer.write(f)
+    else:
+        writer.close()
+        file_name = zip_name
+
+    file_doc = frappe.get_doc({
+        "doctype": "File",
+        "file_name": file_name,
+        "file_url": "/private/files/{0}".format(file_name),
+        "is_private": 1,
+    })
+    file_doc.insert(ignore_permissions=True)
+    frappe.db.commit()
+    return file_doc
+
+
+def get_output_path(extension):
+    file_name = "payment_advices-{0}.{1}".format(now_datetime().strftime("%Y%m%d-%H%M%S"), extension)
+    file_path = frappe.get_site_path("private", "files", file_name)
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    return file_name, file_path
+
+
+def attach_advice(name, pdf):
+    frappe.get_doc({
+        "doctype": "File",
+        "file_name": f"{name}.pdf",
+        "attached_to_doctype": "Payment Entry",
+        "attached_to_name": name,
+        "is_private": 1,
+        "content": pdf,
+    }).insert(ignore_permissions=True)
+
+
+# ----------------------------
+# Prefetch
+# ----------------------------
+
+def get_advice_contexts(names):
+    """
+    Template context of each Payment Entry in `names`, built with a fixed
+    number of queries however many entries and references there are.
+    """
+    payment_entries = {
+        pe.name: pe
+        for pe in frappe.get_all("Payment Entry", filters={"name": ["in", names]}, fields=PAYMENT_ENTRY_FIELDS)
+    }
+
+    references_by_entry = {}
+    for ref in frappe.get_all(
+        "Payment Entry Reference",
+        filters={"parent": ["in", names], "parenttype": "Payment Entry"},
+        fields=REFERENCE_FIELDS,
+        order_by="parent asc, idx asc",
+    ):
+        references_by_entry.setdefault(ref.parent, []).append(ref)
+
+    invoice_names = list({
+        ref.reference_name
+        for refs in references_by_entry.values()
+        for ref in refs
+        if ref.reference_doctype == "Purchase Invoice"
+    })
+    invoice_dates = dict(frappe.get_all(
+        "Purchase Invoice",
+        filters={"name": ["in", invoice_names]},
+        fields=["name", "posting_date"],
+        as_list=True,
+    )) if invoice_names else {}
+
+    company_docs = {
+        company: frappe._dict(
+            frappe.db.get_value("Company", company, ["name", "company_logo", "tax_id", "custom_strn"], as_dict=True)
+        )
+        for company in {pe.company for pe in payment_entries.values()}
+    }
+    company_address = frappe.get_all(
+        "Address",
+        filters={"is_your_company_address": 1, "address_type": "Billing"},
+        fields=["address_line1", "city", "state", "country", "phone"],
+        limit=1,
+    )
+
+    contexts = []
+    for name in names:
+        doc = payment_entries[name]
+        doc.doctype = "Payment Entry"
+        doc.references = references_by_entry.get(name, [])
+        contexts.append({
+            "doc": doc,
+            "advice": frappe._dict(
+                company_doc=company_docs[doc.company],
+                company_address=company_address,
+                invoice_dates={ref.reference_name: invoice_dates.get(ref.reference_name) for ref in doc.references},
+            ),
+        })
+    return contexts
+
+
+# ----------------------------
+# Process pool workers
+# ----------------------------
+
+def init_render_worker(site, sites_path):
+    frappe.init(site=site, sites_path=sites_path)
+    frappe.connect()
+
+
+@lru_cache(maxsize=4)
+def get_compiled_template(print_format_name, modified):
+    """
+    The print format's compiled Jinja template, the default letter head
+    templates, the standard print stylesheet with the format's own CSS and
+    the PDF options, once per process and print format version.
+    """
+    from frappe.www.printview import get_letter_head, get_print_style
+
+    print_format = frappe.get_doc("Print Format", print_format_name)
+    jenv = frappe.get_jenv()
+    template = jenv.from_string(print_format.html)
+
+    # Same letter head a single print picks when none is chosen
+    letter_head = frappe._dict(get_letter_head(frappe._dict(), 0) or {})
+    letter_head_templates = (
+        jenv.from_string(letter_head.content or ""),
+        jenv.from_string(letter_head.footer or ""),
+    )
+
+    pdf_options = {
+        f"margin-{side}": "{0}mm".format(print_format.get(f"margin_{side}") or 15)
+        for side in ("top", "bottom", "left", "right")
+    }
+    return template, letter_head_templates, get_print_style(print_format=print_format), pdf_options
+
+
+def render_advice(template_key, context):
+    from frappe.utils.pdf import get_pdf
+
+    template, (letter_head, footer), print_style, pdf_options = get_compiled_template(*template_key)
+    doc = context["doc"]
+    body = template.render(dict(
+        context,
+        letter_head=letter_head.render(doc=doc),
+        footer=footer.render(doc=doc),
+        no_letterhead=0,
+    ))
+    html = PRINT_WRAPPER.format(lang=frappe.local.lang or "en", style=print_style, body=body)
+    return get_pdf(html, options=dict(pdf_options))
@@ -0,0 +1,376 @@
+import csv
+import os
+
+import frappe
+import numpy as np
+from frappe import _
+from frappe.utils import cint, flt, getdate, now_datetime
+
+from taxcompliancepakistan.utilities.tax_cache import DEFAULT_RATE_BASIS, get_items_tax_rates
+
+# Sales tax rate engine. Rates every line of an items table in one columnar
+# pass over NumPy arrays, for all `rate_application_basis` options of
+# FBR Sales Tax Rates.
+
+APPLY_PERCENTAGE = "Apply Percentage"
+APPLY_PERCENTAGE_AND_UOM = "Apply Percentage Along With Charge on UOM"
+APPLY_UOM_ONLY = "Apply on UOM only"
+APPLY_FLAT_RATE = "Apply Flat Rate in Rupees"
+
+RATE_BASES = (APPLY_PERCENTAGE, APPLY_PERCENTAGE_AND_UOM, APPLY_UOM_ONLY, APPLY_FLAT_RATE)
+
+# custom_fixed_tax_basis of Item Tax Template Detail: the fixed amount is
+# charged as it is per line ("Actual") or per unit of custom_fixed_tax_uom
+# ("UOM"). Code 0 leaves it to the FBR rate basis.
+FIXED_TAX_BASES = ("Actual", "UOM")
+
+INVOICE_PARTY_STATUS_FIELDS = {
+    "Sales Invoice": "custom_customer_st_status",
+    "Purchase Invoice": "custom_supplier_st_status",
+}
+
+
+def get_basis_code(basis):
+    return RATE_BASES.index(basis) if basis in RATE_BASES else 0
+
+
+def get_fixed_basis_code(fixed_basis):
+    return FIXED_TAX_BASES.index(fixed_basis) + 1 if fixed_basis in FIXED_TAX_BASES else 0
+
+
+def compute_sales_tax(qty, base_amount, st_rate, fixed_tax_amount, basis, fixed_basis=None, fixed_tax_qty=None):
+    """
+    Sales tax of many lines at once. All arguments are equal length arrays;
+    `basis` holds each line's index into RATE_BASES.
+
+    - Apply Percentage: rate % of the amount
+    - Apply Percentage Along With Charge on UOM: rate % of the amount plus
+      the fixed charge
+    - Apply on UOM only: the fixed charge
+    - Apply Flat Rate in Rupees: the fixed charge
+
+    The fixed charge follows the template's `fixed_basis` (codes of
+    get_fixed_basis_code): the amount once per line for Actual, the amount
+    per unit of `fixed_tax_qty` (the quantity in the template's fixed tax
+    UOM, `qty` when not given) for UOM. Without a fixed basis it is per unit
+    of `qty`, and once per line for the flat rate basis.
+    """
+    qty = np.asarray(qty, dtype=float)
+    base_amount = np.asarray(base_amount, dtype=float)
+    fixed_tax_amount = np.asarray(fixed_tax_amount, dtype=float)
+    basis = np.asarray(basis, dtype=int)
+    fixed_basis = np.zeros(len(qty), dtype=int) if fixed_basis is None else np.asarray(fixed_basis, dtype=int)
+    fixed_tax_qty = qty if fixed_tax_qty is None else np.asarray(fixed_tax_qty, dtype=float)
+
+    percentage = np.asarray(st_rate, dtype=float) * 0.01 * base_amount
+    fixed_charge = np.select(
+        [fixed_basis == 1, fixed_basis == 2, basis == 3],
+        [fixed_tax_amount, fixed_tax_amount * fixed_tax_qty, fixed_tax_amount],
+        default=fixed_tax_amount * qty,
+    )
+
+    return np.select(
+        [basis == 1, basis == 2, basis == 3],
+        [percentage + fixed_charge, fixed_charge, fixed_charge],
+        default=percentage,
+    )
+
+
+def get_fixed_tax_qty(lines, fixed_tax_uoms, qty):
+    """
+    Quantity of each line in its template's fixed tax UOM. Lines in that
+    UOM or its stock UOM convert with the line's own conversion factor;
+    other UOMs with the item's UOM Conversion Detail, read in one query.
+    Lines without a fixed tax UOM, or without a conversion, keep `qty`.
+    """
+    fixed_tax_qty = np.array(qty, dtype=float)
+    stock_qty = fixed_tax_qty * np.array([flt(line.get("conversion_factor")) or 1 for line in lines])
+
+    to_convert = {}
+    for i, (line, uom) in enumerate(zip(lines, fixed_tax_uoms)):
+        if not uom or uom == line.get("uom"):
+            continue
+        if uom == line.get("stock_uom"):
+            fixed_tax_qty[i] = stock_qty[i]
+        elif line.get("item_code"):
+            to_convert.setdefault((line.get("item_code"), uom), []).append(i)
+
+    if to_convert:
+        factors = {
+            (row.parent, row.uom): flt(row.conversion_factor)
+            for row in frappe.get_all(
+                "UOM Conversion Detail",
+                filters={
+                    "parenttype": "Item",
+                    "parent": ["in", list({item_code for item_code, uom in to_convert})],
+                    "uom": ["in", list({uom for item_code, uom in to_convert})],
+                },
+                fields=["parent", "uom", "conversion_factor"],
+            )
+        }
+        for key, rows in to_convert.items():
+            if factors.get(key):
+                fixed_tax_qty[rows] = stock_qty[rows] / factors[key]
+
+    return fixed_tax_qty
+
+
+def rate_invoice_items(doc, items, basis=DEFAULT_RATE_BASIS, precision=2):
+    """
+    Set ST, further tax and the tax inclusive total of invoice items from
+    their Item Tax Templates, rating the whole list in one pass.
+    """
+    if not items:
+        return
+
+    multiplier = -1 if doc.get("is_return") else 1
+    rates = get_items_tax_rates(items)
+
+    qty = np.array([flt(item.qty) if flt(item.qty) > 0 else 1 for item in items])
+    base_amount = qty * np.array([flt(item.rate) for item in items])
+    st_rate = np.array([flt(r.st_rate) for r in rates])
+    further_tax_rate = np.array([flt(r.further_tax_rate) for r in rates])
+    fixed_tax_amount = np.array([flt(r.get("fixed_tax_amount")) for r in rates])
+    fixed_basis = np.array([get_fixed_basis_code(r.get("fixed_tax_basis")) for r in rates])
+    fixed_tax_qty = get_fixed_tax_qty(items, [r.get("fixed_tax_uom") for r in rates], qty)
+
+    sales_tax = multiplier * compute_sales_tax(
+        qty, base_amount, st_rate, fixed_tax_amount, np.full(len(items), get_basis_code(basis)),
+        fixed_basis, fixed_tax_qty,
+    )
+
+    further_tax = np.zeros(len(items))
+    if doc.doctype == "Sales Invoice" and doc.get("custom_customer_st_status") in (None, "", "Unregistered"):
+        further_tax = multiplier * (further_tax_rate * 0.01 * base_amount)
+
+    total_incl_tax = multiplier * base_amount + sales_tax + further_tax
+
+    for i, item in enumerate(items):
+        item.custom_st_rate = flt(st_rate[i], precision)
+        item.custom_st = flt(sales_tax[i], precision)
+        item.custom_further_tax = flt(further_tax[i], precision)
+        item.custom_at = 0
+        item.custom_total_incl_tax = flt(total_incl_tax[i], precision)
+
+
+@frappe.whitelist()
+def enqueue_sales_tax_audit(company, from_date, to_date, voucher_type="Sales Invoice", tolerance=1):
+    """
+    Re-rate every submitted line of a period in a background job and attach a
+    CSV of lines whose stored ST or further tax differs from the engine's.
+    """
+    frappe.only_for(("Accounts Manager", "System Manager"))
+    if voucher_type not in INVOICE_PARTY_STATUS_FIELDS:
+        frappe.throw(_("Sales tax audit is not available for {0}").format(voucher_type))
+
+    job = frappe.enqueue(
+        "taxcompliancepakistan.utilities.rate_engine.audit_sales_tax",
+        queue="long",
+        timeout=4 * 60 * 60,
+        company=company,
+        from_date=from_date,
+        to_date=to_date,
+        voucher_type=voucher_type,
+        tolerance=flt(tolerance),
+        user=frappe.session.user,
+    )
+    return job.id if job else None
+
+
+def audit_sales_tax(company, from_date, to_date, voucher_type="Sales Invoice", tolerance=1, user=None, chunk_size=50000):
+    lookups = get_audit_lookups()
+
+    file_name = "sales-tax-audit-{0}-{1}.csv".format(
+        frappe.scrub(voucher_type), now_datetime().strftime("%Y%m%d-%H%M%S")
+    )
+    file_path = frappe.get_site_path("private", "files", file_name)
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+
+    lines_checked = mismatches = 0
+    with open(file_path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow([
+            "Invoice", "Posting Date", "Row", "Item Code", "Stored ST", "Expected ST",
+            "Stored Further Tax", "Expected Further Tax"
+        ])
+
+        for lines in iter_invoice_lines(voucher_type, company, from_date, to_date, chunk_size):
+            expected_st, expected_further_tax = rate_invoice_lines(voucher_type, lines, lookups)
+            stored_st = np.array([flt(line.custom_st) for line in lines])
+            stored_further_tax = np.array([flt(line.custom_further_tax) for line in lines])
+
+            mismatched = (np.abs(stored_st - expected_st) > tolerance) | (
+                np.abs(stored_further_tax - expected_further_tax) > tolerance
+            )
+            for i in np.flatnonzero(mismatched):
+                line = lines[i]
+                writer.writerow([
+                    line.parent, line.posting_date, line.idx, line.item_code,
+                    line.custom_st, round(float(expected_st[i]), 2),
+                    line.custom_further_tax, round(float(expected_further_tax[i]), 2),
+                ])
+
+            lines_checked += len(lines)
+            mismatches += int(mismatched.sum())
+
+    file_doc = frappe.get_doc({
+        "doctype": "File",
+        "file_name": file_name,
+        "file_url": "/private/files/{0}".format(file_name),
+        "is_private": 1,
+    }).insert(ignore_permissions=True)
+    frappe.db.commit()
+
+    if user:
+        frappe.publish_realtime(
+            "msgprint",
+            _("Sales tax audit checked {0} lines and found {1} mismatches: {2}").format(
+                lines_checked, mismatches, '<a href="{0}">{1}</a>'.format(file_doc.file_url, file_name)
+            ),
+            user=user,
+        )
+
+    return {"lines_checked": lines_checked, "mismatches": mismatches, "file_url": file_doc.file_url}
+
+
+def get_audit_lookups():
+    """
+    Load every rate the audit needs in a handful of queries, so lines are
+    rated from dictionaries instead of per line cache reads.
+    """
+    group_templates = {}
+    for row in frappe.get_all(
+        "Item Tax",
+        filters={"parenttype": "Item Group"},
+        fields=["parent", "item_tax_template"],
+        order_by="parent asc, idx asc",
+    ):
+        group_templates.setdefault(row.parent, row.item_tax_template)
+
+    # [st rate, further tax rate, fixed amount, fixed basis code] and the
+    # fixed tax UOM of each template
+    template_rates = {}
+    template_fixed_uoms = {}
+    for row in frappe.get_all(
+        "Item Tax Template Detail",
+        filters={"parenttype": "Item Tax Template"},
+        fields=[
+            "parent", "custom_tax_category", "tax_rate", "custom_fixed_tax_amount",
+            "custom_fixed_tax_basis", "custom_fixed_tax_uom",
+        ],
+    ):
+        rates = template_rates.setdefault(row.parent, [0, 0, 0, 0])
+        if row.custom_tax_category == "Sales Tax":
+            rates[0] += flt(row.tax_rate)
+            rates[2] += flt(row.custom_fixed_tax_amount)
+            if row.custom_fixed_tax_amount and row.custom_fixed_tax_basis:
+                rates[3] = get_fixed_basis_code(row.custom_fixed_tax_basis)
+                template_fixed_uoms[row.parent] = row.custom_fixed_tax_uom
+        elif row.custom_tax_category == "Further Sales Tax":
+            rates[1] += flt(row.tax_rate)
+
+    fbr_bases = dict(frappe.get_all(
+        "FBR Sales Tax Rates", fields=["name", "rate_application_basis"], as_list=True
+    ))
+    template_bases = {
+        name: get_basis_code(fbr_bases.get(fbr_rate))
+        for name, fbr_rate in frappe.get_all(
+            "Sales Taxes and Charges Template", fields=["name", "custom_fbr_sales_tax_rate"], as_list=True
+        )
+    }
+
+    return frappe._dict(
+        group_templates=group_templates,
+        template_rates=template_rates,
+        template_fixed_uoms=template_fixed_uoms,
+        template_bases=template_bases,
+    )
+
+
+def iter_invoice_lines(voucher_type, company, from_date, to_date, chunk_size=50000):
+    """
+    Yield submitted invoice lines of a period in chunks, paging on
+    (posting_date, invoice, idx).
+    """
+    values = {"company": company, "from_date": getdate(from_date), "to_date": getdate(to_date)}
+    after = None
+    while True:
+        keyset = ""
+        if after:
+            keyset = "AND (inv.posting_date, inv.name, item.idx) > (%(after_date)s, %(after_name)s, %(after_idx)s)"
+            values["after_date"], values["after_name"], values["after_idx"] = after
+
+        lines = frappe.db.sql(
+            """
+            SELECT
+                item.parent, item.idx, item.item_code, item.item_group, item.item_tax_template,
+                item.qty, item.rate, item.uom, item.stock_uom, item.conversion_factor, item.custom_st, item.custom_further_tax,
+                inv.posting_date, inv.is_return, inv.custom_tax_template,
+                inv.custom_sales_tax_invoice, inv.{party_status_field} AS party_st_status
+            FROM `tab{voucher_type} Item` item
+            INNER JOIN `tab{voucher_type}` inv ON inv.name = item.parent
+            WHERE inv.docstatus = 1
+                AND inv.company = %(company)s
+                AND inv.posting_date BETWEEN %(from_date)s AND %(to_date)s
+                {keyset}
+            ORDER BY inv.posting_date, inv.name, item.idx
+            LIMIT {chunk_size}
+            """.format(
+                voucher_type=voucher_type,
+                party_status_field=INVOICE_PARTY_STATUS_FIELDS[voucher_type],
+                keyset=keyset,
+                chunk_size=cint(chunk_size),
+            ),
+            values,
+            as_dict=True,
+        )
+        if not lines:
+            return
+
+        yield lines
+
+        if len(lines) < chunk_size:
+            return
+        after = (lines[-1].posting_date, lines[-1].parent, lines[-1].idx)
+
+
+def rate_invoice_lines(voucher_type, lines, lookups):
+    """
+    Expected (ST, further tax) arrays for stored invoice lines, following the
+    same rules as rate_invoice_items.
+    """
+    no_rates = (0, 0, 0, 0)
+    rates = []
+    fixed_tax_uoms = []
+    basis = []
+    for line in lines:
+        template = line.item_tax_template or lookups.group_templates.get(line.item_group)
+        rates.append(lookups.template_rates.get(template, no_rates))
+        fixed_tax_uoms.append(lookups.template_fixed_uoms.get(template))
+        basis.append(lookups.template_bases.get(line.custom_tax_template, 0) if voucher_type == "Sales Invoice" else 0)
+
+    rates = np.array(rates, dtype=float).reshape(-1, 4)
+    multiplier = np.array([-1 if line.is_return else 1 for line in lines], dtype=float)
+    qty = np.array([flt(line.qty) if flt(line.qty) > 0 else 1 for line in lines])
+    base_amount = qty * np.array([flt(line.rate) for line in lines])
+
+    # No sales tax for unregistered suppliers or non sales tax invoices
+    taxable = np.array([
+        not (
+            (voucher_type == "Purchase Invoice" and line.party_st_status == "Unregistered")
+            or line.custom_sales_tax_invoice == 0
+        )
+        for line in lines
+    ])
+
+    sales_tax = multiplier * compute_sales_tax(
+        qty, base_amount, rates[:, 0], rates[:, 2], basis,
+        rates[:, 3].astype(int), get_fixed_tax_qty(lines, fixed_tax_uoms, qty),
+    )
+
+    further_tax = np.zeros(len(lines))
+    if voucher_type == "Sales Invoice":
+        further_tax_applies = np.array([line.party_st_status in (None, "", "Unregistered") for line in lines])
+        further_tax = np.where(further_tax_applies, multiplier * rates[:, 1] * 0.01 * base_amount, 0)
+
+    return np.where(taxable, sales_tax, 0), np.where(taxable, further_tax, 0)
@@ -0,0 +1,486 @@
+import frappe
+import pickle
+from bisect import bisect_right
+from datetime import date
+from functools import lru_cache
+
+from frappe.utils import getdate
+
+from taxcompliancepakistan.utilities.instrumentation import instrumented, record_cache_lookup
+
+# Cached tax metadata that is read on every invoice and payment save but
+# almost never changes. Each registry lives in redis (shared by all workers)
+# and is invalidated from the save/trash events of its source documents.
+
+def hget(key, field, generator):
+    """
+    frappe.cache().hget that reports the lookup to the hook instrumentation,
+    as a miss when `generator` had to run.
+    """
+    missed = []
+
+    def load():
+        missed.append(True)
+        return generator()
+
+    value = frappe.cache().hget(key, field, generator=load)
+    record_cache_lookup(hit=not missed)
+    return value
+
+
+def hmget(key, fields):
+    """
+    Values of many fields of a redis hash in one HMGET, None for the fields
+    that are not cached. Each field is reported like an hget lookup.
+    """
+    if not fields:
+        return {}
+
+    cache = frappe.cache()
+    values = {}
+    for field, value in zip(fields, cache.hmget(cache.make_key(key), fields)):
+        record_cache_lookup(hit=value is not None)
+        values[field] = pickle.loads(value) if value is not None else None
+    return values
+
+
+def hset_many(key, values):
+    """Write many fields of a redis hash in one pipeline"""
+    cache = frappe.cache()
+    pipeline = cache.pipeline()
+    for field, value in values.items():
+        pipeline.hset(cache.make_key(key), field, pickle.dumps(value))
+    pipeline.execute()
+
+
+WHT_SECTIONS_KEY = "taxcompliancepakistan:wht_sections"
+WHT_SECTIONS_VERSION_KEY = "taxcompliancepakistan:wht_sections_version"
+
+WHT_SECTION_FIELDS = [
+    "name", "effective_from", "account_head", "tax_receivable_account_head",
+    "active_tax_payer_rate", "inactive_tax_payer_rate"
+]
+
+
+def get_wht_sections():
+    """
+    Return all WHT Sections keyed by section name.
+
+    Sections are kept in an in-process LRU keyed by the version stored in
+    redis, so a warm worker only reads the version key and never queries the
+    database. Saving or deleting a section bumps the version.
+    """
+    version = frappe.cache().get_value(WHT_SECTIONS_VERSION_KEY)
+    if not version:
+        version = frappe.generate_hash(length=10)
+        frappe.cache().set_value(WHT_SECTIONS_VERSION_KEY, version)
+
+    return _get_wht_sections(frappe.local.site, version)
+
+
+@lru_cache(maxsize=32)
+def _get_wht_sections(site, version):
+    return frappe.cache().get_value(WHT_SECTIONS_KEY, generator=load_wht_sections)
+
+
+def load_wht_sections():
+    sections = frappe.get_all("WHT Sections", fields=WHT_SECTION_FIELDS)
+    return {section.name: section for section in sections}
+
+
+def clear_wht_sections_cache():
+    frappe.cache().delete_value([WHT_SECTIONS_KEY, WHT_SECTIONS_VERSION_KEY])
+
+
+COMPANY_TAX_PROFILE_KEY = "taxcompliancepakistan:company_tax_profile"
+TEMPLATE_ADVANCE_TAX_KEY = "taxcompliancepakistan:template_advance_tax"
+
+COMPANY_TAX_PROFILE_FIELDS = [
+    "custom_vat_input", "custom_further_sales_tax_account", "custom_default_freight_expense_account",
+    "custom_freight_on_purchase_account", "cost_center"
+]
+
+
+def get_company_tax_profile(company):
+    """
+    Return the tax account heads of a Company, read from a redis hash that is
+    cleared whenever the Company is saved.
+    """
+    return hget(
+        COMPANY_TAX_PROFILE_KEY, company, generator=lambda: load_company_tax_profile(company)
+    )
+
+
+def load_company_tax_profile(company):
+    profile = frappe.db.get_value("Company", company, COMPANY_TAX_PROFILE_FIELDS, as_dict=True) or {}
+    return frappe._dict({field: profile.get(field) or "" for field in COMPANY_TAX_PROFILE_FIELDS})
+
+
+def get_account_currencies(accounts):
+    """
+    Return {account: currency} for the given accounts in at most one query,
+    falling back to the company currency like ERPNext's get_account_currency.
+    Results are kept for the rest of the request or job, so a batch of
+    Payment Entries resolves each tax account once.
+    """
+    import erpnext
+
+    currencies = getattr(frappe.local, "tax_account_currencies", None)
+    if currencies is None:
+        currencies = frappe.local.tax_account_currencies = {}
+
+    missing = list({account for account in accounts if account and account not in currencies})
+    if missing:
+        for account in frappe.get_all(
+            "Account", filters={"name": ["in", missing]}, fields=["name", "account_currency", "company"]
+        ):
+            currencies[account.name] = account.account_currency or erpnext.get_company_currency(account.company)
+
+    return {account: currencies.get(account) for account in accounts}
+
+
+def get_template_advance_tax(template_doctype, template_name):
+    """
+    Return the 236G rate and account head of a Sales/Purchase Taxes and
+    Charges Template, read from a redis hash that is cleared whenever the
+    template is saved.
+    """
+    return hget(
+        TEMPLATE_ADVANCE_TAX_KEY,
+        f"{template_doctype}::{template_name}",
+        generator=lambda: load_template_advance_tax(template_doctype, template_name),
+    )
+
+
+def load_template_advance_tax(template_doctype, template_name):
+    rows = frappe.get_all(
+        template_doctype.replace(" Template", ""),
+        filters={"parent": template_name, "parenttype": template_doctype, "custom_tax_category": "236G"},
+        fields=["rate", "account_head"],
+        order_by="idx asc",
+        limit=1,
+    )
+    if not rows:
+        return frappe._dict(rate=0, account_head="")
+
+    return frappe._dict(rate=frappe.utils.flt(rows[0].rate), account_head=rows[0].account_head or "")
+
+
+TEMPLATE_RATE_BASIS_KEY = "taxcompliancepakistan:template_rate_basis"
+DEFAULT_RATE_BASIS = "Apply Percentage"
+
+
+def get_template_rate_basis(template_doctype, template_name):
+    """
+    Return the FBR rate application basis of a Taxes and Charges Template.
+    Only Sales templates link an FBR Sales Tax Rate; everything else is
+    rated as a plain percentage.
+    """
+    if template_doctype != "Sales Taxes and Charges Template" or not template_name:
+        return DEFAULT_RATE_BASIS
+
+    return hget(
+        TEMPLATE_RATE_BASIS_KEY,
+        template_name,
+        generator=lambda: load_template_rate_basis(template_name),
+    )
+
+
+def load_template_rate_basis(template_name):
+    fbr_rate = frappe.db.get_value("Sales Taxes and Charges Template", template_name, "custom_fbr_sales_tax_rate")
+    if not fbr_rate:
+        return DEFAULT_RATE_BASIS
+
+    return frappe.db.get_value("FBR Sales Tax Rates", fbr_rate, "rate_application_basis") or DEFAULT_RATE_BASIS
+
+
+def clear_template_rate_basis():
+    frappe.cache().delete_value(TEMPLATE_RATE_BASIS_KEY)
+
+
+## Hooks that will be executed when cached source documents change
+
+@instrumented
+def clear_company_tax_profile(doc, method=None):
+    frappe.cache().hdel(COMPANY_TAX_PROFILE_KEY, doc.name)
+
+
+@instrumented
+def clear_template_advance_tax(doc, method=None):
+    frappe.cache().hdel(TEMPLATE_ADVANCE_TAX_KEY, f"{doc.doctype}::{doc.name}")
+    frappe.cache().hdel(TEMPLATE_RATE_BASIS_KEY, doc.name)
+
+
+ITEM_TAX_RATE_INDEX_KEY = "taxcompliancepakistan:item_tax_rate_index"
+TEMPLATE_TAX_RATES_KEY = "taxcompliancepakistan:item_tax_template_rates"
+ITEM_GROUP_TEMPLATE_KEY = "taxcompliancepakistan:item_group_tax_template"
+
+
+def new_tax_rates(template=None):
+    return frappe._dict(
+        template=template, st_rate=0, further_tax_rate=0, fixed_tax_amount=0, fixed_tax_basis=None, fixed_tax_uom=None
+    )
+
+
+def get_item_tax_rates(item_code=None, item_tax_template=None, item_group=None):
+    """
+    Return {"template", "st_rate", "further_tax_rate", "fixed_tax_amount",
+    "fixed_tax_basis", "fixed_tax_uom"} for an invoice item.
+
+    The row's own Item Tax Template wins; otherwise the item code is looked
+    up in the rate index, which resolves to the first template of the Item
+    Group. Every lookup is a single redis hash read, filled lazily and
+    cleared when the Item, Item Group or Item Tax Template changes.
+    """
+    if item_tax_template:
+        return get_template_tax_rates(item_tax_template)
+
+    if item_code:
+        return hget(
+            ITEM_TAX_RATE_INDEX_KEY, item_code, generator=lambda: load_item_tax_rates(item_code)
+        )
+
+    if item_group:
+        return get_template_tax_rates(get_item_group_tax_template(item_group))
+
+    return get_template_tax_rates(None)
+
+
+def get_items_tax_rates(items):
+    """
+    get_item_tax_rates for every row of an items table, in the same order.
+
+    The rate index and the template rates are each read with one HMGET for
+    all rows instead of one HGET per row; only the misses are loaded and
+    written back, the templates in one query.
+    """
+    item_codes = list({
+        item.get("item_code") for item in items if item.get("item_code") and not item.get("item_tax_template")
+    })
+    indexed = hmget(ITEM_TAX_RATE_INDEX_KEY, item_codes)
+    missing = [item_code for item_code, rates in indexed.items() if rates is None]
+    if missing:
+        item_groups = dict(frappe.get_all(
+            "Item", filters={"name": ["in", missing]}, fields=["name", "item_group"], as_list=True
+        ))
+        indexed.update({
+            item_code: get_template_tax_rates(get_item_group_tax_template(item_groups.get(item_code)))
+            for item_code in missing
+        })
+        hset_many(ITEM_TAX_RATE_INDEX_KEY, {item_code: indexed[item_code] for item_code in missing})
+
+    templates = list({item.get("item_tax_template") for item in items if item.get("item_tax_template")})
+    template_rates = hmget(TEMPLATE_TAX_RATES_KEY, templates)
+    missing = [template for template, rates in template_rates.items() if rates is None]
+    if missing:
+        template_rates.update(load_template_tax_rates(missing))
+        hset_many(TEMPLATE_TAX_RATES_KEY, {template: template_rates[template] for template in missing})
+
+    rates = []
+    for item in items:
+        if item.get("item_tax_template"):
+            rates.append(template_rates[item.get("item_tax_template")])
+        elif item.get("item_code"):
+            rates.append(indexed[item.get("item_code")])
+        else:
+            rates.append(get_item_tax_rates(item_group=item.get("item_group")))
+    return rates
+
+
+def load_item_tax_rates(item_code):
+    item_group = frappe.db.get_value("Item", item_code, "item_group")
+    return get_template_tax_rates(get_item_group_tax_template(item_group))
+
+
+def get_item_group_tax_template(item_group):
+    if not item_group:
+        return None
+
+    return hget(
+        ITEM_GROUP_TEMPLATE_KEY, item_group, generator=lambda: load_item_group_tax_template(item_group)
+    ) or None
+
+
+def load_item_group_tax_template(item_group):
+    templates = frappe.get_all(
+        "Item Tax",
+        filters={"parent": item_group, "parenttype": "Item Group"},
+        pluck="item_tax_template",
+        order_by="idx asc",
+        limit=1,
+    )
+    return templates[0] if templates else ""
+
+
+def get_template_tax_rates(template):
+    if not template:
+        return new_tax_rates()
+
+    return hget(
+        TEMPLATE_TAX_RATES_KEY, template, generator=lambda: load_template_tax_rates([template])[template]
+    )
+
+
+def load_template_tax_rates(templates):
+    rates = {t: new_tax_rates(t) for t in templates}
+    details = frappe.get_all(
+        "Item Tax Template Detail",
+        filters={"parent": ["in", list(templates)], "parenttype": "Item Tax Template"},
+        fields=[
+            "parent", "custom_tax_category", "tax_rate", "custom_fixed_tax_amount",
+            "custom_fixed_tax_basis", "custom_fixed_tax_uom",
+        ],
+    )
+    for row in details:
+        if row.custom_tax_category == "Sales Tax":
+            rates[row.parent].st_rate += frappe.utils.flt(row.tax_rate)
+            rates[row.parent].fixed_tax_amount += frappe.utils.flt(row.custom_fixed_tax_amount)
+            if row.custom_fixed_tax_amount and row.custom_fixed_tax_basis:
+                rates[row.parent].fixed_tax_basis = row.custom_fixed_tax_basis
+                rates[row.parent].fixed_tax_uom = row.custom_fixed_tax_uom
+        elif row.custom_tax_category == "Further Sales Tax":
+            rates[row.parent].further_tax_rate += frappe.utils.flt(row.tax_rate)
+
+    return rates
+
+
+def build_item_tax_rate_index():
+    """
+    Build the whole item tax rate index in three queries and write it to
+    redis in one pipeline. Used for warm up after migrate and for backfills.
+    """
+    group_templates = {}
+    for row in frappe.get_all(
+        "Item Tax",
+        filters={"parenttype": "Item Group"},
+        fields=["parent", "item_tax_template"],
+        order_by="parent asc, idx asc",
+    ):
+        group_templates.setdefault(row.parent, row.item_tax_template or "")
+
+    template_rates = load_template_tax_rates(
+        {t for t in group_templates.values() if t}
+    ) if any(group_templates.values()) else {}
+    no_template = new_tax_rates()
+
+    cache = frappe.cache()
+    pipeline = cache.pipeline()
+    pipeline.delete(cache.make_key(ITEM_TAX_RATE_INDEX_KEY))
+    for item in frappe.get_all("Item", fields=["name", "item_group"]):
+        template = group_templates.get(item.item_group)
+        rates = template_rates.get(template, no_template)
+        pipeline.hset(cache.make_key(ITEM_TAX_RATE_INDEX_KEY), item.name, pickle.dumps(rates))
+    pipeline.execute()
+
+
+## Hooks that will be executed when items or their tax templates change
+
+@instrumented
+def clear_item_tax_rates(doc, method=None):
+    frappe.cache().hdel(ITEM_TAX_RATE_INDEX_KEY, doc.name)
+
+
+@instrumented
+def clear_item_group_tax_rates(doc, method=None):
+    frappe.cache().hdel(ITEM_GROUP_TEMPLATE_KEY, doc.name)
+    item_codes = frappe.get_all("Item", filters={"item_group": doc.name}, pluck="name")
+    if item_codes:
+        frappe.cache().hdel(ITEM_TAX_RATE_INDEX_KEY, item_codes)
+
+
+@instrumented
+def clear_item_tax_template_rates(doc, method=None):
+    # Items point to templates through their group, so drop the items of
+    # every Item Group that uses the template
+    frappe.cache().hdel(TEMPLATE_TAX_RATES_KEY, doc.name)
+    item_groups = frappe.get_all(
+        "Item Tax",
+        filters={"item_tax_template": doc.name, "parenttype": "Item Group"},
+        pluck="parent",
+        distinct=True,
+    )
+    if not item_groups:
+        return
+
+    item_codes = frappe.get_all("Item", filters={"item_group": ["in", item_groups]}, pluck="name")
+    if item_codes:
+        frappe.cache().hdel(ITEM_TAX_RATE_INDEX_KEY, item_codes)
+
+
+WHT_EXEMPTIONS_KEY = "taxcompliancepakistan:wht_exemptions"
+
+
+def is_wht_exempt(party_type, party, section, company, on_date, exemption_index=None):
+    """
+    Check if a party holds a WHT Exemption for a section on a date. Validity
+    periods are kept as sorted, merged intervals per (section, company), so
+    the check is a binary search however many certificates the party has.
+    """
+    if exemption_index is None:
+        exemption_index = get_wht_exemption_index(party_type, party)
+
+    intervals = exemption_index.get((section, company))
+    if not intervals:
+        return False
+
+    on_date = getdate(on_date)
+    starts, ends = intervals
+    i = bisect_right(starts, on_date) - 1
+    return i >= 0 and on_date <= ends[i]
+
+
+def get_wht_exemption_index(party_type, party):
+    return hget(
+        WHT_EXEMPTIONS_KEY,
+        f"{party_type}::{party}",
+        generator=lambda: load_wht_exemption_indexes(party_type, [party]).get(party, {}),
+    )
+
+
+def load_wht_exemption_indexes(party_type, parties):
+    """
+    Load submitted exemptions of many parties in one query and return an
+    exemption index per party.
+    """
+    exemptions = frappe.get_all(
+        "WHT Exemption",
+        filters={"docstatus": 1, "party_type": party_type, "party": ["in", list(parties)]},
+        fields=["party", "exemption_from_section", "company", "valid_from", "valid_upto"],
+    )
+
+    rows_by_party = {}
+    for row in exemptions:
+        rows_by_party.setdefault(row.party, []).append(row)
+
+    return {party: make_wht_exemption_index(rows) for party, rows in rows_by_party.items()}
+
+
+def make_wht_exemption_index(exemptions):
+    """
+    Build {(section, company): (starts, ends)} from exemption rows, merging
+    overlapping validity periods. Open ended periods run to date.min/max.
+    """
+    periods = {}
+    for row in exemptions:
+        start = getdate(row.get("valid_from")) if row.get("valid_from") else date.min
+        end = getdate(row.get("valid_upto")) if row.get("valid_upto") else date.max
+        if end < start:
+            continue
+        periods.setdefault((row.get("exemption_from_section"), row.get("company")), []).append((start, end))
+
+    index = {}
+    for key, intervals in periods.items():
+        starts, ends = [], []
+        for start, end in sorted(intervals):
+            if ends and start <= ends[-1]:
+                ends[-1] = max(ends[-1], end)
+            else:
+                starts.append(start)
+                ends.append(end)
+        index[key] = (starts, ends)
+
+    return index
+
+
+def clear_wht_exemption_index(party_type, party):
+    frappe.cache().hdel(WHT_EXEMPTIONS_KEY, f"{party_type}::{party}")
@@ -0,0 +1,180 @@
+import frappe
+from frappe.utils import get_first_day, getdate, now
+
+from taxcompliancepakistan.utilities.instrumentation import instrumented
+
+# Functions in this maintain the FBR Tax Ledger, a per (invoice, HS code)
+# summary of submitted invoices that the Annex reports can read directly.
+
+LEDGER_DOCTYPE = "FBR Tax Ledger Entry"
+
+# Annex row fields that are stored under the same name in the ledger
+COMMON_FIELDS = (
+    "doc_type", "posting_date", "hs_code", "tax_classification", "sales_tax_rate",
+    "qty", "uom", "amount", "further_tax", "st_amount"
+)
+
+# Party specific Annex row fields mapped to their ledger field
+PARTY_FIELDS = {
+    "Sales Invoice": {
+        "customer_tax_id": "party_tax_id",
+        "customer_name": "party",
+        "tax_category": "party_tax_category",
+        "supplier_province": "company_province",
+        "customer_province": "party_province",
+    },
+    "Purchase Invoice": {
+        "supplier_tax_id": "party_tax_id",
+        "supplier_name": "party",
+        "tax_category": "party_tax_category",
+        "supplier_province": "party_province",
+        "company_province": "company_province",
+    },
+}
+
+LEDGER_FIELDS = ("company", "period", "voucher_type", "voucher_no") + COMMON_FIELDS + (
+    "party", "party_tax_id", "party_tax_category", "party_province", "company_province"
+)
+
+
+def get_report_module(voucher_type):
+    if voucher_type == "Sales Invoice":
+        from taxcompliancepakistan.taxcompliancepakistan.report.annex_c import annex_c
+        return annex_c
+
+    from taxcompliancepakistan.taxcompliancepakistan.report.annex_a import annex_a
+    return annex_a
+
+
+def get_report_rows(voucher_type, invoice_names):
+    report = get_report_module(voucher_type)
+    if voucher_type == "Sales Invoice":
+        return report.get_data(frappe._dict(), invoice_names=invoice_names)
+
+    return report.get_data(report.get_purchase_invoices(frappe._dict(), invoice_names=invoice_names))
+
+
+## Hooks that will be executed when an invoice is submitted or cancelled
+
+@instrumented
+def on_invoice_submit(doc, method=None):
+    delete_ledger_entries(doc.doctype, [doc.name])
+    insert_ledger_entries(doc.doctype, doc.company, get_report_rows(doc.doctype, [doc.name]))
+
+
+@instrumented
+def on_invoice_cancel(doc, method=None):
+    delete_ledger_entries(doc.doctype, [doc.name])
+
+
+def delete_ledger_entries(voucher_type, voucher_nos):
+    frappe.db.delete(LEDGER_DOCTYPE, {"voucher_type": voucher_type, "voucher_no": ["in", voucher_nos]})
+
+
+def insert_ledger_entries(voucher_type, company, report_rows):
+    """
+    Insert Annex report rows into the ledger with a single multi-row insert.
+    """
+    if not report_rows:
+        return
+
+    party_fields = PARTY_FIELDS[voucher_type]
+    timestamp = now()
+    user = frappe.session.user
+
+    fields = ["name", "creation", "modified", "owner", "modified_by", "docstatus", *LEDGER_FIELDS]
+    values = []
+    for row in report_rows:
+        entry = {
+            "company": company,
+            "period": get_first_day(row["posting_date"]),
+            "voucher_type": voucher_type,
+            "voucher_no": row["doc_name"],
+        }
+        entry.update({field: row.get(field) for field in COMMON_FIELDS})
+        entry.update({ledger_field: row.get(row_field) for row_field, ledger_field in party_fields.items()})
+
+        values.append(
+            [frappe.generate_hash(length=10), timestamp, timestamp, user, user, 0]
+            + [entry.get(field) for field in LEDGER_FIELDS]
+        )
+
+    frappe.db.bulk_insert(LEDGER_DOCTYPE, fields, values)
+
+
+def rebuild_tax_ledger(company, from_date, to_date, voucher_types=None, chunk_size=1000):
+    """
+    Backfill the ledger for a company and date range from submitted invoices.
+    Existing entries in the range are replaced.
+    """
+    voucher_types = voucher_types or ("Sales Invoice", "Purchase Invoice")
+    filters = frappe._dict(company=company, from_date=getdate(from_date), to_date=getdate(to_date))
+
+    for voucher_type in voucher_types:
+        frappe.db.delete(LEDGER_DOCTYPE, {
+            "company": company,
+            "voucher_type": voucher_type,
+            "posting_date": ["between", [filters.from_date, filters.to_date]],
+        })
+
+        chunk = []
+        for row in get_report_module(voucher_type).iter_data(filters):
+            chunk.append(row)
+            if len(chunk) >= chunk_size:
+                insert_ledger_entries(voucher_type, company, chunk)
+                chunk = []
+        insert_ledger_entries(voucher_type, company, chunk)
+
+        frappe.db.commit()
+
+
+def get_ledger_data(voucher_type, filters):
+    return list(iter_ledger_data(voucher_type, filters))
+
+
+def iter_ledger_data(voucher_type, filters, page_length=5000):
+    """
+    Yield ledger entries as Annex report rows, paging on
+    (posting_date, voucher_no, name) over the company/date index.
+    """
+    conditions = ["voucher_type = %(voucher_type)s"]
+    values = dict(filters, voucher_type=voucher_type)
+    if filters.get("from_date") and filters.get("to_date"):
+        conditions.append("posting_date BETWEEN %(from_date)s AND %(to_date)s")
+    if filters.get("company"):
+        conditions.append("company = %(company)s")
+
+    party_fields = PARTY_FIELDS[voucher_type]
+    after = None
+    while True:
+        page_conditions = list(conditions)
+        if after:
+            page_conditions.append("(posting_date, voucher_no, name) > (%(after_date)s, %(after_voucher)s, %(after_name)s)")
+            values["after_date"], values["after_voucher"], values["after_name"] = after
+
+        entries = frappe.db.sql(
+            """
+            SELECT name, voucher_no, {fields}
+            FROM `tabFBR Tax Ledger Entry`
+            WHERE {conditions}
+            ORDER BY posting_date, voucher_no, name
+            LIMIT {page_length}
+            """.format(
+                fields=", ".join(COMMON_FIELDS + tuple(party_fields.values())),
+                conditions=" AND ".join(page_conditions),
+                page_length=int(page_length),
+            ),
+            values,
+            as_dict=True,
+        )
+
+        for entry in entries:
+            row = {field: entry[field] for field in COMMON_FIELDS}
+            row.update({row_field: entry[ledger_field] for row_field, ledger_field in party_fields.items()})
+            row["doc_name"] = entry.voucher_no
+            yield row
+
+        if len(entries) < page_length:
+            return
+        last = entries[-1]
+        after = (last.posting_date, last.voucher_no, last.name)
@@ -1,31 +1,206 @@
+import hashlib
+
 import frappe
-from frappe.utils import flt
+from frappe.utils import cint, flt
 from frappe.model.document import Document
 
+from taxcompliancepakistan.utilities.instrumentation import instrumented, span
+from taxcompliancepakistan.utilities.tax_cache import (
+    get_account_currencies,
+    get_company_tax_profile,
+    get_item_tax_rates as get_indexed_item_tax_rates,
+    get_template_advance_tax,
+    get_template_rate_basis,
+)
+from taxcompliancepakistan.utilities.rate_engine import rate_invoice_items
+
+TAX_TEMPLATE_DOCTYPES = {
+    "Sales Invoice": "Sales Taxes and Charges Template",
+    "Purchase Invoice": "Purchase Taxes and Charges Template",
+}
+
+ITEM_TAX_FIELDS = ("custom_st_rate", "custom_st", "custom_further_tax", "custom_at", "custom_total_incl_tax")
+
+# Fields the tax summary of an invoice depends on; see get_tax_fingerprint
+TAX_FINGERPRINT_HEADER_FIELDS = (
+    "company", "is_return", "custom_tax_template", "custom_customer_st_status", "custom_supplier_st_status",
+    "custom_sales_tax_invoice", "custom_purchase_invoice_type", "custom_freight_rule", "custom_freight_amount",
+    "posting_date",
+)
+TAX_FINGERPRINT_ITEM_FIELDS = (
+    "item_code", "item_tax_template", "qty", "rate", "amount", "custom_st_rate", "custom_st", "custom_further_tax",
+)
+
+# Tax categories of the rows apply_item_level_tax_summary builds; rows of any
+# other category were added by hand and are kept when the summary is rebuilt
+SUMMARY_TAX_CATEGORIES = ("Sales Tax", "Further Sales Tax", "236G", "Freight")
+
+
 @frappe.whitelist()
+@instrumented
+def calculate_invoice_taxes(doc, rows=None, manual_override_field=None, incremental=0, manual_overrides=None):
+    """
+    Calculate item level taxes and the tax summary of an invoice form in one
+    call. Only the items named in `rows` are recalculated (all items when
+    `rows` is not given); the summary always covers every item.
+
+    `manual_overrides` maps row names to the field the user typed in that
+    row ("custom_st" or "custom_st_rate"); `manual_override_field` applies
+    one such field to every row in `rows`.
+
+    Returns the tax fields of every item, the summary `taxes` rows, the
+    resulting total_taxes_and_charges and the summary context (account heads
+    and 236G rate) the form needs to keep the summary up to date itself.
+
+    With `incremental` set only the recalculated rows are returned and the
+    summary is left to the form, which adjusts its running totals by the
+    change in those rows.
+    """
+    doc = frappe.get_doc(frappe.parse_json(doc))
+    frappe.has_permission(doc.doctype, throw=True)
+
+    if doc.get("custom_purchase_invoice_type") == "Import":
+        return {"skipped": 1}
+
+    rows = frappe.parse_json(rows) if rows else None
+    manual_overrides = frappe.parse_json(manual_overrides) if manual_overrides else {}
+    if manual_override_field:
+        row_names = rows if rows is not None else [item.name for item in doc.get("items", [])]
+        manual_overrides = dict(dict.fromkeys(row_names, manual_override_field), **manual_overrides)
+
+    precision = get_currency_precision()
+    changed = [item for item in doc.get("items", []) if rows is None or item.name in rows]
+    if is_sales_tax_applicable(doc):
+        for item in changed:
+            if manual_overrides.get(item.name):
+                calculate_item_taxes(doc, item, manual_overrides[item.name], precision)
+        rate_items(doc, [item for item in changed if not manual_overrides.get(item.name)], precision)
+    else:
+        rate_items(doc, changed, precision)
+
+    if cint(incremental) and rows is not None:
+        return {"incremental": 1, "items": [get_item_tax_values(item) for item in changed]}
+
+    tax_summary = apply_item_level_tax_summary(doc)
+
+    return {
+        "items": [get_item_tax_values(item) for item in doc.items],
+        "taxes": tax_summary,
+        "total_taxes_and_charges": sum(flt(row.get("tax_amount")) for row in tax_summary),
+        "summary_context": get_tax_summary_context(doc),
+    }
+
+
+def rate_items(doc, items, precision=2):
+    """
+    Set the item level taxes of `items` with the rate engine, or clear them
+    when the invoice carries no sales tax.
+    """
+    if not is_sales_tax_applicable(doc):
+        for item in items:
+            calculate_item_taxes(doc, item, None, precision)
+        return
+
+    basis = get_template_rate_basis(TAX_TEMPLATE_DOCTYPES[doc.doctype], doc.get("custom_tax_template"))
+    rate_invoice_items(doc, items, basis, precision)
+
+
+def is_rated(item):
+    # Every rated row has a tax inclusive total, zero only when its amount is
+    return bool(flt(item.get("custom_total_incl_tax")) or not flt(item.get("rate")))
+
+
+def get_item_tax_values(item):
+    return dict({"name": item.name}, **{field: item.get(field) for field in ITEM_TAX_FIELDS})
+
+
+def is_sales_tax_applicable(doc):
+    # No sales tax for unregistered suppliers or non sales tax invoices
+    return not (doc.get("custom_supplier_st_status") == "Unregistered" or doc.get("custom_sales_tax_invoice") == 0)
+
+
+def calculate_item_taxes(doc, item, manual_override_field=None, precision=2):
+    """
+    Set ST, further tax and the tax inclusive total of one invoice item in the
+    cases the rate engine (rate_engine.rate_invoice_items) does not cover:
+    an invoice without sales tax, whose item taxes are cleared, and a row
+    where the user typed `manual_override_field` ("custom_st" or
+    "custom_st_rate"), which is kept.
+    """
+    qty = flt(item.qty) if flt(item.qty) > 0 else 1
+    base_amount = qty * flt(item.rate)
+    multiplier = -1 if doc.get("is_return") else 1
+
+    if not is_sales_tax_applicable(doc):
+        item.custom_st_rate = 0
+        item.custom_st = 0
+        item.custom_further_tax = 0
+        item.custom_at = 0
+        item.custom_total_incl_tax = multiplier * base_amount
+        return
+
+    if manual_override_field == "custom_st":
+        sales_tax = flt(item.custom_st, precision)
+        sales_tax_rate = (sales_tax / (multiplier * base_amount)) * 100 if base_amount else 0
+    elif manual_override_field == "custom_st_rate":
+        sales_tax_rate = flt(item.custom_st_rate, precision)
+        sales_tax = flt(multiplier * (sales_tax_rate * 0.01 * base_amount), precision)
+    else:
+        frappe.throw(frappe._("Items are rated with the rate engine unless their ST or ST rate was entered manually"))
+
+    further_tax = 0
+    if doc.doctype == "Sales Invoice" and doc.get("custom_customer_st_status") in (None, "", "Unregistered"):
+        further_tax = multiplier * (get_further_tax_rate(item) * 0.01 * base_amount)
+
+    item.custom_st_rate = flt(sales_tax_rate, precision)
+    item.custom_st = sales_tax
+    item.custom_further_tax = further_tax
+    item.custom_at = 0
+    item.custom_total_incl_tax = multiplier * base_amount + sales_tax + further_tax
+
+
+def get_further_tax_rate(item):
+    """
+    Further tax rate of an invoice item, from its Item Tax Template or else
+    the first template of its Item Group.
+    """
+    return get_indexed_item_tax_rates(
+        item_code=item.get("item_code"),
+        item_tax_template=item.get("item_tax_template"),
+        item_group=item.get("item_group"),
+    ).further_tax_rate
+
+
+def get_currency_precision():
+    return cint(frappe.db.get_default("currency_precision")) or 2
+
+
+@frappe.whitelist()
+@instrumented
 def apply_item_level_tax_summary(doc):
     """
     Based on item-level tax fields (already calculated), apply tax summary 
     to the `taxes` child table. This includes Sales Tax, Further Tax, and Advance Tax (236G).
     """
 
+    # Item level amounts already carry the return sign (see calculate_item_taxes),
+    # so the totals below are used as they are, like the form does.
     sales_tax_total = 0
     further_tax_total = 0
     total_inclusive = 0
-    multiplier = -1 if doc.get("is_return") else 1
 
     for item in doc.get("items", []):
         sales_tax_total += flt(item.custom_st)
         further_tax_total += flt(item.custom_further_tax)
         total_inclusive += flt(item.custom_total_incl_tax)
 
-    # Get account heads from Company
-    company = frappe.get_doc("Company", doc.company)
-    sales_tax_account = company.get("custom_vat_input") or ""
-    further_tax_account = company.get("custom_further_sales_tax_account") or ""
-    freight_account = company.get("custom_default_freight_expense_account") or ""
-    freight_on_purchase_account = company.get("custom_freight_on_purchase_account") or ""
-    cost_center = company.get("cost_center") or ""
+    # Get account heads from Company and 236G from the tax template
+    context = get_tax_summary_context(doc)
+    sales_tax_account = context.sales_tax_account
+    further_tax_account = context.further_tax_account
+    freight_account = context.freight_account
+    freight_on_purchase_account = context.freight_on_purchase_account
+    cost_center = context.cost_center
 
     # Build tax summary, removing decimal places from tax amounts
     tax_summary = []
@@ -35,7 +210,7 @@ def apply_item_level_tax_summary(doc):
             "charge_type": "Actual",
             "account_head": sales_tax_account,
             "description": "Sales Tax (Item Level)",
-            "tax_amount": multiplier * sales_tax_total,
+            "tax_amount": sales_tax_total,
             "custom_tax_category": "Sales Tax",
             "tax_category": "Sales Tax",
             "category":"Total",
@@ -47,34 +222,26 @@ def apply_item_level_tax_summary(doc):
             "charge_type": "Actual",
             "account_head": further_tax_account,
             "description": "Further Tax (Item Level)",
-            "tax_amount": multiplier * further_tax_total,
+            "tax_amount": further_tax_total,
             "custom_tax_category": "Further Sales Tax",
             "tax_category": "Further Sales Tax",
             "category":"Total",
             "add_deduct_tax":"Add"
         })
 
-    # 236G Advance Tax from template - Only for Sales Invoice, not Purchase Invoice
+    # 236G Advance Tax from template, calculated on the total inclusive amount
     advance_tax = 0
-    advance_tax_account = ""
-    advance_tax_rate = 0
-
-    if doc.doctype == "Sales Invoice" and doc.custom_tax_template:
-        template_doctype = "Sales Taxes and Charges Template"
-        template = frappe.get_doc(template_doctype, doc.custom_tax_template)
-        for row in template.get("taxes", []):
-            if row.custom_tax_category == "236G":
-                advance_tax_rate = flt(row.rate)
-                advance_tax_account = row.account_head
-                break
+    advance_tax_account = context.advance_tax_account
+    advance_tax_rate = context.advance_tax_rate
 
+    if doc.doctype == "Sales Invoice":
         if advance_tax_rate and advance_tax_account:
             advance_tax = advance_tax_rate * 0.01 * total_inclusive
             tax_summary.append({
                 "charge_type": "Actual",
                 "account_head": advance_tax_account,
                 "description": "Advance Income Tax (236G)",
-                "tax_amount": multiplier * advance_tax,
+                "tax_amount": advance_tax,
                 "custom_tax_category": "236G",
                 "tax_category": "236G",
                 "cost_center":cost_center,
@@ -82,8 +249,24 @@ def apply_item_level_tax_summary(doc):
                 "add_deduct_tax":"Add"
             })
     
-    # Preserve manually added 236G rows for Purchase Invoice
-    if doc.doctype == "Purchase Invoice":
+    # Purchase Invoice: 236G from the template if it defines one, otherwise
+    # preserve manually added 236G rows
+    elif doc.doctype == "Purchase Invoice" and advance_tax_rate and advance_tax_account:
+        advance_tax = advance_tax_rate * 0.01 * total_inclusive
+        if advance_tax:
+            tax_summary.append({
+                "charge_type": "Actual",
+                "account_head": advance_tax_account,
+                "description": "Withholding Tax (236G)",
+                "tax_amount": advance_tax,
+                "custom_tax_category": "236G",
+                "tax_category": "236G",
+                "cost_center": cost_center,
+                "category": "Total",
+                "add_deduct_tax": "Add",
+                "rate": advance_tax_rate
+            })
+    elif doc.doctype == "Purchase Invoice":
         for tax_row in doc.get("taxes", []): 
             if tax_row.custom_tax_category == "236G":
                 tax_summary.append({
@@ -126,26 +309,117 @@ def apply_item_level_tax_summary(doc):
             })
 
     # Apply tax summary to doc
-    doc.set("taxes", [])
-    for row in tax_summary:
-        doc.append("taxes", row)
+    set_tax_summary_rows(doc, tax_summary)
 
     return tax_summary
 
+
+def get_tax_summary_context(doc):
+    """
+    Account heads and 236G rate the tax summary of an invoice is built from.
+    """
+    company = get_company_tax_profile(doc.company)
+
+    advance = frappe._dict(rate=0, account_head="")
+    if doc.get("custom_tax_template"):
+        advance = get_template_advance_tax(TAX_TEMPLATE_DOCTYPES[doc.doctype], doc.custom_tax_template)
+
+    return frappe._dict(
+        sales_tax_account=company.custom_vat_input,
+        further_tax_account=company.custom_further_sales_tax_account,
+        freight_account=company.custom_default_freight_expense_account,
+        freight_on_purchase_account=company.custom_freight_on_purchase_account,
+        cost_center=company.cost_center,
+        advance_tax_rate=advance.rate,
+        advance_tax_account=advance.account_head,
+    )
+
+
+def set_tax_summary_rows(doc, tax_summary):
+    """
+    Make the summary rows of the `taxes` table match the summary, updating
+    existing rows in place (matched on tax category and account head) instead
+    of clearing and re-adding them, so unchanged rows keep their names. Rows
+    outside SUMMARY_TAX_CATEGORIES are kept after the summary rows.
+    """
+    existing = {}
+    manual_rows = []
+    for row in doc.get("taxes", []):
+        if row.custom_tax_category not in SUMMARY_TAX_CATEGORIES:
+            manual_rows.append(row)
+            continue
+        existing.setdefault((row.custom_tax_category, row.account_head), []).append(row)
+
+    rows = []
+    for values in tax_summary:
+        matches = existing.get((values.get("custom_tax_category"), values.get("account_head")))
+        if matches:
+            row = matches.pop(0)
+            row.update(values)
+        else:
+            row = doc.append("taxes", values)
+        rows.append(row)
+
+    rows.extend(manual_rows)
+    doc.taxes = rows
+    for idx, row in enumerate(rows, 1):
+        row.idx = idx
+
+@instrumented
 def sales_invoice_on_update(doc, method=None):
-    
-        apply_item_level_tax_summary(doc)
-        doc.calculate_taxes_and_totals()
-    #doc.save(ignore_permissions=True)  # Optional: if needed to persist changes
+    update_invoice_tax_summary(doc)
 
 
+@instrumented
 def purchase_invoice_on_update(doc, method=None):
-        
+    update_invoice_tax_summary(doc)
+
+
+def update_invoice_tax_summary(doc):
+    """
+    Rebuild the tax summary of an invoice being saved, unless no header or
+    item field it depends on changed since it was last built. Tax rows edited
+    by hand, such as rounding adjustments to match a supplier's invoice, are
+    kept until then; rows the summary does not build are always kept.
+
+    Rows the form has not rated, as on invoices created through Data Import
+    or the API, are rated with the rate engine first; rows rated in the
+    form, including manually entered ST, are kept as they are.
+    """
+    if doc.get("custom_purchase_invoice_type") == "Import":
+        return
+
+    unrated = [item for item in doc.get("items", []) if not is_rated(item)]
+    if unrated:
+        rate_items(doc, unrated, get_currency_precision())
+
+    if not doc.is_new() and doc.get("custom_tax_fingerprint") == get_tax_fingerprint(doc):
+        return
+
     apply_item_level_tax_summary(doc)
-    doc.calculate_taxes_and_totals()
-    #doc.save(ignore_permissions=True)
+    with span("erpnext.calculate_taxes_and_totals", doc.doctype, doc):
+        doc.calculate_taxes_and_totals()
+    doc.custom_tax_fingerprint = get_tax_fingerprint(doc)
+
+
+def get_tax_fingerprint(doc):
+    """
+    Hash of the header and item fields in TAX_FINGERPRINT_*_FIELDS. The tax
+    rows are left out, so editing them by hand does not rebuild the summary.
+    Numbers are normalised so values read from the database and from the form
+    hash the same.
+    """
+    def normalise(value):
+        return flt(value, 6) if isinstance(value, (int, float)) else (value or "")
+
+    values = [normalise(doc.get(field)) for field in TAX_FINGERPRINT_HEADER_FIELDS]
+    for item in doc.get("items", []):
+        values.append([normalise(item.get(field)) for field in TAX_FINGERPRINT_ITEM_FIELDS])
+
+    return hashlib.sha1(frappe.as_json(values, indent=None).encode()).hexdigest()
 
 
+@instrumented
 def payment_entry_build_gl_map(doc, method=None):
     """
     Override for Payment Entry build_gl_map function.
@@ -157,7 +431,6 @@ def payment_entry_build_gl_map(doc, method=None):
     3. Tax amounts are only accounted in tax accounts
     """
     import erpnext
-    from erpnext.accounts.doctype.payment_entry.payment_entry import get_account_currency
     from frappe.utils import flt
     
     if doc.payment_type in ("Receive", "Pay") and not doc.get("party_account_field"):
@@ -215,8 +488,10 @@ def payment_entry_build_gl_map(doc, method=None):
     doc.add_deductions_gl_entries(gl_entries)
     
     # Custom tax GL entries - only tax account entries, NO counter entries
+    # Currencies of all tax accounts are resolved in one lookup
+    account_currencies = get_account_currencies([d.account_head for d in doc.get("taxes")])
     for d in doc.get("taxes"):
-        account_currency = get_account_currency(d.account_head)
+        account_currency = account_currencies[d.account_head]
         if account_currency != doc.company_currency:
             frappe.throw(frappe._("Currency for {0} must be {1}").format(d.account_head, doc.company_currency))
 
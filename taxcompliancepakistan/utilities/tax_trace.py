@@ -0,0 +1,136 @@
+import json
+import zlib
+
+import frappe
+from frappe.utils import now
+
+# Structured tracing of the tax computations. Trace records go to a bounded
+# redis list (newest first), never to the database, so tracing costs at most
+# one redis round trip per record and nothing at all when filtered out.
+#
+# Configure per site in site_config.json, e.g.
+#   "tax_trace": {
+#       "level": "warning",            # default level for everything
+#       "sample_rate": 0.1,            # share of documents traced below warning
+#       "buffer_size": 5000,           # records kept in the ring buffer
+#       "companies": {"My Company": "debug"},
+#       "parties": {"SUP-0001": "debug"}
+#   }
+# Company and party entries override the level and are never sampled, so
+# full detail can be switched on for one taxpayer without flooding the buffer.
+
+TRACE_KEY = "taxcompliancepakistan:tax_trace"
+
+LEVELS = {"debug": 10, "info": 20, "warning": 30, "error": 40}
+DEFAULT_LEVEL = "warning"
+DEFAULT_BUFFER_SIZE = 1000
+
+
+def get_trace_config():
+    return frappe.conf.get("tax_trace") or {}
+
+
+def is_traced(level, doc=None, company=None, party=None):
+    """
+    Whether a record of `level` about `doc` (or the given company and party)
+    passes the configured level and sampling.
+    """
+    config = get_trace_config()
+    company = company or getattr(doc, "company", None)
+    party = party or getattr(doc, "party", None)
+
+    override = (config.get("parties") or {}).get(party) or (config.get("companies") or {}).get(company)
+    if override:
+        return LEVELS[level] >= LEVELS.get(override, LEVELS[DEFAULT_LEVEL])
+
+    if LEVELS[level] < LEVELS.get(config.get("level"), LEVELS[DEFAULT_LEVEL]):
+        return False
+
+    # Sample whole documents rather than single records, so a sampled
+    # document's trace is complete
+    if LEVELS[level] < LEVELS["warning"]:
+        sample_rate = float(config.get("sample_rate", 1))
+        return zlib.crc32(get_sample_key(doc).encode()) % 10000 < sample_rate * 10000
+
+    return True
+
+
+def get_sample_key(doc=None):
+    """
+    Key a record is sampled on: the document name, or a random key kept on
+    an unsaved document (and through its insert), or one per request for
+    records without a document.
+    """
+    flags = getattr(doc, "flags", None)
+    if flags is not None and flags.get("tax_trace_key"):
+        return flags.tax_trace_key
+
+    name = getattr(doc, "name", None)
+    if name:
+        return name
+
+    if flags is not None:
+        flags.tax_trace_key = frappe.generate_hash()
+        return flags.tax_trace_key
+
+    if not getattr(frappe.local, "tax_trace_key", None):
+        frappe.local.tax_trace_key = frappe.generate_hash()
+    return frappe.local.tax_trace_key
+
+
+def trace(level, event, doc=None, company=None, party=None, **data):
+    """
+    Record a trace event, e.g.
+    trace("debug", "wht.reference", payment_entry, section=..., rate=...).
+    """
+    if not is_traced(level, doc, company, party):
+        return
+
+    record = {
+        "timestamp": now(),
+        "level": level,
+        "event": event,
+        "doctype": getattr(doc, "doctype", None),
+        "name": getattr(doc, "name", None),
+        "company": company or getattr(doc, "company", None),
+        "party": party or getattr(doc, "party", None),
+        "data": data,
+    }
+
+    cache = frappe.cache()
+    key = cache.make_key(TRACE_KEY)
+    buffer_size = int(get_trace_config().get("buffer_size") or DEFAULT_BUFFER_SIZE)
+    try:
+        pipe = cache.pipeline()
+        pipe.lpush(key, json.dumps(record, default=str))
+        pipe.ltrim(key, 0, buffer_size - 1)
+        pipe.execute()
+    except Exception:
+        # Tracing must never fail the document operation
+        pass
+
+
+@frappe.whitelist()
+def get_tax_traces(limit=100, level=None, company=None, party=None, event=None):
+    """Return the newest trace records, optionally filtered"""
+    frappe.only_for("System Manager")
+
+    cache = frappe.cache()
+    records = [json.loads(r) for r in cache.lrange(cache.make_key(TRACE_KEY), 0, -1)]
+
+    if level:
+        records = [r for r in records if LEVELS.get(r["level"], 0) >= LEVELS[level]]
+    if company:
+        records = [r for r in records if r["company"] == company]
+    if party:
+        records = [r for r in records if r["party"] == party]
+    if event:
+        records = [r for r in records if r["event"].startswith(event)]
+
+    return records[:int(limit)]
+
+
+@frappe.whitelist()
+def clear_tax_traces():
+    frappe.only_for("System Manager")
+    frappe.cache().delete_value(TRACE_KEY)
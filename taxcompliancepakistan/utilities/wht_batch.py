@@ -0,0 +1,111 @@
+import frappe
+from frappe.utils import cint, flt
+
+from taxcompliancepakistan.utilities.tax_cache import load_wht_exemption_indexes
+from taxcompliancepakistan.utilities.wht_overrides import calculate_withholding_tax
+
+
+@frappe.whitelist()
+def create_payment_entries(entries, submit=0):
+    """
+    Create many Payment Entries in one request and one transaction.
+
+    Suppliers and WHT exemptions are loaded in a few queries up front and WHT
+    sections come from the shared cache, so WHT is computed for every entry without
+    per-entry lookups. Each entry is inserted under its own savepoint; a
+    failing entry is rolled back and reported without affecting the rest.
+    """
+    frappe.has_permission("Payment Entry", "create", throw=True)
+    if cint(submit):
+        frappe.has_permission("Payment Entry", "submit", throw=True)
+
+    entries = frappe.parse_json(entries) or []
+    wht_context = get_wht_context(entries)
+
+    results = []
+    for idx, entry in enumerate(entries):
+        frappe.db.savepoint("wht_batch_entry")
+        try:
+            payment_entry = frappe.get_doc(dict(entry, doctype="Payment Entry"))
+            calculate_withholding_tax(payment_entry, wht_context=wht_context)
+            payment_entry.flags.wht_precomputed = True
+            payment_entry.insert()
+            if cint(submit):
+                payment_entry.submit()
+
+            results.append({
+                "idx": idx,
+                "status": "Success",
+                "name": payment_entry.name,
+                "wht_amount": sum(flt(ref.custom_wht_amount) for ref in payment_entry.references),
+                "total_taxes_and_charges": payment_entry.total_taxes_and_charges,
+            })
+        except Exception as e:
+            frappe.db.rollback(save_point="wht_batch_entry")
+            frappe.clear_messages()
+            results.append({"idx": idx, "status": "Failed", "error": str(e)})
+
+    return results
+
+
+@frappe.whitelist()
+def submit_payment_entries(names):
+    """
+    Submit many draft Payment Entries in one request and one transaction.
+
+    Each entry submits through the standard ERPNext path under its own
+    savepoint; a failing entry is rolled back and reported without affecting
+    the rest. GL Entries are still inserted one by one by ERPNext; only the
+    account currency lookups of payment_entry_build_gl_map are batched.
+    """
+    frappe.has_permission("Payment Entry", "submit", throw=True)
+
+    names = frappe.parse_json(names) or []
+
+    results = []
+    for idx, name in enumerate(names):
+        frappe.db.savepoint("wht_batch_entry")
+        try:
+            payment_entry = frappe.get_doc("Payment Entry", name)
+            payment_entry.submit()
+            results.append({"idx": idx, "status": "Success", "name": name})
+        except Exception as e:
+            frappe.db.rollback(save_point="wht_batch_entry")
+            frappe.clear_messages()
+            results.append({"idx": idx, "status": "Failed", "name": name, "error": str(e)})
+
+    return results
+
+
+def get_wht_context(entries):
+    """
+    Preload the per-party data calculate_withholding_tax needs for a batch.
+    """
+    parties_by_type = {}
+    for e in entries:
+        if e.get("party_type") in ("Supplier", "Customer") and e.get("party"):
+            parties_by_type.setdefault(e["party_type"], set()).add(e["party"])
+
+    # Default WHT section and tax identifiers (for the ATL status), one query per party type
+    default_wht_templates = {}
+    party_identifiers = {}
+    for party_type, parties in parties_by_type.items():
+        fields = ["name", "tax_id", "custom_cnic_no"]
+        if party_type == "Supplier":
+            fields.append("custom_default_wht_template")
+        for party in frappe.get_all(party_type, filters={"name": ["in", list(parties)]}, fields=fields):
+            party_identifiers[(party_type, party.name)] = (party.tax_id, party.custom_cnic_no)
+            if party_type == "Supplier":
+                default_wht_templates[party.name] = party.custom_default_wht_template
+
+    # Exemption certificates of every party in the batch, one query per party type
+    exemption_indexes = {}
+    for party_type, parties in parties_by_type.items():
+        for party, index in load_wht_exemption_indexes(party_type, parties).items():
+            exemption_indexes[(party_type, party)] = index
+
+    return frappe._dict(
+        default_wht_templates=default_wht_templates,
+        exemption_indexes=exemption_indexes,
+        party_identifiers=party_identifiers,
+    )
@@ -2,24 +2,38 @@ import frappe
 from frappe.model.document import Document
 from collections import defaultdict
 
-def calculate_withholding_tax(payment_entry):
+from taxcompliancepakistan.utilities.atl_index import get_current_snapshot_version, get_party_fbr_status
+from taxcompliancepakistan.utilities.instrumentation import instrumented, span
+from taxcompliancepakistan.utilities.tax_cache import get_wht_exemption_index, get_wht_sections, is_wht_exempt
+from taxcompliancepakistan.utilities.tax_trace import trace
+
+@instrumented
+def calculate_withholding_tax(payment_entry, wht_context=None):
+    """
+    Compute WHT on each invoice reference of a Payment Entry and rebuild its
+    `taxes` rows. `wht_context` carries lookups preloaded for a batch of
+    entries (see wht_batch.create_payment_entries) so they are not repeated.
+    """
 
     # Initialize default_wht_template to None
     default_wht_template = None
-    print('started calculati0on')
     # Only apply WHT logic for Supplier/Customer payments. Skip for Employee and others.
     if getattr(payment_entry, "party_type", None) not in ("Supplier", "Customer"):
-        print('skipped due to attribute')
+        trace("debug", "wht.skipped", payment_entry, party_type=getattr(payment_entry, "party_type", None))
         return
 
     if payment_entry.party_type == "Supplier":
-        supplier = frappe.get_doc("Supplier", payment_entry.party)
-        default_wht_template = supplier.get("custom_default_wht_template")
-        print("Skipped at supplier")
+        if wht_context:
+            default_wht_template = wht_context.default_wht_templates.get(payment_entry.party)
+        else:
+            default_wht_template = frappe.get_cached_value("Supplier", payment_entry.party, "custom_default_wht_template")
+        trace("debug", "wht.default_section", payment_entry, section=default_wht_template)
+
+    if payment_entry.meta.has_field("custom_party_fbr_status"):
+        resolve_party_fbr_status(payment_entry, wht_context)
 
     # Populate missing WHT section in references using default template (if any)
     for ref in payment_entry.references:
-        print("looping on references")
         if (
             ref.reference_doctype == "Purchase Invoice"
             and not ref.custom_wht_section
@@ -28,6 +42,10 @@ def calculate_withholding_tax(payment_entry):
             ref.custom_wht_section = default_wht_template
 
     wht_sections = get_wht_sections_map(payment_entry)
+    if wht_context:
+        exemption_index = wht_context.exemption_indexes.get((payment_entry.party_type, payment_entry.party), {})
+    else:
+        exemption_index = get_wht_exemption_index(payment_entry.party_type, payment_entry.party)
     wht_summary = defaultdict(float)
 
     for ref in payment_entry.references:
@@ -40,6 +58,17 @@ def calculate_withholding_tax(payment_entry):
 
         section = wht_sections.get(section_name)
         if not section:
+            trace("warning", "wht.unknown_section", payment_entry, reference=ref.reference_name, section=section_name)
+            continue
+
+        # Parties holding a valid exemption certificate for the section pay no WHT
+        if is_wht_exempt(
+            payment_entry.party_type, payment_entry.party, section_name, payment_entry.company,
+            payment_entry.posting_date, exemption_index=exemption_index
+        ):
+            ref.custom_wht_amount = 0
+            ref.custom_wht_rate = 0
+            trace("debug", "wht.exempt", payment_entry, reference=ref.reference_name, section=section_name)
             continue
 
         # Guard against missing custom field on variants like EmployeePaymentEntry
@@ -47,6 +76,8 @@ def calculate_withholding_tax(payment_entry):
         
         rate = get_applicable_rate(section, fbr_status)
         if not rate:
+            trace("debug", "wht.no_rate", payment_entry, reference=ref.reference_name, section=section_name,
+                  fbr_status=fbr_status)
             continue
 
         wht_amount = ref.allocated_amount * (rate / 100.0)
@@ -54,9 +85,38 @@ def calculate_withholding_tax(payment_entry):
         ref.custom_wht_rate = rate or 0
 
         wht_summary[section_name] += wht_amount
+        trace("debug", "wht.reference", payment_entry, reference=ref.reference_name, section=section_name,
+              allocated_amount=ref.allocated_amount, rate=rate, wht_amount=wht_amount)
 
     update_advance_taxes_and_charges(payment_entry, wht_summary, wht_sections, payment_entry.payment_type)
 
+def resolve_party_fbr_status(payment_entry, wht_context=None):
+    """
+    Set the party's FBR status from the Active Taxpayer List when it is not
+    set, or when it was set from an older ATL snapshot. custom_fbr_status_source
+    holds the snapshot version of a status set here; a status the user or
+    caller set has no source and is kept.
+    """
+    source = payment_entry.get("custom_fbr_status_source")
+
+    # A status changed by hand after it was set from the ATL is the user's
+    if source and payment_entry.get_doc_before_save() and payment_entry.has_value_changed("custom_party_fbr_status"):
+        payment_entry.custom_fbr_status_source = source = None
+
+    if payment_entry.custom_party_fbr_status and not source:
+        return
+
+    version = get_current_snapshot_version()
+    if not version or version == source:
+        return
+
+    identifiers = wht_context.party_identifiers.get((payment_entry.party_type, payment_entry.party)) if wht_context else None
+    fbr_status = get_party_fbr_status(payment_entry.party_type, payment_entry.party, identifiers)
+    if fbr_status:
+        payment_entry.custom_party_fbr_status = fbr_status
+        payment_entry.custom_fbr_status_source = version
+        trace("debug", "wht.fbr_status", payment_entry, fbr_status=fbr_status, snapshot=version)
+
 def get_wht_sections_map(payment_entry):
     section_names = {ref.custom_wht_section for ref in payment_entry.references
                      if ref.custom_wht_section and ref.reference_doctype in ("Purchase Invoice", "Sales Invoice")}
@@ -64,13 +124,8 @@ def get_wht_sections_map(payment_entry):
     if not section_names:
         return {}
 
-    sections = frappe.get_all(
-        "WHT Sections",
-        filters={"name": ["in", list(section_names)]},
-        fields=["name", "account_head", "tax_receivable_account_head", "active_tax_payer_rate", "inactive_tax_payer_rate"]
-    )
-
-    return {section.name: section for section in sections}
+    wht_sections = get_wht_sections()
+    return {name: wht_sections[name] for name in section_names if name in wht_sections}
 
 def get_applicable_rate(section, fbr_status):
     if fbr_status == "Active":
@@ -81,7 +136,7 @@ def get_applicable_rate(section, fbr_status):
 
 def update_advance_taxes_and_charges(doc, wht_summary, sections_map, payment_type):
     doc.set("taxes", [])  # Clear existing rows if any
-    frappe.log_error(message=f"{wht_summary} ",title="WHT")
+    trace("info", "wht.summary", doc, summary=dict(wht_summary))
     for section_name, total_wht in wht_summary.items():
         section = sections_map.get(section_name)
         if not section:
@@ -99,10 +154,16 @@ def update_advance_taxes_and_charges(doc, wht_summary, sections_map, payment_typ
 
 ## Hooks that will be executed when a payment entry is saved
 
+@instrumented
 def on_payment_entry_update(doc, method):
     if doc.doctype != "Payment Entry":
         return
 
+    # WHT was already computed before insert by the batch API
+    if doc.flags.get("wht_precomputed"):
+        return
+
     calculate_withholding_tax(doc)
-    doc.calculate_taxes()
+    with span("erpnext.calculate_taxes", doc.doctype, doc):
+        doc.calculate_taxes()
     
\ No newline at end of file
@@ -0,0 +1,296 @@
+import csv
+import os
+
+import frappe
+from frappe import _
+from frappe.model.naming import set_new_name
+from frappe.utils import cint, flt, now, now_datetime
+
+from taxcompliancepakistan.utilities.tax_cache import get_wht_sections
+from taxcompliancepakistan.utilities.wht_batch import get_wht_context
+from taxcompliancepakistan.utilities.wht_overrides import calculate_withholding_tax
+
+# Re-rating of draft Payment Entries after the rates of WHT Sections change.
+# Affected drafts are found through the custom_wht_section index, loaded a
+# chunk at a time with one query per table, re-rated in memory with
+# calculate_withholding_tax and written back with bulk updates, without
+# saving each document. A dry run only writes the diff report.
+
+CHUNK_SIZE = 500
+
+DIFF_COLUMNS = (
+    "payment_entry", "party", "posting_date", "reference_name", "wht_section",
+    "old_rate", "new_rate", "old_wht_amount", "new_wht_amount",
+    "old_total_taxes_and_charges", "new_total_taxes_and_charges",
+)
+
+# Child tables of Payment Entry that are loaded for the in-memory documents
+CHILD_TABLES = (
+    ("references", "Payment Entry Reference"),
+    ("taxes", "Advance Taxes and Charges"),
+    ("deductions", "Payment Entry Deduction"),
+)
+
+
+@frappe.whitelist()
+def enqueue_wht_rerating(sections, dry_run=1):
+    """
+    Queue the re-rating of the draft Payment Entries of the given WHT
+    Sections, from each section's effective_from date. The user is sent the
+    diff report once it is ready.
+    """
+    frappe.only_for(("Accounts Manager", "System Manager"))
+
+    sections = frappe.parse_json(sections)
+    if isinstance(sections, str):
+        sections = [sections]
+
+    job = frappe.enqueue(
+        "taxcompliancepakistan.utilities.wht_rerating.rerate_wht_job",
+        queue="long",
+        timeout=4 * 60 * 60,
+        sections=sections,
+        dry_run=cint(dry_run),
+        user=frappe.session.user,
+    )
+    return job.id if job else None
+
+
+def rerate_wht_job(sections, dry_run=1, user=None):
+    summary = rerate_wht(sections, dry_run)
+
+    if user:
+        frappe.publish_realtime(
+            "msgprint",
+            _("WHT re-rating {0}: {1} of {2} draft Payment Entries change. Diff: {3}").format(
+                _("dry run") if dry_run else _("done"),
+                summary["changed"],
+                summary["checked"],
+                '<a href="{0}">{1}</a>'.format(summary["file_url"], summary["file_name"]),
+            ),
+            user=user,
+        )
+    return summary
+
+
+def rerate_wht(sections, dry_run=1, chunk_size=CHUNK_SIZE):
+    """
+    Re-rate the affected drafts chunk by chunk and write a CSV diff report.
+    Returns counts and the report file. Nothing but the report is written
+    when `dry_run` is set.
+    """
+    wht_sections = get_wht_sections()
+    unknown = [section for section in sections if section not in wht_sections]
+    if unknown:
+        frappe.throw(_("Unknown WHT Sections: {0}").format(", ".join(unknown)))
+
+    names = get_affected_payment_entries({section: wht_sections[section].effective_from for section in sections})
+
+    file_name = "wht_rerating-{0}.csv".format(now_datetime().strftime("%Y%m%d-%H%M%S"))
+    file_path = frappe.get_site_path("private", "files", file_name)
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+
+    changed = 0
+    with open(file_path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(DIFF_COLUMNS)
+
+        for start in range(0, len(names), chunk_size):
+            chunk = names[start:start + chunk_size]
+            if not dry_run:
+                # Keep users from saving or submitting the drafts between
+                # re-rating and write back; entries submitted since they were
+                # found are left out
+                chunk = frappe.db.sql(
+                    "SELECT name FROM `tabPayment Entry` WHERE name IN %s AND docstatus = 0 FOR UPDATE",
+                    (tuple(chunk),),
+                    pluck=True,
+                )
+                if not chunk:
+                    continue
+
+            updated_docs = []
+            changed_headers = {}
+            changed_references = {}
+            for doc, diff, changed_header, changed_reference in rerate_payment_entries(chunk):
+                writer.writerows(diff)
+                updated_docs.append(doc)
+                changed_headers[doc.name] = changed_header
+                changed_references.update(changed_reference)
+
+            changed += len(updated_docs)
+            if not dry_run:
+                write_back(updated_docs, changed_headers, changed_references)
+                frappe.db.commit()
+
+    file_doc = frappe.get_doc({
+        "doctype": "File",
+        "file_name": file_name,
+        "file_url": "/private/files/{0}".format(file_name),
+        "is_private": 1,
+    })
+    file_doc.insert(ignore_permissions=True)
+    frappe.db.commit()
+
+    return {
+        "checked": len(names),
+        "changed": changed,
+        "dry_run": cint(dry_run),
+        "file_name": file_doc.file_name,
+        "file_url": file_doc.file_url,
+    }
+
+
+def get_affected_payment_entries(effective_from_by_section):
+    """
+    Names of draft Payment Entries with a reference under one of the
+    sections, posted on or after that section's effective_from.
+    """
+    names = set()
+    for section, effective_from in effective_from_by_section.items():
+        names.update(frappe.db.sql(
+            """
+            SELECT DISTINCT pe.name
+            FROM `tabPayment Entry Reference` per
+            INNER JOIN `tabPayment Entry` pe ON pe.name = per.parent
+            WHERE per.custom_wht_section = %(wht_section)s AND per.parenttype = 'Payment Entry'
+                AND pe.docstatus = 0 AND pe.posting_date >= %(effective_from)s
+            """,
+            {"wht_section": section, "effective_from": effective_from or "1900-01-01"},
+            pluck=True,
+        ))
+    return sorted(names)
+
+
+def load_payment_entries(names):
+    """
+    Draft Payment Entry documents of `names`, built from one query per table
+    instead of one frappe.get_doc per entry.
+    """
+    rows = {
+        row.name: row
+        for row in frappe.get_all("Payment Entry", filters={"name": ["in", names], "docstatus": 0}, fields=["*"])
+    }
+
+    for fieldname, child_doctype in CHILD_TABLES:
+        for row in rows.values():
+            row[fieldname] = []
+        for child in frappe.get_all(
+            child_doctype,
+            filters={"parent": ["in", names], "parenttype": "Payment Entry", "parentfield": fieldname},
+            fields=["*"],
+            order_by="idx asc",
+        ):
+            rows[child.parent][fieldname].append(child)
+
+    return [frappe.get_doc(dict(rows[name], doctype="Payment Entry")) for name in names if name in rows]
+
+
+def rerate_payment_entries(names):
+    """
+    Yield (doc, diff rows, changed header fields, changed reference fields)
+    of every entry of `names` whose WHT changes. The documents are updated
+    in memory only.
+    """
+    docs = load_payment_entries(names)
+    wht_context = get_wht_context([{"party_type": doc.party_type, "party": doc.party} for doc in docs])
+
+    for doc in docs:
+        header_before = get_field_values(doc)
+        references_before = {ref.name: get_field_values(ref) for ref in doc.references}
+        old_total = flt(doc.total_taxes_and_charges)
+
+        # Same as the on_payment_entry_update hook, without saving. The
+        # amounts validate derives from the taxes are set as a save would.
+        calculate_withholding_tax(doc, wht_context=wht_context)
+        doc.calculate_taxes()
+        doc.set_unallocated_amount()
+        doc.set_difference_amount()
+
+        changed_header = get_changed_fields(header_before, get_field_values(doc))
+        changed_references = {
+            ref.name: changed
+            for ref in doc.references
+            if (changed := get_changed_fields(references_before[ref.name], get_field_values(ref)))
+        }
+        if not (changed_header or changed_references):
+            continue
+
+        diff = [
+            (
+                doc.name, doc.party, doc.posting_date, ref.reference_name, ref.custom_wht_section,
+                flt(references_before[ref.name].get("custom_wht_rate")), flt(ref.custom_wht_rate),
+                flt(references_before[ref.name].get("custom_wht_amount")), flt(ref.custom_wht_amount),
+                old_total, flt(doc.total_taxes_and_charges),
+            )
+            for ref in doc.references
+            if ref.name in changed_references
+        ]
+        if not diff:
+            # Only header amounts (or the FBR status) changed
+            diff = [(
+                doc.name, doc.party, doc.posting_date, "", "", "", "", "", "",
+                old_total, flt(doc.total_taxes_and_charges),
+            )]
+
+        yield doc, diff, changed_header, changed_references
+
+
+def get_field_values(doc):
+    """Column values of a document or child row, without timestamps"""
+    values = doc.get_valid_dict(convert_dates_to_str=True)
+    for field in ("modified", "modified_by", "creation", "owner"):
+        values.pop(field, None)
+    return values
+
+
+def get_changed_fields(before, after):
+    return {field for field, value in after.items() if before.get(field) != value}
+
+
+def write_back(docs, changed_headers, changed_references):
+    """
+    Write back with bulk updates every header and reference field the
+    re-rating changed, and replace the taxes rows with the rebuilt ones.
+    """
+    if not docs:
+        return
+
+    timestamp = now()
+
+    # bulk_update sets the same columns on every row, so each row carries
+    # its current value of every column changed on any row
+    reference_fields = set().union(*changed_references.values()) if changed_references else set()
+    if reference_fields:
+        frappe.db.bulk_update(
+            "Payment Entry Reference",
+            {
+                ref.name: {field: ref.get(field) for field in reference_fields}
+                for doc in docs
+                for ref in doc.references
+                if ref.name in changed_references
+            },
+            update_modified=False,
+        )
+
+    header_fields = set().union(*changed_headers.values()) if changed_headers else set()
+    frappe.db.bulk_update(
+        "Payment Entry",
+        {doc.name: {field: doc.get(field) for field in header_fields} for doc in docs},
+        modified=timestamp,
+        modified_by=frappe.session.user,
+    )
+
+    names = [doc.name for doc in docs]
+    frappe.db.delete("Advance Taxes and Charges", {"parent": ["in", names], "parenttype": "Payment Entry"})
+
+    rows = []
+    for doc in docs:
+        for tax in doc.taxes:
+            set_new_name(tax)
+            tax.owner = tax.modified_by = frappe.session.user
+            tax.creation = tax.modified = timestamp
+            rows.append(tax.get_valid_dict(convert_dates_to_str=True))
+    if rows:
+        fields = list(rows[0])
+        frappe.db.bulk_insert("Advance Taxes and Charges", fields, [[row.get(field) for field in fields] for row in rows])